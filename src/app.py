@@ -1,20 +1,42 @@
+import time
+# 以 --startup-time 啟動時，從這裡開始計算啟動耗時
+_STARTED_AT = time.perf_counter()
+import sys
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import threading
 import queue
 import json
 import os
+import sqlite3
 from datetime import datetime
+from typing import Optional
 
 # 匯入我們自己建立的模組
-from ui import AppUI, ApiKeyWindow, PersonaManagerWindow, PersonaEditorWindow, StyleManagerWindow, StyleEditorWindow, HistoryManagerWindow
+from ui import AppUI, ApiKeyWindow, PersonaManagerWindow, PersonaEditorWindow, StyleManagerWindow, StyleEditorWindow, HistoryManagerWindow, PickerWindow
 import ollama_client
+import model_catalog
 import gemini_client
 import persona_manager
 import style_manager
 import output_formatter
+import history_db
+from debate_runner import DebateRunner, apply_client_config
+from cancellation import CancelToken
+
+_IMPORTED_AT = time.perf_counter()
+# 啟動時不應載入的大型SDK；--startup-time 會回報其中哪些被提早匯入
+HEAVY_MODULES = ("google.generativeai", "openai", "docx", "openpyxl")
 
 CONFIG_FILE = "config.json"
+# 下拉選單中最多列出的角色/風格數量，其餘透過「搜尋…」視窗選擇
+COMBO_VALUES_LIMIT = 200
+# 收到佇列喚醒後等待多久才處理 (約一個畫面)，這段時間內的訊息合併成一次更新
+FRAME_INTERVAL_MS = 16
+# 歷史紀錄搜尋框停止輸入多久後才開始搜尋 (毫秒)
+HISTORY_SEARCH_DELAY_MS = 250
+# 歷史紀錄列表中顯示的對話狀態
+HISTORY_STATUS_LABELS = {"running": "未完成", "finished": "完成", "stopped": "已終止", "failed": "失敗", "imported": "匯入"}
 APP_VERSION = "1.44"
 
 class MainApp:
@@ -42,17 +64,30 @@ class MainApp:
 
         self.ui = AppUI(root, commands=commands, version=APP_VERSION)
         self.queue = queue.Queue()
+        # 佇列中是否已有尚未處理的喚醒事件，以及已排定的處理工作
+        self._wake_lock = threading.Lock()
+        self._wake_pending = False
+        self._flush_job = None
+        self.root.bind("<<QueueUpdated>>", self.on_queue_updated)
         self.conversation_thread = None
-        self.stop_event = threading.Event()
+        self.stop_event = CancelToken()
         self.structured_log = []
-        self.personas = []
-        self.styles = []
+        # 正在檢視的歷史紀錄編號；檢視時 structured_log 為空，儲存時才從資料庫讀取
+        self.viewed_session_id = None
+        # 以名稱為索引的角色與風格，選取時不需逐一比對或讀取檔案
+        self.persona_store = persona_manager.get_store()
+        self.style_store = style_manager.get_store()
+        # 搜尋索引在背景建立，第一次打開搜尋視窗時通常已經可用
+        self.persona_store.prepare_search()
+        self.style_store.prepare_search()
         self.gemini_api_key = ""
+        self.config = {}
 
         self.load_config()
         self.bind_events()
         self.initialize_app()
-        self.process_queue()
+        # 處理主迴圈開始前背景執行緒已送出的訊息
+        self.root.after_idle(self.process_queue)
 
     def bind_events(self):
         """集中綁定所有UI事件。"""
@@ -64,6 +99,21 @@ class MainApp:
         self.ui.persona1_combo.bind("<<ComboboxSelected>>", self.on_persona1_select)
         self.ui.persona2_combo.bind("<<ComboboxSelected>>", self.on_persona2_select)
         self.ui.style_combo.bind("<<ComboboxSelected>>", self.on_style_select)
+        self.ui.model1_combo.bind("<<ComboboxSelected>>", lambda e: self.on_model_select(1))
+        self.ui.model2_combo.bind("<<ComboboxSelected>>", lambda e: self.on_model_select(2))
+        self.ui.persona1_search_button.config(command=lambda: self.open_picker(
+            "搜尋角色", self.persona_store, self.ui.persona1_combo, self.on_persona1_select))
+        self.ui.persona2_search_button.config(command=lambda: self.open_picker(
+            "搜尋角色", self.persona_store, self.ui.persona2_combo, self.on_persona2_select))
+        self.ui.style_search_button.config(command=lambda: self.open_picker(
+            "搜尋風格", self.style_store, self.ui.style_combo, self.on_style_select))
+
+    def open_picker(self, title, store, combobox, on_select):
+        """打開搜尋視窗；選擇的項目會填入下拉選單 (即使不在選單列出的範圍內) 並觸發選擇事件。"""
+        def choose(name):
+            combobox.set(name)
+            on_select()
+        PickerWindow(self.root, title, store.search, choose)
 
     def load_config(self):
         """從設定檔載入設定，例如API金鑰。"""
@@ -71,16 +121,29 @@ class MainApp:
             try:
                 with open(CONFIG_FILE, 'r') as f:
                     config = json.load(f)
+                    self.config = config
                     self.gemini_api_key = config.get("gemini_api_key", "")
-                    if self.gemini_api_key:
-                        gemini_client.configure_api_key(self.gemini_api_key)
+                    apply_client_config(config)
+                    try:
+                        self.ui.scrollback_turns = max(0, int(config.get("dialogue_scrollback_turns", self.ui.scrollback_turns)))
+                    except (TypeError, ValueError):
+                        print("dialogue_scrollback_turns 必須是整數，使用預設值。")
             except (json.JSONDecodeError, IOError): pass
+        if self.gemini_api_key:
+            # 金鑰驗證需要一次網路請求，在背景進行，結果顯示在狀態列
+            self.ui.set_status("Gemini API 金鑰驗證中...")
+            threading.Thread(target=self.validate_api_key_thread, daemon=True).start()
+
+    def validate_api_key_thread(self):
+        """(執行緒工作) 驗證已設定的Gemini金鑰並將結果放入佇列。"""
+        self.post(("key_status", 0, gemini_client.validate_api_key()))
 
     def save_config(self):
         """儲存設定到設定檔。"""
         try:
             with open(CONFIG_FILE, 'w') as f:
-                json.dump({"gemini_api_key": self.gemini_api_key}, f, indent=4)
+                self.config["gemini_api_key"] = self.gemini_api_key
+                json.dump(self.config, f, indent=4)
         except IOError as e:
             messagebox.showerror("儲存設定失敗", f"無法寫入設定檔 {CONFIG_FILE}: {e}")
 
@@ -92,18 +155,42 @@ class MainApp:
         api_window.save_button.config(command=lambda: self.save_api_key(api_window))
 
     def save_api_key(self, window: ApiKeyWindow):
-        """儲存API金鑰並關閉視窗。"""
+        """在背景驗證新的API金鑰，驗證期間停用儲存按鈕，結果由 finish_save_api_key() 處理。"""
         new_key = window.api_key_entry.get().strip()
         if new_key:
-            if gemini_client.configure_api_key(new_key):
-                self.gemini_api_key = new_key
-                self.save_config()
-                messagebox.showinfo("成功", "Gemini API 金鑰已儲存並驗證成功。")
+            window.save_button.config(state=tk.DISABLED)
+            threading.Thread(target=self.save_api_key_thread, args=(window, new_key), daemon=True).start()
+        else:
+            messagebox.showwarning("輸入錯誤", "API金鑰不能為空。", parent=window)
+
+    def save_api_key_thread(self, window: ApiKeyWindow, new_key: str):
+        """(執行緒工作) 驗證新的Gemini金鑰 (此時仍使用原本的金鑰)，將結果放入佇列。"""
+        valid = gemini_client.validate_api_key(new_key)
+        self.post(("key_saved", 0, (window, new_key, valid)))
+
+    def finish_save_api_key(self, window: ApiKeyWindow, new_key: str, valid: Optional[bool]):
+        """(主執行緒) 驗證通過時才改用並儲存新的金鑰，然後關閉視窗。"""
+        if valid:
+            self.show_key_status(valid)
+            gemini_client.configure_api_key(new_key, validate=False)
+            self.gemini_api_key = new_key
+            self.save_config()
+            messagebox.showinfo("成功", "Gemini API 金鑰已儲存並驗證成功。")
+            if window.winfo_exists():
                 window.destroy()
+        elif window.winfo_exists():
+            window.save_button.config(state=tk.NORMAL)
+            if valid is None:
+                messagebox.showerror("無法驗證", "目前無法連線到Gemini驗證金鑰，請稍後再試。", parent=window)
             else:
                 messagebox.showerror("驗證失敗", "此Gemini API 金鑰無效，請重新輸入。", parent=window)
+
+    def show_key_status(self, valid: Optional[bool]):
+        """在狀態列顯示Gemini金鑰的驗證結果；valid 為None表示暫時無法驗證。"""
+        if valid is None:
+            self.ui.set_status("暫時無法驗證Gemini API 金鑰 (網路或伺服器錯誤)。")
         else:
-            messagebox.showwarning("輸入錯誤", "API金鑰不能為空。", parent=window)
+            self.ui.set_status("Gemini API 金鑰有效。" if valid else "Gemini API 金鑰驗證失敗，請在「設定」中重新輸入。")
 
     # --- 角色管理 ---
     def open_persona_manager_window(self):
@@ -112,14 +199,13 @@ class MainApp:
         self.manager_window.add_button.config(command=self.add_persona)
         self.manager_window.edit_button.config(command=self.edit_persona)
         self.manager_window.delete_button.config(command=self.delete_persona)
+        self.manager_window.persona_picker.search = lambda query: self.persona_store.search(query, editable_only=True)
+        self.manager_window.persona_picker.bind_choose(lambda name: self.edit_persona())
         self.refresh_persona_manager_list()
 
     def refresh_persona_manager_list(self):
-        """刷新角色管理視窗中的列表。"""
-        self.manager_window.persona_listbox.delete(0, tk.END)
-        user_personas = [p for p in self.personas if not p.get("is_default")]
-        for p in user_personas:
-            self.manager_window.persona_listbox.insert(tk.END, p["name"])
+        """刷新角色管理視窗中的列表 (保留目前的搜尋條件)。"""
+        self.manager_window.persona_picker.refresh()
 
     def add_persona(self):
         """打開新增角色視窗。"""
@@ -133,55 +219,46 @@ class MainApp:
         if not name or not prompt:
             messagebox.showwarning("輸入錯誤", "角色名稱和提示詞不能為空。", parent=window)
             return
-        if any(p["name"] == name for p in self.personas):
+        if not self.persona_store.add({"name": name, "prompt": prompt, "is_default": False}):
             messagebox.showwarning("名稱重複", f"名為「{name}」的角色已存在。", parent=window)
             return
-        new_persona = {"name": name, "prompt": prompt, "is_default": False}
-        self.personas.append(new_persona)
-        persona_manager.save_user_personas(self.personas)
         self.refresh_persona_manager_list()
         self.refresh_main_persona_comboboxes()
         window.destroy()
 
     def edit_persona(self):
         """打開編輯角色視窗。"""
-        selected_indices = self.manager_window.persona_listbox.curselection()
-        if not selected_indices:
+        selected_name = self.manager_window.persona_picker.selected()
+        if selected_name is None:
             messagebox.showwarning("未選擇", "請先從列表中選擇一個要編輯的角色。")
             return
-        selected_name = self.manager_window.persona_listbox.get(selected_indices[0])
-        persona_to_edit = next((p for p in self.personas if p["name"] == selected_name), None)
+        persona_to_edit = self.persona_store.get(selected_name)
         if persona_to_edit:
             editor_window = PersonaEditorWindow(self.manager_window, persona=persona_to_edit)
             editor_window.save_button.config(command=lambda: self.save_edited_persona(editor_window, persona_to_edit))
 
-    def save_edited_persona(self, window: PersonaEditorWindow, old_persona: dict):
+    def save_edited_persona(self, window: PersonaEditorWindow, old_persona):
         """儲存被編輯後的角色資料，並刷新所有相關UI。"""
         new_name = window.name_entry.get().strip()
         new_prompt = window.prompt_text.get("1.0", tk.END).strip()
         if not new_name or not new_prompt:
             messagebox.showwarning("輸入錯誤", "角色名稱和提示詞不能為空。", parent=window)
             return
-        if new_name != old_persona["name"] and any(p["name"] == new_name for p in self.personas):
+        if not self.persona_store.update(old_persona["name"], {"name": new_name, "prompt": new_prompt, "is_default": False}):
             messagebox.showwarning("名稱重複", f"名為「{new_name}」的角色已存在。", parent=window)
             return
-        old_persona["name"] = new_name
-        old_persona["prompt"] = new_prompt
-        persona_manager.save_user_personas(self.personas)
         self.refresh_persona_manager_list()
         self.refresh_main_persona_comboboxes()
         window.destroy()
 
     def delete_persona(self):
         """刪除選定的角色，並刷新所有相關UI。"""
-        selected_indices = self.manager_window.persona_listbox.curselection()
-        if not selected_indices:
+        selected_name = self.manager_window.persona_picker.selected()
+        if selected_name is None:
             messagebox.showwarning("未選擇", "請先從列表中選擇一個要刪除的角色。")
             return
-        selected_name = self.manager_window.persona_listbox.get(selected_indices[0])
         if messagebox.askyesno("確認刪除", f"您確定要刪除角色「{selected_name}」嗎？"):
-            self.personas = [p for p in self.personas if p["name"] != selected_name]
-            persona_manager.save_user_personas(self.personas)
+            self.persona_store.remove(selected_name)
             self.refresh_persona_manager_list()
             self.refresh_main_persona_comboboxes()
 
@@ -191,12 +268,12 @@ class MainApp:
         self.style_manager_win.add_button.config(command=self.add_style)
         self.style_manager_win.edit_button.config(command=self.edit_style)
         self.style_manager_win.delete_button.config(command=self.delete_style)
+        self.style_manager_win.style_picker.search = self.style_store.search
+        self.style_manager_win.style_picker.bind_choose(lambda name: self.edit_style())
         self.refresh_style_manager_list()
 
     def refresh_style_manager_list(self):
-        self.style_manager_win.style_listbox.delete(0, tk.END)
-        for s in self.styles:
-            self.style_manager_win.style_listbox.insert(tk.END, s["name"])
+        self.style_manager_win.style_picker.refresh()
 
     def add_style(self):
         editor = StyleEditorWindow(self.style_manager_win)
@@ -208,51 +285,43 @@ class MainApp:
         if not name or not prompt:
             messagebox.showwarning("輸入錯誤", "風格名稱和指令不能為空。", parent=window)
             return
-        if any(s["name"] == name for s in self.styles):
+        if not self.style_store.add({"name": name, "prompt": prompt}):
             messagebox.showwarning("名稱重複", f"名為「{name}」的風格已存在。", parent=window)
             return
-        self.styles.append({"name": name, "prompt": prompt})
-        style_manager.save_user_styles(self.styles)
         self.refresh_style_manager_list()
         self.refresh_main_style_combobox()
         window.destroy()
 
     def edit_style(self):
-        indices = self.style_manager_win.style_listbox.curselection()
-        if not indices:
+        name = self.style_manager_win.style_picker.selected()
+        if name is None:
             messagebox.showwarning("未選擇", "請先選擇一個要編輯的風格。")
             return
-        name = self.style_manager_win.style_listbox.get(indices[0])
-        style_to_edit = next((s for s in self.styles if s["name"] == name), None)
+        style_to_edit = self.style_store.get(name)
         if style_to_edit:
             editor = StyleEditorWindow(self.style_manager_win, style=style_to_edit)
             editor.save_button.config(command=lambda: self.save_edited_style(editor, style_to_edit))
 
-    def save_edited_style(self, window: StyleEditorWindow, old_style: dict):
+    def save_edited_style(self, window: StyleEditorWindow, old_style):
         new_name = window.name_entry.get().strip()
         new_prompt = window.prompt_text.get("1.0", tk.END).strip()
         if not new_name or not new_prompt:
             messagebox.showwarning("輸入錯誤", "風格名稱和指令不能為空。", parent=window)
             return
-        if new_name != old_style["name"] and any(s["name"] == new_name for s in self.styles):
+        if not self.style_store.update(old_style["name"], {"name": new_name, "prompt": new_prompt}):
             messagebox.showwarning("名稱重複", f"名為「{new_name}」的風格已存在。", parent=window)
             return
-        old_style["name"] = new_name
-        old_style["prompt"] = new_prompt
-        style_manager.save_user_styles(self.styles)
         self.refresh_style_manager_list()
         self.refresh_main_style_combobox()
         window.destroy()
 
     def delete_style(self):
-        indices = self.style_manager_win.style_listbox.curselection()
-        if not indices:
+        name = self.style_manager_win.style_picker.selected()
+        if name is None:
             messagebox.showwarning("未選擇", "請先選擇一個要刪除的風格。")
             return
-        name = self.style_manager_win.style_listbox.get(indices[0])
         if messagebox.askyesno("確認刪除", f"您確定要刪除風格「{name}」嗎？"):
-            self.styles = [s for s in self.styles if s["name"] != name]
-            style_manager.save_user_styles(self.styles)
+            self.style_store.remove(name)
             self.refresh_style_manager_list()
             self.refresh_main_style_combobox()
 
@@ -267,28 +336,29 @@ class MainApp:
     def refresh_main_persona_comboboxes(self):
         """刷新主視窗的角色下拉選單。"""
         self.ui.append_dialogue("正在載入角色列表...\n")
-        self.personas = persona_manager.get_all_personas()
-        if self.personas:
-            persona_names = [p["name"] for p in self.personas]
-            self.ui.persona1_combo['values'] = persona_names
-            self.ui.persona2_combo['values'] = persona_names
-            if len(self.personas) >= 2:
+        # 只有在角色檔案被外部修改過時才會重新解析
+        self.persona_store.reload_if_changed()
+        if len(self.persona_store):
+            persona_names = self.persona_store.names()
+            # 大型角色庫只將前面的部分放進下拉選單，完整的角色庫透過搜尋視窗選擇
+            self.ui.persona1_combo['values'] = persona_names[:COMBO_VALUES_LIMIT]
+            self.ui.persona2_combo['values'] = persona_names[:COMBO_VALUES_LIMIT]
+            if len(persona_names) >= 2:
                 self.ui.persona1_combo.current(0)
                 self.ui.persona2_combo.current(1)
-            elif len(self.personas) == 1:
+            elif len(persona_names) == 1:
                 self.ui.persona1_combo.current(0)
                 self.ui.persona2_combo.current(0)
             self.on_persona1_select()
             self.on_persona2_select()
-            self.ui.append_dialogue(f"成功載入 {len(self.personas)} 個角色。\n")
+            self.ui.append_dialogue(f"成功載入 {len(persona_names)} 個角色。\n")
         else:
             self.ui.append_dialogue("警告：找不到任何角色。\n")
 
     def refresh_main_style_combobox(self):
         """刷新主視窗的風格下拉選單。"""
-        self.styles = style_manager.load_user_styles()
-        style_names = [s["name"] for s in self.styles]
-        self.ui.style_combo['values'] = style_names
+        self.style_store.reload_if_changed()
+        self.ui.style_combo['values'] = self.style_store.names()[:COMBO_VALUES_LIMIT]
 
     def on_source_changed(self, var_name=None, index=None, mode=None):
         """當模型來源改變時，非同步更新對應的模型下拉列表。"""
@@ -331,9 +401,9 @@ class MainApp:
             self.update_combobox(ai_num, gemini_client.SUPPORTED_MODELS)
 
     def fetch_ollama_models_thread(self, ai_num):
-        """(執行緒工作) 獲取Ollama模型並放入佇列。"""
-        models = ollama_client.get_available_models()
-        self.queue.put(("update_models", ai_num, models))
+        """(執行緒工作) 獲取Ollama模型並放入佇列；兩方同時查詢或快取仍有效時只會送出一次請求。"""
+        models = model_catalog.get_models()
+        self.post(("update_models", ai_num, models))
 
     def update_combobox(self, ai_num, models):
         """(主執行緒) 更新指定的Combobox。"""
@@ -342,6 +412,20 @@ class MainApp:
         combobox.set('')
         combobox.current(0)
 
+    def on_model_select(self, ai_num):
+        """使用者選擇Ollama模型時，在背景預先載入該模型，讓第一回合不必等待冷啟動。"""
+        source = self.ui.source1_var.get() if ai_num == 1 else self.ui.source2_var.get()
+        model = self.ui.model1_combo.get() if ai_num == 1 else self.ui.model2_combo.get()
+        if source != "Ollama" or not model or model == "無可用模型":
+            return
+        threading.Thread(target=self.warm_up_model_thread, args=(ai_num, model), daemon=True).start()
+
+    def warm_up_model_thread(self, ai_num, model):
+        """(執行緒工作) 預載Ollama模型並將結果與模型資料放入佇列。"""
+        result = ollama_client.warm_up_model(model)
+        info = model_catalog.get_model_info(model)
+        self.post(("warmup_done", ai_num, (model, result, info)))
+
     def start_conversation_thread(self):
         """在一個新的執行緒中開始對話。"""
         try:
@@ -354,124 +438,143 @@ class MainApp:
                 return
             self.ui.clear_dialogue()
             self.ui.set_ui_state(is_running=True)
-            self.stop_event.clear()
-            self.conversation_thread = threading.Thread(target=self.run_conversation_logic, args=(settings,), daemon=True)
+            # 每場對話使用新的 CancelToken，避免上一場尚未結束的執行緒因旗標被清除而繼續進行
+            self.stop_event = CancelToken()
+            self.conversation_thread = threading.Thread(target=self.run_conversation_logic, args=(settings, self.stop_event), daemon=True)
             self.conversation_thread.start()
         except Exception as e:
             messagebox.showerror("未知錯誤", f"發生錯誤: {e}")
             self.ui.set_ui_state(is_running=False)
 
-    def run_conversation_logic(self, settings):
+    def run_conversation_logic(self, settings, stop_event):
         """實際執行對話的邏輯。這個函式在一個單獨的執行緒中運行。"""
-        self.structured_log = []
-        persona1_final_prompt = settings["persona1_prompt"]
-        persona2_final_prompt = settings["persona2_prompt"]
-        if settings["style_prompt"]:
-            style_directive = f"\n\n--- 對話風格指令 ---\n{settings['style_prompt']}"
-            persona1_final_prompt += style_directive
-            persona2_final_prompt += style_directive
-        history1 = [{"role": "system", "content": persona1_final_prompt}]
-        history2 = [{"role": "system", "content": persona2_final_prompt}]
-        header = (f"角色介紹\n"
-                  f"角色A：預設角色({settings['persona1_name']})\n"
-                  f"提示詞：\n{settings['persona1_prompt']}\n\n"
-                  f"角色B：預設角色({settings['persona2_name']})\n"
-                  f"提示詞：\n{settings['persona2_prompt']}\n")
-        if settings["style_prompt"]:
-            header += f"\n對話風格指令：\n{settings['style_prompt']}\n"
-        header += "==========================================\n"
-        self.queue_update(header)
-        self.structured_log.append({'speaker': 'System', 'content': header})
-        current_message = f"關於主題： '{settings['topic']}'\n請您針對此主題，開始進行第一回合的發言。"
-        for i in range(settings['turns'] * 2):
-            if self.stop_event.is_set():
-                self.queue_update("\n--- 對話被使用者提前終止 ---\n")
-                break
-            turn_number = (i // 2) + 1
-            if i % 2 == 0:
-                speaker_name = f"角色A：{settings['persona1_name']},模型：{settings['model1']}"
-                log_speaker_name = f"角色A：{settings['persona1_name']}"
-                self.queue_update(f"\n第{turn_number}回合對話 ({speaker_name}):\n")
-                history1.append({"role": "user", "content": current_message})
-                response = (ollama_client.generate_response(settings['model1'], history1)
-                            if settings['source1'] == 'Ollama'
-                            else gemini_client.generate_response(settings['model1'], persona1_final_prompt, history1))
-                if response is None:
-                    self.queue_update(f"無法從 {speaker_name} 獲取回應，對話終止。\n")
-                    break
-                current_message = response
-                self.queue_update(f"{current_message}\n")
-                self.structured_log.append({'speaker': log_speaker_name, 'content': current_message})
-                history1.append({"role": "assistant", "content": current_message})
-                history2.append({"role": "user", "content": current_message})
-            else:
-                speaker_name = f"角色B：{settings['persona2_name']},模型：{settings['model2']}"
-                log_speaker_name = f"角色B：{settings['persona2_name']}"
-                self.queue_update(f"\n第{turn_number}回合對話 ({speaker_name}):\n")
-                history2.append({"role": "user", "content": current_message})
-                response = (ollama_client.generate_response(settings['model2'], history2)
-                            if settings['source2'] == 'Ollama'
-                            else gemini_client.generate_response(settings['model2'], persona2_final_prompt, history2))
-                if response is None:
-                    self.queue_update(f"無法從 {speaker_name} 獲取回應，對話終止。\n")
-                    break
-                current_message = response
-                self.queue_update(f"{current_message}\n")
-                self.structured_log.append({'speaker': log_speaker_name, 'content': current_message})
-                history2.append({"role": "assistant", "content": current_message})
-                history1.append({"role": "user", "content": current_message})
-        self.queue_update("\n--- 對話結束 ---\n")
+        runner = DebateRunner(settings, config=self.config, emit=self.queue_update, stop_event=stop_event,
+                              on_metrics=lambda metrics: self.post(("metrics", None, list(metrics))),
+                              on_turn_start=lambda index: self.post(("turn_start", None, index)),
+                              history=history_db.get_db())
+        # 與執行器共用同一個列表，讓對話進行中也能儲存目前的紀錄
+        self.structured_log = runner.structured_log
+        self.viewed_session_id = None
+        try:
+            runner.run()
+        finally:
+            self.post(("conversation_finished", None, stop_event))
 
     def stop_conversation(self):
-        self.ui.append_dialogue("\n--- 使用者請求停止（將在目前回合結束後生效） ---\n")
+        # 設定 CancelToken 會立即中斷進行中的請求並關閉連線，對話執行緒隨即送出終止標記
+        self.stop_event.set()
         self.ui.set_ui_state(is_running=False)
 
+    def post(self, message):
+        """
+        (任何執行緒) 將 (類型, AI編號, 資料) 訊息放入佇列，並在佇列原本沒有待處理的喚醒時
+        送出 <<QueueUpdated>> 虛擬事件喚醒主執行緒；同一畫面內的多則訊息只會觸發一次喚醒。
+        """
+        self.queue.put(message)
+        with self._wake_lock:
+            if self._wake_pending:
+                return
+            self._wake_pending = True
+        try:
+            self.root.event_generate("<<QueueUpdated>>", when="tail")
+        except (RuntimeError, tk.TclError):
+            # 主迴圈尚未開始或已結束；訊息留在佇列中，由主迴圈開始時的第一次處理或下一次喚醒取出
+            with self._wake_lock:
+                self._wake_pending = False
+
+    def on_queue_updated(self, event=None):
+        """收到喚醒事件後，排定在下一個畫面處理佇列，讓這段時間內送達的訊息一起處理。"""
+        if self._flush_job is None:
+            self._flush_job = self.root.after(FRAME_INTERVAL_MS, self.process_queue)
+
     def process_queue(self):
-        """處理佇列中的訊息，包括對話內容和UI更新請求。"""
+        """
+        處理佇列中所有待處理的訊息。對話文字會合併成一次插入與一次捲動，而不是每則訊息各更新一次元件。
+        """
+        self._flush_job = None
+        with self._wake_lock:
+            # 先清除旗標再取出訊息，處理期間送達的新訊息會再觸發一次喚醒
+            self._wake_pending = False
+        # (是否開始新的一段, 文字片段) 的列表，最後合併成一次更新
+        segments = []
         try:
-            while not self.queue.empty():
-                message_data = self.queue.get_nowait()
-                if isinstance(message_data, str):
-                    self.ui.append_dialogue(message_data)
-                    if "--- 對話結束 ---" in message_data or "--- 對話被使用者提前終止 ---" in message_data:
+            while True:
+                try:
+                    msg_type, ai_num, data = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if msg_type == "dialogue":
+                    if not segments:
+                        segments.append((False, []))
+                    segments[-1][1].append(data)
+                elif msg_type == "turn_start":
+                    segments.append((True, []))
+                elif msg_type == "conversation_finished":
+                    # 只有目前這場對話結束時才恢復按鈕；被終止的上一場對話稍後結束不影響新的對話
+                    if data is self.stop_event:
                         self.ui.set_ui_state(is_running=False)
-                elif isinstance(message_data, tuple):
-                    msg_type, ai_num, data = message_data
-                    if msg_type == "update_models":
-                        self.update_combobox(ai_num, data)
+                elif msg_type == "update_models":
+                    self.update_combobox(ai_num, data)
+                elif msg_type == "key_status":
+                    self.show_key_status(data)
+                elif msg_type == "key_saved":
+                    self.finish_save_api_key(*data)
+                elif msg_type == "metrics":
+                    self.ui.set_status(self.format_metrics_status(data))
+                elif msg_type == "warmup_done":
+                    model, result, info = data
+                    if info is not None:
+                        self.ui.set_status(f"AI #{ai_num} {model_catalog.format_model_info(info)}")
+                    if not segments:
+                        segments.append((False, []))
+                    if result is None:
+                        segments[-1][1].append(f"AI #{ai_num} 模型 {model} 預載失敗。\n")
+                    else:
+                        segments[-1][1].append(f"AI #{ai_num} 模型 {model} 已預載 (載入 {result['load_seconds']:.2f} 秒)。\n")
         finally:
-            self.root.after(100, self.process_queue)
+            if segments:
+                self.ui.append_dialogue_batch([(new_turn, "".join(parts)) for new_turn, parts in segments])
+            if not self.queue.empty():
+                # 處理途中發生錯誤時，其餘訊息在下一個畫面繼續處理
+                self.on_queue_updated()
+
+    def format_metrics_status(self, turn_metrics):
+        """將最近一回合與整場對話的平均效能指標整理成狀態列文字。"""
+        latest = turn_metrics[-1]
+        avg_wall = sum(m["wall_time"] for m in turn_metrics) / len(turn_metrics)
+        rates = [m["tokens_per_sec"] for m in turn_metrics if m["tokens_per_sec"]]
+        text = f"第{len(turn_metrics)}次發言 {latest['model']}：耗時 {latest['wall_time']:.1f}s，首字 {latest['ttft']:.2f}s"
+        if latest["tokens_per_sec"]:
+            text += f"，{latest['tokens_per_sec']:.1f} tok/s"
+        if (latest.get("attempts") or 1) > 1:
+            text += f"，重試 {latest['attempts'] - 1} 次"
+        text += f" | 平均耗時 {avg_wall:.1f}s"
+        if rates:
+            text += f"，平均 {sum(rates) / len(rates):.1f} tok/s"
+        return text
 
     def queue_update(self, message: str):
-        self.queue.put(message)
+        """(對話執行緒) DebateRunner 的 emit 回呼，將要顯示的文字送往主執行緒。"""
+        self.post(("dialogue", None, message))
 
     def on_persona1_select(self, event=None):
-        selected_name = self.ui.persona1_combo.get()
-        if not selected_name: return
-        for persona in self.personas:
-            if persona["name"] == selected_name:
-                self.ui.persona1_text.delete("1.0", tk.END)
-                self.ui.persona1_text.insert("1.0", persona["prompt"])
-                break
+        persona = self.persona_store.get(self.ui.persona1_combo.get())
+        if persona is not None:
+            self.ui.persona1_text.delete("1.0", tk.END)
+            self.ui.persona1_text.insert("1.0", persona["prompt"])
 
     def on_persona2_select(self, event=None):
-        selected_name = self.ui.persona2_combo.get()
-        if not selected_name: return
-        for persona in self.personas:
-            if persona["name"] == selected_name:
-                self.ui.persona2_text.delete("1.0", tk.END)
-                self.ui.persona2_text.insert("1.0", persona["prompt"])
-                break
+        persona = self.persona_store.get(self.ui.persona2_combo.get())
+        if persona is not None:
+            self.ui.persona2_text.delete("1.0", tk.END)
+            self.ui.persona2_text.insert("1.0", persona["prompt"])
 
     def on_style_select(self, event=None):
         """當風格下拉選單被選擇時，更新文字框內容。"""
-        selected_name = self.ui.style_combo.get()
-        if not selected_name: return
-        for style in self.styles:
-            if style["name"] == selected_name:
-                self.ui.style_prompt_text.delete("1.0", tk.END)
-                self.ui.style_prompt_text.insert("1.0", style["prompt"])
-                break
+        style = self.style_store.get(self.ui.style_combo.get())
+        if style is not None:
+            self.ui.style_prompt_text.delete("1.0", tk.END)
+            self.ui.style_prompt_text.insert("1.0", style["prompt"])
 
     # --- 歷史紀錄管理 ---
     def open_history_window(self):
@@ -479,56 +582,130 @@ class MainApp:
         self.history_win = HistoryManagerWindow(self.root)
         self.history_win.view_button.config(command=self.view_history)
         self.history_win.delete_button.config(command=self.delete_history)
+        self.history_win.import_button.config(command=self.import_legacy_history)
+        self.history_win.prev_button.config(command=lambda: self.change_history_page(-1))
+        self.history_win.next_button.config(command=lambda: self.change_history_page(1))
+        self.history_win.history_listbox.bind("<Double-Button-1>", lambda e: self.view_history())
+        self.history_win.history_listbox.bind("<<ListboxSelect>>", lambda e: self.show_history_snippet())
+        self.history_win.search_var.trace_add("write", lambda *args: self.schedule_history_search())
+        self.history_win.search_entry.bind("<Return>", lambda e: self.refresh_history_list())
+        self.history_page = 0
+        self.history_search_job = None
         self.refresh_history_list()
 
+    def schedule_history_search(self):
+        """輸入停頓一小段時間後才搜尋，避免每按一個鍵就查詢一次。"""
+        if self.history_search_job is not None:
+            self.root.after_cancel(self.history_search_job)
+        self.history_search_job = self.root.after(HISTORY_SEARCH_DELAY_MS, self.refresh_history_list)
+
     def refresh_history_list(self):
-        """刷新歷史紀錄視窗的列表。"""
+        """刷新歷史紀錄視窗的列表：有搜尋條件時列出全文搜尋結果，否則以分頁查詢由新到舊列出。"""
+        self.history_search_job = None
+        if not self.history_win.winfo_exists():
+            return
+        query = self.history_win.search_var.get().strip()
+        if query:
+            self.show_history_search(query)
+            return
+        self.history_win.snippet_label.config(text="")
+        db = history_db.get_db()
+        total = db.count_sessions()
+        pages = max(1, -(-total // history_db.PAGE_SIZE))
+        self.history_page = min(self.history_page, pages - 1)
+        self.history_sessions = db.list_sessions(history_db.PAGE_SIZE, self.history_page * history_db.PAGE_SIZE)
         self.history_win.history_listbox.delete(0, tk.END)
-        if not os.path.exists("history"):
+        for session in self.history_sessions:
+            self.history_win.history_listbox.insert(tk.END, self.format_history_entry(session))
+        self.history_win.page_label.config(text=f"第 {self.history_page + 1} / {pages} 頁，共 {total} 場對話")
+        self.history_win.prev_button.config(state="normal" if self.history_page > 0 else "disabled")
+        self.history_win.next_button.config(state="normal" if self.history_page < pages - 1 else "disabled")
+
+    def show_history_search(self, query):
+        """列出全文搜尋結果，每場對話一行並附上最相關的摘錄。"""
+        started = time.perf_counter()
+        self.history_sessions = history_db.get_db().search(query)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.history_win.history_listbox.delete(0, tk.END)
+        for session in self.history_sessions:
+            snippet = " ".join(session["snippet"].split())
+            self.history_win.history_listbox.insert(tk.END, f"{self.format_history_entry(session)}  | {snippet}")
+        self.history_win.page_label.config(text=f"找到 {len(self.history_sessions)} 場對話 ({elapsed_ms:.0f} ms)")
+        self.history_win.snippet_label.config(text="")
+        self.history_win.prev_button.config(state="disabled")
+        self.history_win.next_button.config(state="disabled")
+
+    def show_history_snippet(self):
+        """顯示選取的搜尋結果的發言者與完整摘錄。"""
+        indices = self.history_win.history_listbox.curselection()
+        if not indices or "snippet" not in self.history_sessions[indices[0]]:
             return
-        # 讀取history資料夾，並按檔名(時間)倒序排序
-        history_files = sorted([f for f in os.listdir("history") if f.endswith(".txt")], reverse=True)
-        for f in history_files:
-            self.history_win.history_listbox.insert(tk.END, f)
+        session = self.history_sessions[indices[0]]
+        self.history_win.snippet_label.config(text=f"{session['speaker']}：{session['snippet']}")
 
-    def view_history(self):
-        """檢視選定的歷史紀錄。"""
+    def change_history_page(self, delta):
+        self.history_page = max(0, self.history_page + delta)
+        self.refresh_history_list()
+
+    def format_history_entry(self, session):
+        """將一場對話的摘要整理成列表中的一行。"""
+        status = HISTORY_STATUS_LABELS.get(session["status"], session["status"])
+        started = session["started_at"].replace("T", " ")
+        if session["persona1"] or session["persona2"]:
+            title = f"{session['persona1']} vs {session['persona2']}：{session['topic']}"
+        else:
+            title = session["topic"]
+        return f"{started}  [{status}] {session['turn_count']:>3} 則  {title}"
+
+    def selected_history_session(self, action):
         indices = self.history_win.history_listbox.curselection()
         if not indices:
-            messagebox.showwarning("未選擇", "請先選擇一筆要檢視的紀錄。", parent=self.history_win)
-            return
-
-        filename = self.history_win.history_listbox.get(indices[0])
-        filepath = os.path.join("history", filename)
+            messagebox.showwarning("未選擇", f"請先選擇一筆要{action}的紀錄。", parent=self.history_win)
+            return None
+        return self.history_sessions[indices[0]]
 
+    def view_history(self):
+        """
+        檢視選定的歷史紀錄。紀錄以區塊從資料庫讀取，捲動時才載入其餘部分；
+        「儲存」時才讀取完整的紀錄並匯出。
+        """
+        session = self.selected_history_session("檢視")
+        if session is None:
+            return
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            self.ui.clear_dialogue()
-            self.ui.append_dialogue(content)
-            self.history_win.destroy() # 檢視後自動關閉視窗
-        except Exception as e:
-            messagebox.showerror("讀取失敗", f"無法讀取歷史紀錄檔案: {e}", parent=self.history_win)
+            reader = history_db.TranscriptReader(history_db.get_db(), session["id"])
+            self.ui.show_transcript(reader.chunk)
+        except sqlite3.Error as e:
+            messagebox.showerror("讀取失敗", f"無法讀取歷史紀錄: {e}", parent=self.history_win)
+            return
+        self.structured_log = []
+        self.viewed_session_id = session["id"]
+        self.history_win.destroy() # 檢視後自動關閉視窗
 
     def delete_history(self):
         """刪除選定的歷史紀錄。"""
-        indices = self.history_win.history_listbox.curselection()
-        if not indices:
-            messagebox.showwarning("未選擇", "請先選擇一筆要刪除的紀錄。", parent=self.history_win)
+        session = self.selected_history_session("刪除")
+        if session is None:
             return
-
-        filename_txt = self.history_win.history_listbox.get(indices[0])
-        base_filename = os.path.splitext(filename_txt)[0]
-
-        if messagebox.askyesno("確認刪除", f"您確定要刪除紀錄「{base_filename}」嗎？\n(將會同時刪除 .txt 和 .json 檔案)", parent=self.history_win):
+        if messagebox.askyesno("確認刪除", f"您確定要刪除紀錄「{self.format_history_entry(session)}」嗎？", parent=self.history_win):
             try:
-                os.remove(os.path.join("history", filename_txt))
-                os.remove(os.path.join("history", base_filename + ".json"))
+                history_db.get_db().delete_session(session["id"])
                 self.refresh_history_list() # 刷新列表
-            except Exception as e:
-                messagebox.showerror("刪除失敗", f"無法刪除檔案: {e}", parent=self.history_win)
+            except sqlite3.Error as e:
+                messagebox.showerror("刪除失敗", f"無法刪除紀錄: {e}", parent=self.history_win)
+
+    def import_legacy_history(self):
+        """從舊版的 history 資料夾 (.txt/.json 紀錄) 匯入對話；已匯入過的檔案會略過。"""
+        directory = filedialog.askdirectory(title="選擇舊版紀錄資料夾", parent=self.history_win)
+        if not directory:
+            return
+        count = history_db.get_db().import_legacy_dir(directory)
+        messagebox.showinfo("匯入完成", f"已匯入 {count} 場對話。", parent=self.history_win)
+        self.refresh_history_list()
 
     def save_dialogue(self):
+        if not self.structured_log and self.viewed_session_id is not None:
+            self.structured_log = history_db.get_db().load_turns(self.viewed_session_id)
         if not self.structured_log:
             messagebox.showwarning("沒有內容", "對話紀錄是空的，沒有什麼可以儲存。")
             return
@@ -559,11 +736,11 @@ class MainApp:
     def export_data(self, data_type: str):
         """匯出指定類型的資料 (personas 或 styles)。"""
         if data_type == "personas":
-            data_to_export = [p for p in self.personas if not p.get("is_default")]
+            data_to_export = [{"name": p["name"], "prompt": p["prompt"]} for p in self.persona_store.editable_records()]
             default_filename = "my_personas_backup.json"
             title = "匯出角色庫"
         elif data_type == "styles":
-            data_to_export = self.styles
+            data_to_export = [dict(s) for s in self.style_store.records()]
             default_filename = "my_styles_backup.json"
             title = "匯出風格庫"
         else:
@@ -610,20 +787,32 @@ class MainApp:
 
         if messagebox.askyesno("確認匯入", f"這將會覆蓋您現有的自訂{title.replace('匯入', '')}。您確定要繼續嗎？"):
             if data_type == "personas":
-                self.personas = [p for p in self.personas if p.get("is_default")] + imported_data
-                persona_manager.save_user_personas(self.personas)
+                self.persona_store.replace_editable([{**p, "is_default": False} for p in imported_data])
                 self.refresh_main_persona_comboboxes()
             elif data_type == "styles":
-                self.styles = imported_data
-                style_manager.save_user_styles(self.styles)
+                self.style_store.replace_editable(imported_data)
                 self.refresh_main_style_combobox()
 
             messagebox.showinfo("匯入成功", f"{title.replace('匯入', '')}已成功匯入並應用。")
 
+def report_startup_time(root: tk.Tk, app_created_at: float):
+    """(--startup-time) 視窗第一次繪製完成後，印出各階段的啟動耗時與被提早載入的大型模組，然後結束。"""
+    root.update_idletasks()
+    shown_at = time.perf_counter()
+    print(f"匯入模組: {(_IMPORTED_AT - _STARTED_AT) * 1000:.1f} ms")
+    print(f"建立主視窗: {(app_created_at - _IMPORTED_AT) * 1000:.1f} ms")
+    print(f"第一次繪製: {(shown_at - app_created_at) * 1000:.1f} ms")
+    print(f"總計: {(shown_at - _STARTED_AT) * 1000:.1f} ms")
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    print(f"已載入的大型模組: {', '.join(loaded) if loaded else '無'}")
+    root.destroy()
+
 if __name__ == '__main__':
     try:
         root = tk.Tk()
         app = MainApp(root)
+        if "--startup-time" in sys.argv[1:]:
+            root.after(0, report_startup_time, root, time.perf_counter())
         root.mainloop()
     except tk.TclError as e:
         print(f"無法啟動UI，可能是在無顯示(headless)環境中運行: {e}")
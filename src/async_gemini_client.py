@@ -0,0 +1,90 @@
+import asyncio
+from typing import List, Dict, Any, Optional
+
+import gemini_client
+import rate_limiter
+import response_cache
+from cancellation import CancelToken, CancelledError, await_cancellable
+from resilience import classify_error
+from gemini_client import SUPPORTED_MODELS
+
+async def configure_api_key(api_key: str) -> bool:
+    """
+    設定並驗證Google Gemini API金鑰 (非同步版本)。
+
+    SDK 的模型列表查詢沒有非同步介面，因此在執行緒池中執行同步版本，避免阻塞事件迴圈。
+
+    Args:
+        api_key (str): 使用者的API金鑰。
+
+    Returns:
+        bool: 如果金鑰被設定則返回True，否則False。
+    """
+    return await asyncio.to_thread(gemini_client.configure_api_key, api_key)
+
+async def get_available_models() -> List[str]:
+    """返回支援的Gemini模型列表，與其他非同步客戶端保持相同的介面。"""
+    return list(SUPPORTED_MODELS)
+
+async def generate_response(
+    model_name: str,
+    system_prompt: str,
+    conversation_history: List[Dict[str, str]],
+    session_id: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> Optional[str]:
+    """
+    使用指定的Gemini模型生成一個新的回應 (非同步版本)。
+
+    與同步版本共用聊天會話快取，每回合只送出最新的使用者訊息。
+    回應快取 (SQLite) 與聊天會話的準備 (第一次呼叫時會匯入SDK) 是阻塞操作，在執行緒池中執行。
+
+    Args:
+        model_name (str): 要使用的模型名稱 (例如, "gemini-1.5-flash")。
+        system_prompt (str): AI的系統提示詞/角色設定。
+        conversation_history (List[Dict[str, str]]): Ollama格式的對話歷史記錄。
+        session_id (str, optional): 對話中某一方的識別碼，用來區分不同的聊天會話。
+        stats (Dict[str, Any], optional): 若提供，會填入本次請求的token用量與速率限制的排隊時間；失敗時填入 error。
+        cancel_token (CancelToken, optional): 被設定時 (可由其他執行緒) 立即放棄排隊或進行中的請求並返回None，
+            stats 中會標記 cancelled。
+
+    Returns:
+        Optional[str]: AI生成的回應內容。如果發生錯誤或被取消則返回None。
+    """
+    if model_name not in SUPPORTED_MODELS:
+        print(f"錯誤: 不支援的模型 '{model_name}'。")
+        return None
+
+    cache_key, cached = await asyncio.to_thread(response_cache.lookup, "gemini", model_name, system_prompt, conversation_history)
+    if cached is not None:
+        if stats is not None:
+            stats["cache_hit"] = True
+        return cached
+
+    try:
+        state, last_user_prompt = await asyncio.to_thread(
+            gemini_client.prepare_chat, model_name, system_prompt, conversation_history, session_id)
+        if state is None:
+            return None
+        response = await await_cancellable(cancel_token, rate_limiter.call_with_limits_async(
+            "gemini", model_name, rate_limiter.estimate_request_tokens(conversation_history, system_prompt),
+            lambda: state.chat.send_message_async(last_user_prompt),
+            stats=stats, usage=gemini_client.usage_tokens))
+        gemini_client.commit_chat(state, last_user_prompt, response.text)
+        gemini_client.fill_usage(stats, response)
+        await asyncio.to_thread(response_cache.store, cache_key, response.text)
+        return response.text
+
+    except CancelledError:
+        # 被中止的請求可能已部分寫入會話歷史，與同步版本相同，丟棄會話後下一回合依完整歷史重建
+        gemini_client.discard_chat(model_name, system_prompt, session_id)
+        if stats is not None:
+            stats["cancelled"] = True
+        return None
+    except Exception as e:
+        print(f"錯誤: Gemini API請求失敗: {e}")
+        if stats is not None:
+            stats["error"] = classify_error(e)
+        gemini_client.discard_chat(model_name, system_prompt, session_id)
+        return None
@@ -0,0 +1,291 @@
+import asyncio
+import contextlib
+import json
+import time
+from typing import List, Dict, Any, Callable, Optional
+
+import aiohttp
+
+import ollama_client
+import ollama_pool
+import response_cache
+from cancellation import CancelToken, CancelledError, await_cancellable
+from resilience import classify_error
+
+# 與同步客戶端相同的逾時設定：連線5秒，兩個分塊之間最多等待120秒
+_CHAT_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=120)
+_TAGS_TIMEOUT = aiohttp.ClientTimeout(total=5)
+
+# aiohttp 的 ClientSession 綁定在建立它的事件迴圈上，因此以迴圈為單位保存；
+# 已關閉的迴圈留下的項目會在下一次 get_session() 時移除
+_sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    取得目前事件迴圈共用的 aiohttp session (含 keep-alive 連線池)，第一次呼叫時才建立。
+
+    必須在事件迴圈內呼叫。session 的連線要在迴圈結束前以 close_session() 關閉，
+    或以 `async with session_scope():` 包住使用這個模組的程式碼。
+    """
+    loop = asyncio.get_running_loop()
+    for other in [l for l in _sessions if l.is_closed()]:
+        # 未呼叫 close_session() 就結束的迴圈，其session已無法再使用；移除後由 aiohttp 在回收時關閉其連線
+        del _sessions[other]
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=ollama_client.DEFAULT_POOL_CONNECTIONS * ollama_client.DEFAULT_POOL_MAXSIZE,
+            limit_per_host=ollama_client.DEFAULT_POOL_MAXSIZE
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[loop] = session
+    return session
+
+async def close_session():
+    """關閉目前事件迴圈的共用session，應在事件迴圈結束前呼叫。"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+@contextlib.asynccontextmanager
+async def session_scope():
+    """
+    在區塊結束時關閉目前事件迴圈的共用session，例如:
+
+        async def main():
+            async with async_ollama_client.session_scope():
+                await async_ollama_client.generate_response(...)
+    """
+    try:
+        yield get_session()
+    finally:
+        await close_session()
+
+async def get_available_models(base_url: Optional[str] = None) -> List[str]:
+    """
+    從Ollama API獲取所有可用的模型列表 (非同步版本)。
+
+    Args:
+        base_url (str, optional): Ollama服務的基礎URL，預設為 ollama_client.OLLAMA_BASE_URL。
+
+    Returns:
+        List[str]: 可用模型名稱的列表。如果發生錯誤則返回空列表。
+    """
+    pool = ollama_pool.get_pool()
+    if base_url is None and pool is not None:
+        return await asyncio.to_thread(pool.probe_all)
+    base_url = base_url or ollama_client.OLLAMA_BASE_URL
+    try:
+        async with get_session().get(f"{base_url}/api/tags", timeout=_TAGS_TIMEOUT) as response:
+            response.raise_for_status()
+            models_data = (await response.json()).get("models", [])
+            return [model["name"] for model in models_data]
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error connecting to Ollama at {base_url}: {e}")
+        return []
+    except json.JSONDecodeError:
+        print(f"Error: Failed to decode JSON response from Ollama.")
+        return []
+
+def _classify(error: Exception) -> str:
+    """將 aiohttp 的例外歸類，結果與同步客戶端的 resilience.classify_error() 一致。"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        if error.status == 429:
+            return "rate_limit"
+        return "server" if error.status >= 500 else "client"
+    if isinstance(error, aiohttp.ClientPayloadError):
+        return "protocol"
+    if isinstance(error, aiohttp.ClientConnectionError):
+        return "connection"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    return classify_error(error)
+
+def _note_failure(lease: ollama_pool.Lease, error: Exception):
+    """連線失敗或逾時時，讓端點池暫時避開這個端點。"""
+    if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        lease.mark_failed()
+
+async def _lease(
+    model_name: str,
+    affinity: Optional[str],
+    base_url: Optional[str],
+    cancel_token: Optional[CancelToken],
+    stats: Optional[Dict[str, Any]]
+) -> Optional[ollama_pool.Lease]:
+    """ollama_client._lease() 的非同步版本：等待端點時不阻塞事件迴圈，被取消時返回None。"""
+    try:
+        return await ollama_pool.lease_async(model_name, affinity, base_url, ollama_client.OLLAMA_BASE_URL, cancel_token)
+    except CancelledError:
+        ollama_client._was_cancelled(cancel_token, stats)
+        return None
+
+async def _lookup(model_name: str, conversation_history: List[Dict[str, str]]):
+    # 回應快取是同步的SQLite，在執行緒池中查詢以免阻塞事件迴圈
+    return await asyncio.to_thread(response_cache.lookup, "ollama", model_name, None, conversation_history)
+
+async def generate_response(
+    model_name: str,
+    conversation_history: List[Dict[str, str]],
+    base_url: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    cancel_token: Optional[CancelToken] = None,
+    affinity: Optional[str] = None
+) -> str | None:
+    """
+    使用指定的模型和對話歷史，向Ollama API請求生成一個新的回應 (非同步版本)。
+
+    Args:
+        model_name (str): 要使用的模型名稱 (例如, "llama3:latest")。
+        conversation_history (List[Dict[str, str]]): 對話歷史記錄。
+        base_url (str, optional): Ollama服務的基礎URL；未指定時使用 ollama_client.OLLAMA_BASE_URL 或由端點池分配。
+        stats (Dict[str, Any], optional): 若提供，會填入模型載入時間、生成時間與token數；失敗時填入 error。
+        cancel_token (CancelToken, optional): 被設定時 (可由其他執行緒) 立即關閉連線並返回None，stats 中會標記 cancelled。
+        affinity (str, optional): 端點池的固定路由鍵，與同步客戶端相同。
+
+    Returns:
+        str | None: AI生成的回應內容。如果發生錯誤或被取消則返回None。
+    """
+    cache_key, cached = await _lookup(model_name, conversation_history)
+    if cached is not None:
+        if stats is not None:
+            stats["cache_hit"] = True
+        return cached
+    lease = await _lease(model_name, affinity, base_url, cancel_token, stats)
+    if lease is None:
+        return None
+    payload = ollama_client.build_chat_payload(model_name, conversation_history, stream=False)
+
+    async def post():
+        async with get_session().post(f"{lease.url}/api/chat", json=payload, timeout=_CHAT_TIMEOUT) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    try:
+        response_data = await await_cancellable(cancel_token, post())
+        ollama_client.fill_stats(stats, response_data)
+        content = ollama_client.extract_content(response_data)
+        if content is None:
+            ollama_client._record_error(stats, "protocol")
+        await asyncio.to_thread(response_cache.store, cache_key, content)
+        return content
+    except CancelledError:
+        ollama_client._was_cancelled(cancel_token, stats)
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        _note_failure(lease, e)
+        ollama_client._record_error(stats, _classify(e))
+        print(f"Error during Ollama generation request: {e}")
+        return None
+    except json.JSONDecodeError:
+        ollama_client._record_error(stats, "protocol")
+        print(f"Error: Failed to decode JSON response from Ollama.")
+        return None
+    finally:
+        lease.release()
+
+async def generate_response_stream(
+    model_name: str,
+    conversation_history: List[Dict[str, str]],
+    on_token: Optional[Callable[[str], None]] = None,
+    base_url: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    cancel_token: Optional[CancelToken] = None,
+    affinity: Optional[str] = None
+) -> str | None:
+    """
+    以流式傳輸向Ollama API請求生成回應 (非同步版本)，每收到一段文字就立即回呼。
+
+    Args:
+        model_name (str): 要使用的模型名稱。
+        conversation_history (List[Dict[str, str]]): 對話歷史記錄。
+        on_token (Callable[[str], None], optional): 每收到一段新文字時呼叫的回呼函式。
+        base_url (str, optional): Ollama服務的基礎URL；未指定時使用 ollama_client.OLLAMA_BASE_URL 或由端點池分配。
+        stats (Dict[str, Any], optional): 若提供，會以最後一個分塊填入載入時間、生成時間與token數；
+            失敗時填入 error (串流在 done 分塊之前結束也視為 "protocol" 錯誤)。
+        cancel_token (CancelToken, optional): 被設定時立即中斷正在讀取的串流並關閉連線，讓Ollama停止生成；
+            此時返回None，stats 中會標記 cancelled。
+        affinity (str, optional): 端點池的固定路由鍵，與同步客戶端相同。
+
+    Returns:
+        str | None: 完整的AI回應內容。如果發生錯誤或被取消則返回None。
+    """
+    cache_key, cached = await _lookup(model_name, conversation_history)
+    if cached is not None:
+        if stats is not None:
+            stats["cache_hit"] = True
+        if on_token:
+            on_token(cached)
+        return cached
+    lease = await _lease(model_name, affinity, base_url, cancel_token, stats)
+    if lease is None:
+        return None
+    payload = ollama_client.build_chat_payload(model_name, conversation_history, stream=True)
+    parser = ollama_client.StreamParser(on_token, stats)
+
+    async def read_stream():
+        async with get_session().post(f"{lease.url}/api/chat", json=payload, timeout=_CHAT_TIMEOUT) as response:
+            response.raise_for_status()
+            # aiohttp 的 content 以行為單位迭代，正好對應 NDJSON 的每一個分塊
+            async for line in response.content:
+                if parser.feed(line):
+                    break
+
+    try:
+        await await_cancellable(cancel_token, read_stream())
+        content = parser.finish()
+        await asyncio.to_thread(response_cache.store, cache_key, content)
+        return content
+    except CancelledError:
+        ollama_client._was_cancelled(cancel_token, stats)
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        _note_failure(lease, e)
+        ollama_client._record_error(stats, _classify(e))
+        print(f"Error during Ollama streaming request: {e}")
+        return None
+    except json.JSONDecodeError:
+        ollama_client._record_error(stats, "protocol")
+        print(f"Error: Failed to decode streamed JSON chunk from Ollama.")
+        return None
+    finally:
+        lease.release()
+
+async def warm_up_model(
+    model_name: str,
+    base_url: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None,
+    affinity: Optional[str] = None
+) -> Dict[str, float] | None:
+    """
+    以一個不含訊息的請求預先將模型載入Ollama的記憶體 (非同步版本)，參數與返回值同 ollama_client.warm_up_model()。
+    """
+    lease = await _lease(model_name, affinity, base_url, cancel_token, None)
+    if lease is None:
+        return None
+    payload = ollama_client.build_chat_payload(model_name, [], stream=False)
+    start = time.perf_counter()
+
+    async def post():
+        async with get_session().post(f"{lease.url}/api/chat", json=payload, timeout=_CHAT_TIMEOUT) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    try:
+        response_data = await await_cancellable(cancel_token, post())
+        result: Dict[str, float] = {}
+        ollama_client.fill_stats(result, response_data)
+        result.setdefault("load_seconds", 0.0)
+        result["wall_seconds"] = time.perf_counter() - start
+        return result
+    except CancelledError:
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        _note_failure(lease, e)
+        print(f"Error warming up Ollama model {model_name}: {e}")
+        return None
+    except json.JSONDecodeError:
+        print(f"Error: Failed to decode JSON response from Ollama.")
+        return None
+    finally:
+        lease.release()
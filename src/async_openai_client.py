@@ -0,0 +1,93 @@
+import asyncio
+import openai
+from typing import List, Dict, Any, Optional
+
+import openai_client
+import rate_limiter
+import response_cache
+from cancellation import CancelToken, CancelledError, await_cancellable
+from resilience import classify_error
+from openai_client import SUPPORTED_MODELS
+
+# Store the async client instance globally
+client = None
+
+async def configure_api_key(api_key: str) -> bool:
+    """
+    Configures the async OpenAI client and validates the key.
+    """
+    global client
+    if not api_key:
+        return False
+    try:
+        client = openai.AsyncOpenAI(api_key=api_key)
+        # Attempt a simple API call to validate the key
+        await client.models.list()
+        return True
+    except openai.AuthenticationError as e:
+        print(f"OpenAI API key validation failed: {e}")
+        client = None
+        return False
+    except Exception as e:
+        print(f"An unexpected error occurred during OpenAI client configuration: {e}")
+        client = None
+        return False
+
+async def get_available_models() -> List[str]:
+    """
+    Returns the supported OpenAI models, mirroring the other async clients.
+    """
+    return list(SUPPORTED_MODELS)
+
+async def generate_response(
+    model_name: str,
+    system_prompt: str,
+    conversation_history: List[Dict[str, str]],
+    stats: Optional[Dict[str, Any]] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> Optional[str]:
+    """
+    Generates a response using the specified OpenAI model without blocking the event loop.
+    If stats is given, it receives the prompt/completion token usage and any rate-limit wait,
+    or the error kind on failure. Setting cancel_token (from any thread) abandons the request
+    and marks stats as cancelled. The SQLite response cache is consulted in a worker thread.
+    Returns None on errors or cancellation so they are never passed on as dialogue.
+    """
+    if not client:
+        print("OpenAI client is not configured. Please set your API key.")
+        return None
+
+    if model_name not in SUPPORTED_MODELS:
+        print(f"Error: Model '{model_name}' is not in the list of supported OpenAI models.")
+        return None
+
+    messages = openai_client.build_messages(system_prompt, conversation_history)
+    cache_key, cached = await asyncio.to_thread(response_cache.lookup, "openai", model_name, None, messages)
+    if cached is not None:
+        if stats is not None:
+            stats["cache_hit"] = True
+        return cached
+
+    try:
+        response = await await_cancellable(cancel_token, rate_limiter.call_with_limits_async(
+            "openai", model_name, rate_limiter.estimate_request_tokens(messages),
+            lambda: client.chat.completions.create(model=model_name, messages=messages),
+            stats=stats, usage=openai_client.usage_tokens))
+        content = response.choices[0].message.content
+        openai_client.fill_usage(stats, response)
+        await asyncio.to_thread(response_cache.store, cache_key, content)
+        return content
+    except CancelledError:
+        if stats is not None:
+            stats["cancelled"] = True
+        return None
+    except openai.APIError as e:
+        print(f"OpenAI API Error: {e}")
+        if stats is not None:
+            stats["error"] = classify_error(e)
+        return None
+    except Exception as e:
+        print(f"An unexpected error occurred while generating response from OpenAI: {e}")
+        if stats is not None:
+            stats["error"] = classify_error(e)
+        return None
@@ -0,0 +1,244 @@
+"""
+無介面 (headless) 的批次對話執行器。
+
+從 JSONL 或 JSON 檔案讀取多場對話的設定，以有限的並行度同時執行，
+並透過 output_formatter 將每一場的結果寫入輸出資料夾。
+
+用法 (在專案根目錄執行):
+    python src/batch_runner.py jobs.jsonl --output-dir batch_output --format md
+
+加上 --async 時所有對話在同一個事件迴圈中以非同步客戶端執行 (DebateRunner.run_async())，
+等待回應時不佔用執行緒，適合大量並行的對話。
+
+每一筆工作的欄位:
+    id          (選填) 輸出檔名，預設為 job-<序號>
+    persona1    AI #1 的角色名稱 (對應 persona_manager 中的名稱)，或改用 persona1_prompt 直接給提示詞
+    persona2    AI #2 的角色名稱，或改用 persona2_prompt
+    style       (選填) 風格名稱 (對應 style_manager 中的名稱)，或改用 style_prompt
+    topic       對話主題
+    turns       (選填) 回合數，預設 5
+    source1 / model1, source2 / model2
+                模型來源 ("Ollama" 或 "Gemini") 與模型名稱
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Any
+
+import persona_manager
+import style_manager
+import output_formatter
+import ollama_pool
+import async_ollama_client
+from debate_runner import DebateRunner, apply_client_config
+from cancellation import CancelToken
+
+CONFIG_FILE = "config.json"
+DEFAULT_TURNS = 5
+
+# 輸出格式與對應的 output_formatter 函式；前者返回字串，後者直接寫檔
+TEXT_FORMATS = {"txt": output_formatter.to_txt, "md": output_formatter.to_md, "csv": output_formatter.to_csv}
+FILE_FORMATS = {"docx": output_formatter.to_docx, "xlsx": output_formatter.to_xlsx}
+
+def load_jobs(path: str) -> List[Dict[str, Any]]:
+    """
+    讀取工作清單。副檔名為 .jsonl 時每行一筆，否則視為一個 JSON 陣列。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+def build_settings(job: Dict[str, Any], personas: Dict[str, str], styles: Dict[str, str]) -> Dict[str, Any]:
+    """
+    將一筆工作轉換成 DebateRunner 使用的設定 (與 AppUI.get_settings() 相同的格式)。
+
+    Raises:
+        ValueError: 當角色或風格名稱找不到，或缺少必要欄位時。
+    """
+    settings = {"topic": job["topic"], "turns": int(job.get("turns", DEFAULT_TURNS))}
+    for n in (1, 2):
+        name = job.get(f"persona{n}", "")
+        prompt = job.get(f"persona{n}_prompt")
+        if prompt is None:
+            if name not in personas:
+                raise ValueError(f"找不到角色「{name}」")
+            prompt = personas[name]
+        settings[f"persona{n}_name"] = name or f"AI #{n}"
+        settings[f"persona{n}_prompt"] = prompt
+        settings[f"source{n}"] = job.get(f"source{n}", "Ollama")
+        settings[f"model{n}"] = job[f"model{n}"]
+    style_prompt = job.get("style_prompt")
+    if style_prompt is None and job.get("style"):
+        if job["style"] not in styles:
+            raise ValueError(f"找不到風格「{job['style']}」")
+        style_prompt = styles[job["style"]]
+    settings["style_prompt"] = style_prompt or ""
+    return settings
+
+def write_result(log: List[Dict[str, Any]], output_dir: str, job_id: str, fmt: str) -> str:
+    """透過 output_formatter 將一場對話的結果寫入檔案，並返回檔案路徑。"""
+    filepath = os.path.join(output_dir, f"{job_id}.{fmt}")
+    if fmt in FILE_FORMATS:
+        FILE_FORMATS[fmt](log, filepath)
+    else:
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(TEXT_FORMATS[fmt](log))
+    return filepath
+
+def _job_id(index: int, job: Dict[str, Any]) -> str:
+    return str(job.get("id", f"job-{index:04d}"))
+
+def _summary(job_id: str, settings: Dict[str, Any], log: List[Dict[str, Any]], filepath: str, start: float) -> Dict[str, Any]:
+    turns_done = sum(1 for entry in log if entry['speaker'].startswith(("角色A", "角色B")))
+    status = "ok" if turns_done == settings["turns"] * 2 else "incomplete"
+    return {"id": job_id, "status": status, "turns": turns_done, "output": filepath,
+            "seconds": round(time.perf_counter() - start, 3)}
+
+def run_job(index: int, job: Dict[str, Any], args, config, personas, styles, backend_limits, stop_event) -> Dict[str, Any]:
+    """(工作執行緒) 執行單一工作並寫出結果，返回這筆工作的執行摘要。"""
+    job_id = _job_id(index, job)
+    start = time.perf_counter()
+    try:
+        settings = build_settings(job, personas, styles)
+        emit = (lambda text: print(text, end="", flush=True)) if args.verbose else None
+        runner = DebateRunner(settings, config=config, emit=emit, stop_event=stop_event, backend_limits=backend_limits)
+        log = runner.run()
+        filepath = write_result(log, args.output_dir, job_id, args.format)
+        return _summary(job_id, settings, log, filepath, start)
+    except Exception as e:
+        return {"id": job_id, "status": "error", "error": str(e), "seconds": round(time.perf_counter() - start, 3)}
+
+async def run_job_async(index: int, job: Dict[str, Any], args, config, personas, styles, backend_limits, stop_event) -> Dict[str, Any]:
+    """run_job() 的非同步版本，以 DebateRunner.run_async() 執行；寫檔在執行緒池中進行。"""
+    job_id = _job_id(index, job)
+    start = time.perf_counter()
+    try:
+        settings = build_settings(job, personas, styles)
+        emit = (lambda text: print(text, end="", flush=True)) if args.verbose else None
+        runner = DebateRunner(settings, config=config, emit=emit, stop_event=stop_event, backend_limits=backend_limits)
+        log = await runner.run_async()
+        filepath = await asyncio.to_thread(write_result, log, args.output_dir, job_id, args.format)
+        return _summary(job_id, settings, log, filepath, start)
+    except Exception as e:
+        return {"id": job_id, "status": "error", "error": str(e), "seconds": round(time.perf_counter() - start, 3)}
+
+def run_jobs(jobs, args, config, personas, styles, stop_event) -> List[Dict[str, Any]]:
+    """以執行緒池執行所有工作，每完成一筆就輸出其摘要。"""
+    backend_limits = {"Gemini": threading.BoundedSemaphore(args.gemini_limit)}
+    if ollama_pool.get_pool() is None:
+        backend_limits["Ollama"] = threading.BoundedSemaphore(args.ollama_limit)
+    results = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(run_job, i, job, args, config, personas, styles, backend_limits, stop_event)
+                   for i, job in enumerate(jobs, start=1)]
+        remaining = set(futures)
+        while remaining:
+            try:
+                done, remaining = wait(remaining, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                print("收到中斷訊號，正在停止所有對話...", file=sys.stderr)
+                stop_event.set()
+                for future in remaining:
+                    future.cancel()
+                remaining = {future for future in remaining if not future.cancelled()}
+                continue
+            for future in done:
+                result = future.result()
+                results.append(result)
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+    return results
+
+async def run_jobs_async(jobs, args, config, personas, styles, stop_event) -> List[Dict[str, Any]]:
+    """
+    在目前的事件迴圈中執行所有工作，最多 --concurrency 場同時進行，每完成一筆就輸出其摘要。
+    Ctrl+C 時與 run_jobs() 相同：中止進行中的請求，尚未開始的工作不再執行。
+    """
+    backend_limits = {"Gemini": asyncio.Semaphore(args.gemini_limit)}
+    if ollama_pool.get_pool() is None:
+        backend_limits["Ollama"] = asyncio.Semaphore(args.ollama_limit)
+    slots = asyncio.Semaphore(args.concurrency)
+    loop = asyncio.get_running_loop()
+
+    def interrupt():
+        print("收到中斷訊號，正在停止所有對話...", file=sys.stderr)
+        stop_event.set()
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, interrupt)
+    except (NotImplementedError, RuntimeError):
+        # Windows 的事件迴圈不支援訊號處理，Ctrl+C 會直接結束程式
+        pass
+
+    async def run(index, job):
+        async with slots:
+            if stop_event.is_set():
+                return None
+            return await run_job_async(index, job, args, config, personas, styles, backend_limits, stop_event)
+
+    results = []
+    try:
+        async with async_ollama_client.session_scope():
+            for finished in asyncio.as_completed([run(i, job) for i, job in enumerate(jobs, start=1)]):
+                result = await finished
+                if result is None:
+                    continue
+                results.append(result)
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+    finally:
+        try:
+            loop.remove_signal_handler(signal.SIGINT)
+        except (NotImplementedError, RuntimeError):
+            pass
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="以無介面方式批次執行多場AI對話。")
+    parser.add_argument("jobs", help="工作清單檔案 (.jsonl 或 .json)")
+    parser.add_argument("--output-dir", default="batch_output", help="輸出資料夾 (預設: batch_output)")
+    parser.add_argument("--format", default="txt", choices=sorted(TEXT_FORMATS) + sorted(FILE_FORMATS), help="輸出格式 (預設: txt)")
+    parser.add_argument("--config", default=CONFIG_FILE, help="設定檔路徑 (預設: config.json)")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時進行的對話數 (預設: 4)")
+    parser.add_argument("--ollama-limit", type=int, default=2,
+                        help="每個Ollama端點同時處理的請求數上限 (預設: 2)")
+    parser.add_argument("--gemini-limit", type=int, default=4, help="同時送往Gemini的請求數上限 (預設: 4)")
+    parser.add_argument("--verbose", action="store_true", help="即時輸出對話內容")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="在單一事件迴圈中以非同步客戶端執行所有對話")
+    args = parser.parse_args(argv)
+
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+    apply_client_config(config)
+
+    jobs = load_jobs(args.jobs)
+    personas = {p["name"]: p["prompt"] for p in persona_manager.get_store().records()}
+    styles = {s["name"]: s["prompt"] for s in style_manager.get_store().records()}
+    pool = ollama_pool.get_pool()
+    if pool is not None:
+        # 設定了端點池時由端點池對每個端點分別限制，請求不會因為其他端點已滿而排隊
+        pool.set_max_in_flight(args.ollama_limit)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Ctrl+C 時中止所有進行中的請求，已開始的對話會以 incomplete 狀態寫出目前的結果
+    stop_event = CancelToken()
+    if args.use_async:
+        results = asyncio.run(run_jobs_async(jobs, args, config, personas, styles, stop_event))
+    else:
+        results = run_jobs(jobs, args, config, personas, styles, stop_event)
+
+    succeeded = sum(1 for r in results if r["status"] == "ok")
+    print(f"完成 {succeeded}/{len(jobs)} 場對話。", file=sys.stderr)
+    return 0 if succeeded == len(jobs) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+對話流程的端對端效能測試。
+
+在子程序中啟動 mock_llm_server，將 Ollama 客戶端指向它，
+再以 DebateRunner 同時執行多場對話，量測:
+    turns_per_sec       每秒完成的回合數
+    p50 / p99           單回合延遲 (秒)
+    cpu_ms_per_turn     客戶端程序每回合消耗的CPU時間 (毫秒)，模擬伺服器在另一個程序中不計入
+    memory_kb_per_turn  每回合增加的Python記憶體 (以 tracemalloc 在另一輪相同的負載中量測，不影響CPU時間)
+
+結果以JSON寫出，可用 --compare 與先前版本的結果比較。
+
+用法 (在專案根目錄執行):
+    python src/benchmark.py --debates 8 --turns 5 --concurrency 4 --output benchmark_results/latest.json
+    python src/benchmark.py --compare benchmark_results/baseline.json
+    python src/benchmark.py --async --output benchmark_results/async.json   (以 DebateRunner.run_async() 執行)
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+
+import ollama_client
+import async_ollama_client
+from debate_runner import DebateRunner
+
+MOCK_SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_llm_server.py")
+MOCK_MODELS = ["mock-llama:latest", "mock-gemma:latest"]
+
+# 比較結果時，這些指標數值越大越好；其餘越小越好
+HIGHER_IS_BETTER = {"turns_per_sec"}
+
+def start_mock_server(args) -> Tuple[subprocess.Popen, str]:
+    """
+    在子程序中啟動模擬伺服器 (埠號由系統指定)，返回 (程序, 伺服器網址)。
+
+    Raises:
+        RuntimeError: 當伺服器未能啟動時。
+    """
+    command = [sys.executable, MOCK_SERVER_SCRIPT, "--port", "0",
+               "--latency", args.latency, "--tokens-per-sec", str(args.tokens_per_sec),
+               "--reply-tokens", str(args.reply_tokens), "--failure-rate", str(args.failure_rate),
+               "--models", *MOCK_MODELS]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    if not url.startswith("http"):
+        process.kill()
+        raise RuntimeError("無法啟動模擬伺服器")
+    return process, url
+
+def build_settings(index: int, turns: int) -> Dict[str, Any]:
+    """產生一場測試對話的設定 (與 AppUI.get_settings() 相同的格式)。"""
+    return {
+        "persona1_name": "正方", "persona1_prompt": "你是辯論的正方，請支持題目的立場。",
+        "persona2_name": "反方", "persona2_prompt": "你是辯論的反方，請反對題目的立場。",
+        "source1": "Ollama", "model1": MOCK_MODELS[0],
+        "source2": "Ollama", "model2": MOCK_MODELS[1],
+        "topic": f"遠距工作是否應成為常態 (#{index})",
+        "turns": turns,
+        "style_prompt": "",
+    }
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """以最近排名法計算百分位數 (第 ceil(pct/100 * n) 小的值)；列表為空時返回None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+def run_debates(args, config: Dict[str, Any]) -> Tuple[List[float], int]:
+    """同時執行所有測試對話，返回 (每回合的延遲列表, 未完成的對話數)。"""
+    latencies: List[float] = []
+    failed_debates = 0
+    lock = threading.Lock()
+
+    def run_one(index):
+        nonlocal failed_debates
+        runner = DebateRunner(build_settings(index, args.turns), config=config)
+        runner.run()
+        with lock:
+            latencies.extend(m["wall_time"] for m in runner.turn_metrics)
+            if len(runner.turn_metrics) < args.turns * 2:
+                failed_debates += 1
+
+    if args.use_async:
+        return asyncio.run(run_debates_async(args, config))
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(run_one, range(args.debates)))
+    return latencies, failed_debates
+
+async def run_debates_async(args, config: Dict[str, Any]) -> Tuple[List[float], int]:
+    """run_debates() 的非同步版本：所有對話在同一個事件迴圈中執行，最多 concurrency 場同時進行。"""
+    latencies: List[float] = []
+    failed_debates = 0
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def run_one(index):
+        nonlocal failed_debates
+        async with slots:
+            runner = DebateRunner(build_settings(index, args.turns), config=config)
+            await runner.run_async()
+        latencies.extend(m["wall_time"] for m in runner.turn_metrics)
+        if len(runner.turn_metrics) < args.turns * 2:
+            failed_debates += 1
+
+    async with async_ollama_client.session_scope():
+        await asyncio.gather(*(run_one(i) for i in range(args.debates)))
+    return latencies, failed_debates
+
+def run_benchmark(args) -> Dict[str, Any]:
+    """
+    執行所有測試對話並返回彙整後的結果。
+
+    tracemalloc 會追蹤每一次配置而大幅增加CPU負擔，因此分成兩輪：
+    第一輪不追蹤記憶體，量測吞吐量、延遲與CPU時間；第二輪以相同的負載在 tracemalloc 下量測記憶體。
+    """
+    config = {"context_budgets": {"default": args.token_budget}}
+
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+    latencies, failed_debates = run_debates(args, config)
+    elapsed = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_before
+
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    memory_latencies, _ = run_debates(args, config)
+    memory_after, memory_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    turns = len(latencies)
+    memory_turns = len(memory_latencies)
+    return {
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "turns": turns,
+        "failed_debates": failed_debates,
+        "elapsed_seconds": round(elapsed, 3),
+        "turns_per_sec": round(turns / elapsed, 3) if elapsed else None,
+        "p50": round(percentile(latencies, 50), 4) if turns else None,
+        "p99": round(percentile(latencies, 99), 4) if turns else None,
+        "cpu_ms_per_turn": round(cpu_seconds * 1000 / turns, 3) if turns else None,
+        "memory_kb_per_turn": round((memory_after - memory_before) / 1024 / memory_turns, 3) if memory_turns else None,
+        "memory_peak_kb": round(memory_peak / 1024, 1),
+    }
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """將本次結果與基準結果逐項比較，返回可直接輸出的文字行。"""
+    lines = []
+    for metric in ("turns_per_sec", "p50", "p99", "cpu_ms_per_turn", "memory_kb_per_turn"):
+        old, new = baseline.get(metric), current.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        better = change > 0 if metric in HIGHER_IS_BETTER else change < 0
+        lines.append(f"{metric:>20}: {old} -> {new} ({change:+.1f}%{'，較佳' if better else ''})")
+    return lines
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="以模擬LLM伺服器量測對話流程的效能。")
+    parser.add_argument("--debates", type=int, default=8, help="要執行的對話場數 (預設: 8)")
+    parser.add_argument("--turns", type=int, default=5, help="每場對話的回合數 (預設: 5)")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時進行的對話數 (預設: 4)")
+    parser.add_argument("--latency", default="lognormal:0.05,0.5", help="模擬伺服器的首字延遲分布")
+    parser.add_argument("--tokens-per-sec", type=float, default=400.0, help="模擬伺服器的生成速度")
+    parser.add_argument("--reply-tokens", type=int, default=80, help="每則回覆的token數")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="模擬伺服器回應錯誤的比例")
+    parser.add_argument("--token-budget", type=int, default=3072, help="每方的token預算")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=os.path.join("benchmark_results", "latest.json"), help="結果JSON的輸出路徑")
+    parser.add_argument("--compare", help="與另一份結果JSON比較")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="以非同步客戶端在單一事件迴圈中執行所有對話")
+    args = parser.parse_args(argv)
+
+    process, url = start_mock_server(args)
+    try:
+        ollama_client.set_base_url(url)
+        result = run_benchmark(args)
+    finally:
+        process.terminate()
+        process.wait()
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps({k: v for k, v in result.items() if k != "params"}, ensure_ascii=False, indent=2))
+    print(f"結果已儲存至 {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\n與 {args.compare} 比較:")
+        for line in compare_results(result, baseline):
+            print(line)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
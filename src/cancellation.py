@@ -0,0 +1,151 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional, List, Any
+
+class CancelledError(Exception):
+    """請求因 CancelToken 被設定而中止。"""
+
+class CancelToken(threading.Event):
+    """
+    可立即中止進行中請求的停止旗標。
+
+    用法與 threading.Event 相同 (對話迴圈仍可在回合之間檢查 is_set())，
+    另外可登記回呼；set() 時會立即依序呼叫，讓客戶端關閉正在讀取的連線，而不必等到逾時。
+    """
+    def __init__(self):
+        super().__init__()
+        self._callbacks: List[Callable[[], None]] = []
+        self._callbacks_lock = threading.Lock()
+
+    def set(self):
+        with self._callbacks_lock:
+            if self.is_set():
+                return
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"錯誤: 執行取消回呼時發生錯誤: {e}")
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        登記一個在 set() 時呼叫的回呼；若已被設定則立即呼叫。
+
+        Returns:
+            Callable[[], None]: 傳入的回呼，可交給 remove_callback() 取消登記。
+        """
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return callback
+        callback()
+        return callback
+
+    def remove_callback(self, callback: Callable[[], None]):
+        """請求結束後取消登記，避免回呼作用在已被重複使用的連線上。"""
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+# 目前執行緒正在處理的請求所屬的 CancelToken 與在此期間登記的回呼，供 ollama_client 的連線類別使用
+_local = threading.local()
+
+@contextmanager
+def cancel_scope(cancel_token: Optional[CancelToken]):
+    """
+    在此範圍內，目前執行緒送出的Ollama請求都會在 cancel_token 被設定時中止。
+
+    離開範圍時會取消登記範圍內所有的回呼，避免之後重複使用同一條連線的請求被誤關。
+    """
+    previous = (getattr(_local, "token", None), getattr(_local, "callbacks", None))
+    _local.token, _local.callbacks = cancel_token, []
+    try:
+        yield cancel_token
+    finally:
+        if cancel_token is not None:
+            for callback in _local.callbacks:
+                cancel_token.remove_callback(callback)
+        _local.token, _local.callbacks = previous
+
+def register_abort(callback: Callable[[], None]):
+    """若目前執行緒位於 cancel_scope() 內，登記一個在取消時呼叫的回呼，直到範圍結束為止。"""
+    cancel_token = getattr(_local, "token", None)
+    if cancel_token is None:
+        return
+    _local.callbacks.append(callback)
+    cancel_token.add_callback(callback)
+
+def run_cancellable(cancel_token: Optional[CancelToken], func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    在背景執行緒中執行無法從外部中斷的阻塞呼叫 (例如雲端SDK的請求)，
+    cancel_token 被設定時立即返回，不等待呼叫結束。
+
+    Raises:
+        CancelledError: 呼叫完成前 cancel_token 就被設定時。
+        Exception: func 本身拋出的例外會原樣傳回。
+    """
+    if cancel_token is None:
+        return func(*args, **kwargs)
+    if cancel_token.is_set():
+        raise CancelledError()
+    done = threading.Event()
+    outcome = {}
+
+    def worker():
+        try:
+            outcome["result"] = func(*args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=worker, daemon=True).start()
+    callback = cancel_token.add_callback(done.set)
+    try:
+        done.wait()
+    finally:
+        cancel_token.remove_callback(callback)
+    if "error" in outcome:
+        raise outcome["error"]
+    if "result" not in outcome:
+        raise CancelledError()
+    return outcome["result"]
+
+async def await_cancellable(cancel_token: Optional[CancelToken], awaitable: Awaitable[Any]) -> Any:
+    """
+    run_cancellable() 的非同步版本：等待 awaitable，cancel_token 被設定時立即取消它
+    (例如關閉進行中的 aiohttp 連線)，不必等到逾時。cancel_token 可由其他執行緒設定。
+
+    Raises:
+        CancelledError: 完成前 cancel_token 就被設定時。
+        Exception: awaitable 本身拋出的例外會原樣傳回。
+    """
+    if cancel_token is None:
+        return await awaitable
+    if cancel_token.is_set():
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise CancelledError()
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(awaitable)
+
+    def cancel():
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            # 事件迴圈已關閉，工作也不會再執行
+            pass
+
+    callback = cancel_token.add_callback(cancel)
+    try:
+        return await task
+    except asyncio.CancelledError:
+        # 只有被 cancel_token 取消時才轉換；呼叫端自己的工作被取消時照常往外傳遞
+        if cancel_token.is_set() and not asyncio.current_task().cancelling():
+            raise CancelledError() from None
+        raise
+    finally:
+        cancel_token.remove_callback(callback)
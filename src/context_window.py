@@ -0,0 +1,202 @@
+from concurrent.futures import Executor, Future
+from typing import List, Dict, Callable, Optional
+
+# 未特別設定時，每一方送出的提示 (系統提示詞 + 對話歷史) 的token上限。
+# Ollama 模型常見的上下文長度為 4096，保留約1000個token給模型的回覆。
+DEFAULT_TOKEN_BUDGET = 3072
+# 雲端模型的上下文長度大得多，預算主要用來控制每回合的請求量
+DEFAULT_CLOUD_TOKEN_BUDGET = 32768
+# 已知模型實際的上下文長度時，保留給模型回覆的token數
+REPLY_RESERVE_TOKENS = 1024
+# 每則訊息在聊天模板中額外佔用的token (角色標記、分隔符號等)
+MESSAGE_OVERHEAD_TOKENS = 4
+# 超出預算時一次裁切到預算的這個比例，讓保留下來的前綴能維持數個回合不變，
+# 以便Ollama的KV快取與Gemini的聊天會話可以繼續沿用
+DEFAULT_LOW_WATER = 0.75
+
+# 摘要以一組問答的形式放在對話歷史的最前面，讓不支援額外系統訊息的模型 (如Gemini) 也能看到
+SUMMARY_PREFIX = "（以下是先前對話的摘要）\n"
+SUMMARY_ACK = "好的，我會依據這份摘要繼續對話。"
+
+def _is_cjk(char: str) -> bool:
+    """判斷字元是否為中日韓文字或全形標點，這些字元大約每個佔一個token。"""
+    code = ord(char)
+    return (0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0x3000 <= code <= 0x303F
+            or 0xFF00 <= code <= 0xFFEF or 0x3040 <= code <= 0x30FF or 0xAC00 <= code <= 0xD7AF)
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估計一段文字的token數，不需要載入任何tokenizer。
+
+    中日韓文字以每字一個token計算，其餘文字以每4個字元一個token計算。
+    """
+    cjk = sum(1 for char in text if _is_cjk(char))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+def get_token_budget(
+    source: str,
+    model_name: str,
+    budgets: Optional[Dict[str, int]] = None,
+    context_length: Optional[int] = None
+) -> int:
+    """
+    取得某個模型的token預算。
+
+    Args:
+        source (str): 模型來源 ("Ollama" 或 "Gemini")。
+        model_name (str): 模型名稱。
+        budgets (Dict[str, int], optional): 來自設定檔的預算表，可用模型名稱或 "default" 為鍵。
+        context_length (int, optional): 模型實際使用的上下文長度 (例如 Modelfile 的 num_ctx)；
+            設定檔沒有指定預算時，以此長度扣除回覆保留量作為預算。
+
+    Returns:
+        int: 該模型每次請求可使用的token數。
+    """
+    budgets = budgets or {}
+    if model_name in budgets:
+        return int(budgets[model_name])
+    if "default" in budgets:
+        return int(budgets["default"])
+    if context_length and context_length > 2 * REPLY_RESERVE_TOKENS:
+        return context_length - REPLY_RESERVE_TOKENS
+    return DEFAULT_TOKEN_BUDGET if source == "Ollama" else DEFAULT_CLOUD_TOKEN_BUDGET
+
+def build_summary_prompt(previous_summary: Optional[str], messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    組出請摘要模型濃縮舊對話的訊息列表。
+
+    Args:
+        previous_summary (Optional[str]): 既有的摘要，新摘要需將其內容一併納入。
+        messages (List[Dict[str, str]]): 要被濃縮的舊訊息，'assistant' 為己方、'user' 為對方。
+
+    Returns:
+        List[Dict[str, str]]: 可直接送給任一客戶端的對話歷史。
+    """
+    lines = []
+    if previous_summary:
+        lines.append(f"先前的摘要：\n{previous_summary}\n")
+    for message in messages:
+        speaker = "己方" if message["role"] == "assistant" else "對方"
+        lines.append(f"{speaker}：{message['content']}")
+    return [
+        {"role": "system", "content": "你是一位精確的會議記錄員。"},
+        {"role": "user", "content": (
+            "請以繁體中文將以下辯論內容濃縮成不超過300字的摘要，保留雙方的主要論點、立場與尚未解決的爭議。"
+            "只輸出摘要本身。\n\n" + "\n".join(lines)
+        )},
+    ]
+
+class ContextWindow:
+    """
+    一方AI的對話歷史，送出時只保留系統提示詞加上能放進token預算的最新訊息。
+
+    每則訊息的token數在加入時計算一次並快取，裁切只需移動起始索引，成本與歷史長度無關。
+    完整的歷史仍保留在 all_messages 中。
+
+    若提供摘要函式，被裁切掉的舊訊息會在背景濃縮成一份滾動摘要，放在送出的歷史最前面。
+    摘要尚未完成時不會等待，該回合直接使用先前的摘要，因此不會增加對話的等待時間。
+    """
+    def __init__(
+        self,
+        system_prompt: str,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        low_water: float = DEFAULT_LOW_WATER,
+        on_summary: Optional[Callable[[str], None]] = None
+    ):
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.token_budget = token_budget
+        self.low_water = low_water
+        self.all_messages: List[Dict[str, str]] = []
+        self._token_counts: List[int] = []
+        self._system_tokens = estimate_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        self._start = 0
+        self._window_tokens = 0
+        self.on_summary = on_summary
+        self.summary: Optional[str] = None
+        self._summary_tokens = 0
+        self._summarized_upto = 0
+        self._summary_future: Optional[Future] = None
+        self._summary_target = 0
+
+    def append(self, role: str, content: str):
+        """加入一則訊息 ('user' 或 'assistant')。"""
+        tokens = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        self.all_messages.append({"role": role, "content": content})
+        self._token_counts.append(tokens)
+        self._window_tokens += tokens
+
+    @property
+    def dropped_count(self) -> int:
+        """目前被排除在請求之外的舊訊息數量。"""
+        return self._start
+
+    @property
+    def window_tokens(self) -> int:
+        """目前送出的內容 (含系統提示詞與摘要) 估計的token數。"""
+        return self._system_tokens + self._summary_tokens + self._window_tokens
+
+    def compact_async(self, executor: Executor, summarize: Callable[[Optional[str], List[Dict[str, str]]], Optional[str]]):
+        """
+        先依預算裁切，再把已被裁掉但尚未摘要的訊息交給背景執行緒濃縮。
+
+        應在這一方剛回覆完、輪到對方生成時呼叫，讓摘要與對方的生成同時進行。
+
+        Args:
+            executor (Executor): 執行摘要工作的執行緒池。
+            summarize (Callable): 接收 (先前摘要, 要濃縮的訊息) 並返回新摘要的函式，失敗時返回None。
+        """
+        self._apply_finished_summary()
+        self._trim()
+        if self._summary_future is not None or self._start <= self._summarized_upto:
+            return
+        self._summary_target = self._start
+        pending = self.all_messages[self._summarized_upto:self._start]
+        self._summary_future = executor.submit(summarize, self.summary, pending)
+
+    def _apply_finished_summary(self):
+        """若背景摘要已完成，就採用它；尚未完成則不等待。"""
+        future = self._summary_future
+        if future is None or not future.done():
+            return
+        self._summary_future = None
+        try:
+            summary = future.result()
+        except Exception as e:
+            print(f"錯誤: 產生對話摘要時發生錯誤: {e}")
+            return
+        if not summary:
+            return
+        self.summary = summary
+        self._summarized_upto = self._summary_target
+        self._summary_tokens = (estimate_tokens(SUMMARY_PREFIX + summary) + estimate_tokens(SUMMARY_ACK)
+                                + 2 * MESSAGE_OVERHEAD_TOKENS)
+        if self.on_summary:
+            self.on_summary(summary)
+
+    def _drop_oldest(self):
+        self._window_tokens -= self._token_counts[self._start]
+        self._start += 1
+
+    def _trim(self):
+        """超出預算時，從最舊的訊息開始捨棄，直到降到低水位為止。最新一則訊息永遠保留。"""
+        available = self.token_budget - self._system_tokens - self._summary_tokens
+        if self._window_tokens <= available:
+            return
+        target = available * self.low_water
+        last = len(self.all_messages) - 1
+        while self._start < last and self._window_tokens > target:
+            self._drop_oldest()
+        # 對話歷史必須從使用者訊息開始，避免出現沒有提問的回覆
+        while self._start < last and self.all_messages[self._start]["role"] != "user":
+            self._drop_oldest()
+
+    def messages(self) -> List[Dict[str, str]]:
+        """返回本回合要送出的訊息列表：系統提示詞、滾動摘要 (若有) 與預算內最新的對話。"""
+        self._apply_finished_summary()
+        self._trim()
+        prefix = [self.system_message]
+        if self.summary:
+            prefix.append({"role": "user", "content": SUMMARY_PREFIX + self.summary})
+            prefix.append({"role": "assistant", "content": SUMMARY_ACK})
+        return prefix + self.all_messages[self._start:]
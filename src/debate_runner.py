@@ -0,0 +1,484 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import List, Dict, Any, Callable, Optional
+
+import ollama_client
+import ollama_pool
+import model_catalog
+import gemini_client
+import async_ollama_client
+import async_gemini_client
+import response_cache
+import rate_limiter
+import resilience
+import history_db
+from cancellation import CancelToken
+from context_window import ContextWindow, get_token_budget, build_summary_prompt
+
+# 單回合的模型載入時間超過此秒數時，在對話區提示模型曾被重新載入
+RELOAD_NOTICE_SECONDS = 0.5
+
+# 對話結束時送出的標記文字，UI據此恢復按鈕狀態
+END_MARKER = "\n--- 對話結束 ---\n"
+STOPPED_MARKER = "\n--- 對話被使用者提前終止 ---\n"
+# 結構化日誌中摘要記錄的發言者名稱前綴
+SUMMARY_SPEAKER_PREFIX = "對話摘要"
+
+def build_turn_metrics(model: str, wall_time: float, ttft: float, stats: Dict[str, Any],
+                       streamed: bool = True) -> Dict[str, Any]:
+    """
+    由客戶端回報的 stats 與本地計時，整理出單一回合的效能指標。
+
+    Args:
+        model (str): 模型名稱。
+        wall_time (float): 從送出請求到收到完整回應的秒數。
+        ttft (float): 從送出請求到收到第一段文字的秒數 (非流式傳輸時忽略，視為 wall_time)。
+        stats (Dict[str, Any]): 客戶端填入的token數與伺服器端計時。
+        streamed (bool): 回應是否以流式傳輸逐段收到。非流式的回應一次到達，
+            沒有「首字之後」的生成時間可用，生成速度改以整個 wall_time 計算。
+
+    Returns:
+        Dict[str, Any]: 包含 model, wall_time, ttft, prompt_tokens, completion_tokens, tokens_per_sec,
+            以及 resilience 回報的 attempts, breaker_opens, breaker_closes, error 的字典。
+    """
+    completion_tokens = stats.get("completion_tokens")
+    if not streamed:
+        ttft = wall_time
+    # 優先使用伺服器回報的純生成時間 (Ollama)，否則以收到第一段文字後的時間估算
+    if stats.get("eval_seconds"):
+        generation_seconds = stats["eval_seconds"]
+    elif streamed and wall_time > ttft:
+        generation_seconds = wall_time - ttft
+    else:
+        generation_seconds = wall_time
+    tokens_per_sec = completion_tokens / generation_seconds if completion_tokens and generation_seconds else None
+    return {
+        "model": model,
+        "wall_time": round(wall_time, 3),
+        "ttft": round(ttft, 3),
+        "prompt_tokens": stats.get("prompt_tokens"),
+        "completion_tokens": completion_tokens,
+        "tokens_per_sec": round(tokens_per_sec, 2) if tokens_per_sec else None,
+        "attempts": stats.get("attempts"),
+        "breaker_opens": stats.get("breaker_opens"),
+        "breaker_closes": stats.get("breaker_closes"),
+        "error": stats.get("error"),
+    }
+
+def apply_client_config(config: Dict[str, Any]):
+    """
+    將設定檔中與客戶端相關的選項套用到各模組 (API金鑰、回應快取、Ollama位址或端點池、模型列表快取、速率限制、重試與斷路器、keep_alive、連線池)。
+    GUI 與批次執行器共用。
+    """
+    gemini_api_key = config.get("gemini_api_key", "")
+    if gemini_api_key:
+        # 只記下金鑰，不在此阻塞驗證；需要時由呼叫端在背景呼叫 gemini_client.validate_api_key()
+        gemini_client.configure_api_key(gemini_api_key, validate=False)
+    cache_config = config.get("response_cache", {})
+    if cache_config.get("enabled"):
+        response_cache.configure(
+            cache_config.get("path", response_cache.DEFAULT_CACHE_PATH),
+            int(cache_config.get("max_mb", response_cache.DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024)
+    if config.get("ollama_base_url"):
+        ollama_client.set_base_url(config["ollama_base_url"])
+    if config.get("ollama_endpoints"):
+        ollama_pool.configure(config["ollama_endpoints"],
+                              float(config.get("ollama_probe_interval", ollama_pool.DEFAULT_PROBE_INTERVAL)),
+                              session_provider=ollama_client.get_session)
+    # 位址或端點池可能已改變，重建模型目錄讓模型列表重新查詢
+    model_catalog.configure(float(config.get("model_list_ttl", model_catalog.DEFAULT_TTL_SECONDS)))
+    if "rate_limits" in config:
+        rate_limiter.configure(config["rate_limits"])
+    if "resilience" in config:
+        resilience.configure(config["resilience"])
+    if "ollama_keep_alive" in config:
+        ollama_client.set_keep_alive(config["ollama_keep_alive"])
+    if "ollama_pool_connections" in config or "ollama_pool_maxsize" in config:
+        ollama_client.configure_session(
+            pool_connections=config.get("ollama_pool_connections", ollama_client.DEFAULT_POOL_CONNECTIONS),
+            pool_maxsize=config.get("ollama_pool_maxsize", ollama_client.DEFAULT_POOL_MAXSIZE))
+
+class DebateRunner:
+    """
+    執行一場兩個AI之間的對話，不依賴任何UI。
+
+    settings 的格式與 AppUI.get_settings() 相同。所有要顯示的文字都透過 emit 回呼送出，
+    完整內容則記錄在 structured_log 中，供 output_formatter 匯出。
+    run() 在呼叫端的執行緒中以同步客戶端執行；run_async() 以非同步客戶端執行，
+    讓單一事件迴圈同時驅動多場對話 (見 batch_runner 的 --async)。
+    """
+    def __init__(
+        self,
+        settings: Dict[str, Any],
+        config: Optional[Dict[str, Any]] = None,
+        emit: Optional[Callable[[str], None]] = None,
+        stop_event: Optional[threading.Event] = None,
+        backend_limits: Optional[Dict[str, threading.Semaphore]] = None,
+        on_metrics: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+        on_turn_start: Optional[Callable[[int], None]] = None,
+        history: Optional[Any] = None
+    ):
+        """
+        Args:
+            settings (Dict[str, Any]): 對話設定 (來源、模型、角色、主題、回合數、風格)。
+            config (Dict[str, Any], optional): 設定檔內容，用於token預算與摘要模型等選項。
+            emit (Callable[[str], None], optional): 接收要顯示文字的回呼；None 表示不輸出。
+            stop_event (threading.Event, optional): 設定後，對話會在下一回合開始前停止。
+                若為 CancelToken，進行中的請求也會立即中止。預設會建立一個新的 CancelToken。
+            backend_limits (Dict[str, threading.Semaphore], optional): 以模型來源為鍵的號誌，
+                用來限制同一後端同時進行中的請求數。run_async() 使用 asyncio.Semaphore。
+            on_metrics (Callable, optional): 每回合結束後以目前所有回合的效能指標列表呼叫。
+            on_turn_start (Callable[[int], None], optional): 每一方發言開始、送出標題文字之前以發言序號 (由0起) 呼叫，
+                UI 據此將對話區分段。
+            history (history_db.HistoryDB, optional): 對話紀錄資料庫；設定後每一筆記錄在產生時就立即寫入，
+                中途當機也不會遺失已完成的回合。
+        """
+        self.settings = settings
+        self.config = config or {}
+        self.emit = emit or (lambda text: None)
+        self.stop_event = stop_event or CancelToken()
+        # 只有 CancelToken 能中止進行中的請求；一般的 threading.Event 仍只在回合之間檢查
+        self.cancel_token = self.stop_event if isinstance(self.stop_event, CancelToken) else None
+        self.backend_limits = backend_limits or {}
+        self.on_metrics = on_metrics
+        self.on_turn_start = on_turn_start
+        self.structured_log: List[Dict[str, Any]] = []
+        self.recorder = history_db.SessionRecorder(history, settings) if history is not None else None
+        self.turn_metrics: List[Dict[str, Any]] = []
+        # 每一方的會話識別碼：Gemini 據此沿用聊天會話，Ollama 端點池據此固定路由
+        conversation_id = uuid.uuid4().hex
+        self.sessions = {n: f"{conversation_id}-{n}" for n in (1, 2)}
+
+    def _warm_up_targets(self):
+        """返回要預載的 (模型, 固定路由鍵)；沒有端點池時同一個模型只預載一次。"""
+        settings = self.settings
+        # 使用端點池時，每一方的模型要預載在之後會固定送往的那台伺服器上
+        pooled = ollama_pool.get_pool() is not None
+        targets = {}
+        for n in (1, 2):
+            if settings[f'source{n}'] == 'Ollama':
+                model = settings[f'model{n}']
+                targets.setdefault((model, self.sessions[n]) if pooled else model, (model, self.sessions[n]))
+        return targets
+
+    def warm_up_models(self):
+        """
+        在第一回合前同時預載兩方使用的Ollama模型，並回報各自的載入時間。
+        模型若已在記憶體中，這個請求幾乎會立即返回。
+        """
+        targets = self._warm_up_targets()
+        results = {}
+        def warm(model, affinity):
+            results[model] = ollama_client.warm_up_model(model, cancel_token=self.cancel_token, affinity=affinity)
+        threads = [threading.Thread(target=warm, args=target, daemon=True) for target in targets.values()]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self._report_warm_up(results)
+
+    async def warm_up_models_async(self):
+        """warm_up_models() 的非同步版本，兩方的模型在同一個事件迴圈中同時預載。"""
+        targets = self._warm_up_targets()
+        results = await asyncio.gather(*(
+            async_ollama_client.warm_up_model(model, cancel_token=self.cancel_token, affinity=affinity)
+            for model, affinity in targets.values()))
+        self._report_warm_up(dict(zip((model for model, _ in targets.values()), results)))
+
+    def _report_warm_up(self, results):
+        for model, result in results.items():
+            if result is not None:
+                self.emit(f"模型 {model} 已就緒 (載入 {result['load_seconds']:.2f} 秒，請求共 {result['wall_seconds']:.2f} 秒)\n")
+
+    def context_length(self, n):
+        """返回第 n 方Ollama模型在 Modelfile 中設定的上下文長度 (num_ctx)，未設定或非Ollama時為None。"""
+        if self.settings[f'source{n}'] != 'Ollama':
+            return None
+        info = model_catalog.get_model_info(self.settings[f'model{n}'])
+        return info.get("num_ctx") if info else None
+
+    def summarize_history(self, previous_summary, messages):
+        """(摘要執行緒) 使用設定檔中的摘要模型，將舊回合與先前的摘要濃縮成新的摘要。"""
+        model = self.config["summary_model"]
+        prompt = build_summary_prompt(previous_summary, messages)
+        limit = self.backend_limits.get(self.config.get("summary_source", "Ollama"))
+        # run_async() 的 asyncio.Semaphore 無法在摘要執行緒中使用，此時只受 rate_limiter 與端點池的限制
+        with limit if isinstance(limit, threading.Semaphore) else nullcontext():
+            if self.config.get("summary_source", "Ollama") == "Ollama":
+                return ollama_client.generate_response(model, prompt)
+            return gemini_client.generate_response(model, prompt[0]["content"], prompt)
+
+    def log(self, entry: Dict[str, Any]):
+        """將一筆記錄加入結構化日誌，並在有設定對話紀錄資料庫時立即寫入。"""
+        self.structured_log.append(entry)
+        if self.recorder is not None:
+            self.recorder.append(entry)
+
+    def log_summary(self, persona_name, summary):
+        """將新採用的摘要記錄到結構化日誌，原始回合仍完整保留。"""
+        self.log({'speaker': f"{SUMMARY_SPEAKER_PREFIX} ({persona_name})", 'content': summary})
+
+    def _response_hooks(self):
+        """
+        request_response() 與其非同步版本共用的回呼：on_token 送出文字並記下首個token的時間，
+        on_retry 在重試前提示並重設該時間。返回 (計時用的字典, on_token, on_retry)。
+        """
+        timing = {"first_token_at": None}
+        def on_token(delta):
+            if timing["first_token_at"] is None:
+                timing["first_token_at"] = time.perf_counter()
+            self.emit(delta)
+
+        def on_retry(retry, error):
+            # 首個token時間以成功的那次嘗試為準，失敗嘗試收到的token不算
+            timing["first_token_at"] = None
+            # 流式傳輸失敗前已顯示的部分文字保留在畫面上，重試的回應從新的一行開始
+            self.emit(f"\n(請求失敗: {error}，重試第 {retry} 次...)\n")
+        return timing, on_token, on_retry
+
+    def _finish_response(self, source, model, response, stats, start, end, first_token_at):
+        """送出回應結尾 (含模型重新載入的提示)，返回本回合的效能指標。"""
+        if response is not None:
+            self.emit("\n")
+            # 模型在回合之間被卸載時，將重新載入與實際生成的時間分開顯示
+            if stats.get("load_seconds", 0) >= RELOAD_NOTICE_SECONDS:
+                self.emit(f"(模型 {model} 重新載入 {stats['load_seconds']:.2f} 秒，生成 {stats.get('eval_seconds', 0):.2f} 秒)\n")
+        streamed = source == 'Ollama'
+        ttft = (first_token_at or end) - start
+        return build_turn_metrics(model, end - start, ttft, stats, streamed=streamed)
+
+    def request_response(self, source, model, system_prompt, history, session_id=None):
+        """
+        向指定來源請求一則回應並送出顯示。
+
+        Ollama 使用流式傳輸，每收到一段文字就立即送出；
+        其他來源則在完整回應產生後一次送出。session_id 讓Gemini沿用同一個聊天會話，
+        並讓Ollama端點池將同一方的請求固定送往同一台伺服器。
+        請求經由 resilience.call_with_resilience() 送出：暫時性錯誤會在回合時間預算內重試，
+        連續失敗的模型會被斷路器暫時擋下。
+
+        Returns:
+            Tuple[Optional[str], Dict[str, Any]]: AI的回應 (失敗或被取消時為None) 與本回合的效能指標。
+        """
+        stats = {}
+        timing, on_token, on_retry = self._response_hooks()
+
+        def attempt(cancel_token, attempt_stats):
+            if source == 'Ollama':
+                return ollama_client.generate_response_stream(model, history, on_token=on_token, stats=attempt_stats,
+                                                              cancel_token=cancel_token, affinity=session_id)
+            response = gemini_client.generate_response(model, system_prompt, history, session_id=session_id,
+                                                       stats=attempt_stats, cancel_token=cancel_token)
+            if response is not None:
+                self.emit(response)
+            return response
+
+        with self.backend_limits.get(source, nullcontext()):
+            # 在取得後端號誌之後才開始計時，排隊等待的時間不算在回合延遲內
+            start = time.perf_counter()
+            # 每次嘗試都會取得新的 CancelToken：使用者停止或超出回合時間預算時立即中止
+            response = resilience.call_with_resilience(source, model, attempt, cancel_token=self.stop_event,
+                                                       stats=stats, on_retry=on_retry)
+            end = time.perf_counter()
+        return response, self._finish_response(source, model, response, stats, start, end, timing["first_token_at"])
+
+    async def request_response_async(self, source, model, system_prompt, history, session_id=None):
+        """request_response() 的非同步版本，使用非同步客戶端與 resilience.call_with_resilience_async()。"""
+        stats = {}
+        timing, on_token, on_retry = self._response_hooks()
+
+        async def attempt(cancel_token, attempt_stats):
+            if source == 'Ollama':
+                return await async_ollama_client.generate_response_stream(
+                    model, history, on_token=on_token, stats=attempt_stats, cancel_token=cancel_token, affinity=session_id)
+            response = await async_gemini_client.generate_response(model, system_prompt, history, session_id=session_id,
+                                                                   stats=attempt_stats, cancel_token=cancel_token)
+            if response is not None:
+                self.emit(response)
+            return response
+
+        async with self.backend_limits.get(source, nullcontext()):
+            start = time.perf_counter()
+            response = await resilience.call_with_resilience_async(source, model, attempt, cancel_token=self.stop_event,
+                                                                   stats=stats, on_retry=on_retry)
+            end = time.perf_counter()
+        return response, self._finish_response(source, model, response, stats, start, end, timing["first_token_at"])
+
+    def _prepare(self):
+        """
+        run() 與 run_async() 共用：組合兩方的系統提示詞與上下文視窗，並送出角色介紹。
+
+        Returns:
+            Tuple: (兩方的系統提示詞, 兩方的 ContextWindow, 角色介紹的日誌記錄)。
+        """
+        settings = self.settings
+        persona_final_prompts = {1: settings["persona1_prompt"], 2: settings["persona2_prompt"]}
+        if settings["style_prompt"]:
+            style_directive = f"\n\n--- 對話風格指令 ---\n{settings['style_prompt']}"
+            for n in (1, 2):
+                persona_final_prompts[n] += style_directive
+        budgets = self.config.get("context_budgets")
+        histories = {
+            n: ContextWindow(persona_final_prompts[n], get_token_budget(settings[f'source{n}'], settings[f'model{n}'], budgets,
+                                                                        self.context_length(n)),
+                             on_summary=lambda summary, name=settings[f'persona{n}_name']: self.log_summary(name, summary))
+            for n in (1, 2)
+        }
+        header = (f"角色介紹\n"
+                  f"角色A：預設角色({settings['persona1_name']})\n"
+                  f"提示詞：\n{settings['persona1_prompt']}\n\n"
+                  f"角色B：預設角色({settings['persona2_name']})\n"
+                  f"提示詞：\n{settings['persona2_prompt']}\n")
+        if settings["style_prompt"]:
+            header += f"\n對話風格指令：\n{settings['style_prompt']}\n"
+        header += "==========================================\n"
+        self.emit(header)
+        return persona_final_prompts, histories, {'speaker': 'System', 'content': header}
+
+    def _opening_message(self):
+        return f"關於主題： '{self.settings['topic']}'\n請您針對此主題，開始進行第一回合的發言。"
+
+    def _start_turn(self, i, histories, current_message):
+        """送出第 i 次發言的標題並將對方的上一則訊息加入這一方的歷史，返回 (n, 顯示名稱, 日誌中的發言者名稱)。"""
+        settings = self.settings
+        turn_number = (i // 2) + 1
+        n = 1 if i % 2 == 0 else 2
+        label = "角色A" if n == 1 else "角色B"
+        speaker_name = f"{label}：{settings[f'persona{n}_name']},模型：{settings[f'model{n}']}"
+        log_speaker_name = f"{label}：{settings[f'persona{n}_name']}"
+        if self.on_turn_start:
+            self.on_turn_start(i)
+        self.emit(f"\n第{turn_number}回合對話 ({speaker_name}):\n")
+        histories[n].append("user", current_message)
+        return n, speaker_name, log_speaker_name
+
+    def _failed_turn(self, metrics, speaker_name) -> str:
+        """沒有取得回應時送出原因，返回對話的最終狀態。"""
+        if self.stop_event.is_set():
+            self.emit(STOPPED_MARKER)
+            return "stopped"
+        if metrics.get("error") == "circuit_open":
+            self.emit(f"{speaker_name} 近期連續失敗，暫停送出請求，對話終止。\n")
+        else:
+            self.emit(f"無法從 {speaker_name} 獲取回應，對話終止。\n")
+        return "failed"
+
+    def _end_turn(self, history, response, metrics, summary_executor):
+        """回合成功後更新效能指標與這一方的歷史；有設定摘要模型時在背景濃縮被裁切的舊回合。"""
+        self.turn_metrics.append(metrics)
+        if self.on_metrics:
+            self.on_metrics(self.turn_metrics)
+        history.append("assistant", response)
+        if summary_executor:
+            history.compact_async(summary_executor, self.summarize_history)
+
+    def _release(self, summary_executor):
+        # 發生例外時也要釋放會話快取與端點池的固定路由，不讓它們留在記憶體中
+        if summary_executor:
+            summary_executor.shutdown(wait=False, cancel_futures=True)
+        for session_id in self.sessions.values():
+            gemini_client.release_session(session_id)
+            ollama_client.release_session(session_id)
+
+    def _end_output(self, cache_start, cache_stats):
+        if cache_stats is not None:
+            # 快取的計數是所有對話共用的累計值，只回報這場對話期間的增量
+            hits = cache_stats['hits'] - cache_start['hits']
+            misses = cache_stats['misses'] - cache_start['misses']
+            self.emit(f"\n(回應快取：命中 {hits} 次，未命中 {misses} 次)\n")
+        self.emit(END_MARKER)
+
+    def run(self) -> List[Dict[str, Any]]:
+        """
+        執行整場對話。
+
+        Returns:
+            List[Dict[str, Any]]: 結構化的對話日誌 (與 self.structured_log 為同一個列表)。
+        """
+        settings = self.settings
+        cache = response_cache.get_cache()
+        cache_start = cache.stats() if cache is not None else None
+        # 有設定摘要模型時，被裁切的舊回合會在對方生成的同時於背景濃縮成摘要
+        summary_executor = ThreadPoolExecutor(max_workers=2) if self.config.get("summary_model") else None
+        persona_final_prompts, histories, header_entry = self._prepare()
+        self.log(header_entry)
+        status = "finished"
+        try:
+            self.warm_up_models()
+            current_message = self._opening_message()
+            for i in range(settings['turns'] * 2):
+                if self.stop_event.is_set():
+                    self.emit(STOPPED_MARKER)
+                    status = "stopped"
+                    break
+                n, speaker_name, log_speaker_name = self._start_turn(i, histories, current_message)
+                response, metrics = self.request_response(settings[f'source{n}'], settings[f'model{n}'], persona_final_prompts[n],
+                                                          histories[n].messages(), self.sessions[n])
+                if response is None:
+                    status = self._failed_turn(metrics, speaker_name)
+                    break
+                current_message = response
+                self.log({'speaker': log_speaker_name, 'content': current_message, **metrics})
+                self._end_turn(histories[n], current_message, metrics, summary_executor)
+        except BaseException:
+            status = "failed"
+            raise
+        finally:
+            self._release(summary_executor)
+            # 記錄對話的最終狀態，不讓它停在 "running"
+            if self.recorder is not None:
+                self.recorder.finish(status)
+        self._end_output(cache_start, cache.stats() if cache is not None else None)
+        return self.structured_log
+
+    async def _log_async(self, entry: Dict[str, Any]):
+        """run_async() 使用的 log()：對話紀錄資料庫是同步的SQLite，在執行緒池中寫入以免阻塞事件迴圈。"""
+        if self.recorder is None:
+            self.log(entry)
+        else:
+            await asyncio.to_thread(self.log, entry)
+
+    async def run_async(self) -> List[Dict[str, Any]]:
+        """
+        run() 的非同步版本：以非同步客戶端執行整場對話，等待回應時不佔用執行緒，
+        同一個事件迴圈可同時執行多場對話。stop_event 可由其他執行緒設定。
+
+        Returns:
+            List[Dict[str, Any]]: 結構化的對話日誌 (與 self.structured_log 為同一個列表)。
+        """
+        settings = self.settings
+        cache = response_cache.get_cache()
+        cache_start = await asyncio.to_thread(cache.stats) if cache is not None else None
+        summary_executor = ThreadPoolExecutor(max_workers=2) if self.config.get("summary_model") else None
+        persona_final_prompts, histories, header_entry = self._prepare()
+        await self._log_async(header_entry)
+        status = "finished"
+        try:
+            await self.warm_up_models_async()
+            current_message = self._opening_message()
+            for i in range(settings['turns'] * 2):
+                if self.stop_event.is_set():
+                    self.emit(STOPPED_MARKER)
+                    status = "stopped"
+                    break
+                n, speaker_name, log_speaker_name = self._start_turn(i, histories, current_message)
+                response, metrics = await self.request_response_async(
+                    settings[f'source{n}'], settings[f'model{n}'], persona_final_prompts[n],
+                    histories[n].messages(), self.sessions[n])
+                if response is None:
+                    status = self._failed_turn(metrics, speaker_name)
+                    break
+                current_message = response
+                await self._log_async({'speaker': log_speaker_name, 'content': current_message, **metrics})
+                self._end_turn(histories[n], current_message, metrics, summary_executor)
+        except BaseException:
+            status = "failed"
+            raise
+        finally:
+            self._release(summary_executor)
+            if self.recorder is not None:
+                await asyncio.to_thread(self.recorder.finish, status)
+        self._end_output(cache_start, await asyncio.to_thread(cache.stats) if cache is not None else None)
+        return self.structured_log
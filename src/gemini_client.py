@@ -1,5 +1,11 @@
-import google.generativeai as genai
-from typing import List, Dict, Optional
+import threading
+import requests
+from typing import List, Dict, Any, Optional, Tuple
+
+import response_cache
+from resilience import classify_error
+import rate_limiter
+from cancellation import CancelToken, CancelledError, run_cancellable
 
 # 使用者指定的Gemini模型列表 (使用官方API ID)
 SUPPORTED_MODELS = [
@@ -9,71 +15,278 @@ SUPPORTED_MODELS = [
     "gemini-2.5-flash-lite",
 ]
 
-def configure_api_key(api_key: str) -> bool:
+class _ChatState:
+    """
+    一場對話中某一方的Gemini聊天會話快取。
+
+    ChatSession 內部已保存轉換好的歷史紀錄，之後每回合只需送出最新的使用者訊息。
+    synced_len / first_content / last_content 用來確認呼叫端傳入的歷史與會話內容一致。
+    """
+    __slots__ = ("chat", "synced_len", "first_content", "last_content")
+
+    def __init__(self, chat, synced_len: int, first_content: Optional[str], last_content: Optional[str]):
+        self.chat = chat
+        self.synced_len = synced_len
+        self.first_content = first_content
+        self.last_content = last_content
+
+# 以 (session_id, model_name, system_prompt) 為鍵的聊天會話與模型快取。
+# 兩者都依最近使用的順序保留有限的數量：對話結束時會以 release_session() 釋放會話，
+# 上限只是防止未正常結束的對話或大量不同的系統提示詞讓快取無限增長；被移除的會話下一回合會依完整歷史重建
+MAX_CHAT_SESSIONS = 64
+MAX_CACHED_MODELS = 32
+_chat_sessions: Dict[Tuple[str, str, str], _ChatState] = {}
+_models: Dict[Tuple[str, str], "genai.GenerativeModel"] = {}
+_sessions_lock = threading.Lock()
+
+# 目前的API金鑰，以及已送進SDK的金鑰；SDK在第一次實際使用時才載入並設定
+_api_key: Optional[str] = None
+_configured_key: Optional[str] = None
+_genai_lock = threading.Lock()
+# 每個金鑰確定的驗證結果 (True/False)，避免重複向伺服器驗證；網路錯誤等無法判斷的結果不會記錄
+_key_status: Dict[str, bool] = {}
+# 驗證金鑰時查詢的模型列表端點；直接以HTTP請求帶上金鑰，不經過SDK的全域設定
+KEY_VALIDATION_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+KEY_VALIDATION_TIMEOUT = 10
+
+def _genai():
+    """
+    延遲匯入 google.generativeai 並套用目前的API金鑰。
+
+    這個SDK匯入需要數百毫秒，只在第一次真正呼叫Gemini時才載入，讓應用程式的啟動不受影響。
+    """
+    global _configured_key
+    import google.generativeai as genai
+    with _genai_lock:
+        if _api_key and _configured_key != _api_key:
+            genai.configure(api_key=_api_key)
+            _configured_key = _api_key
+    return genai
+
+def configure_api_key(api_key: str, validate: bool = True) -> bool:
     """
     設定Google Gemini API金鑰。
 
     Args:
         api_key (str): 使用者的API金鑰。
+        validate (bool): 是否先向伺服器驗證金鑰 (需要一次網路請求，會阻塞呼叫端)；驗證未通過時不會取代目前的金鑰。
+            False 時只記下金鑰，可稍後在背景呼叫 validate_api_key()。
 
     Returns:
-        bool: 如果金鑰被設定則返回True，否則False。
+        bool: 如果金鑰被設定 (且驗證時有效) 則返回True，否則False。
     """
+    global _api_key
     if not api_key:
         return False
-    try:
-        genai.configure(api_key=api_key)
-        # 嘗試列出模型以驗證金鑰是否有效
-        genai.list_models()
-        return True
-    except Exception as e:
-        print(f"錯誤: 設定Gemini API金鑰時發生問題: {e}")
+    if validate and not validate_api_key(api_key):
         return False
+    _api_key = api_key
+    return True
+
+def validate_api_key(api_key: Optional[str] = None) -> Optional[bool]:
+    """
+    以列出模型的請求驗證金鑰是否有效，並快取確定的結果 (見 get_key_status())。
+
+    驗證只用這把金鑰送出一次HTTP請求，不會改變目前使用中的金鑰，可用來檢查使用者剛輸入的候選金鑰。
+
+    Args:
+        api_key (str, optional): 要驗證的金鑰，預設為目前的金鑰。
+
+    Returns:
+        Optional[bool]: 有效時為True，伺服器拒絕時為False；網路或伺服器錯誤而無法判斷時為None (不快取，下次會重新驗證)。
+    """
+    api_key = api_key or _api_key
+    if not api_key:
+        return False
+    if api_key in _key_status:
+        return _key_status[api_key]
+    try:
+        response = requests.get(KEY_VALIDATION_URL, params={"key": api_key, "pageSize": 1},
+                                timeout=KEY_VALIDATION_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        print(f"錯誤: 無法連線驗證Gemini API金鑰: {e}")
+        return None
+    if response.ok:
+        valid = True
+    elif 400 <= response.status_code < 500 and response.status_code != 429:
+        print(f"錯誤: Gemini API金鑰無效 (HTTP {response.status_code})。")
+        valid = False
+    else:
+        print(f"錯誤: 暫時無法驗證Gemini API金鑰 (HTTP {response.status_code})。")
+        return None
+    _key_status[api_key] = valid
+    return valid
+
+def get_key_status(api_key: Optional[str] = None) -> Optional[bool]:
+    """返回金鑰的快取驗證結果；尚未驗證時為None。"""
+    return _key_status.get(api_key or _api_key)
+
+def to_gemini_history(conversation_history: List[Dict[str, str]]) -> List[Dict]:
+    """
+    將Ollama格式 ('user'/'assistant') 的對話歷史轉換為Gemini格式 ('user'/'model')。
+    同步與非同步 (async_gemini_client) 客戶端共用此轉換。
+    """
+    gemini_history = []
+    for message in conversation_history:
+        # 系統提示詞透過 system_instruction 傳入，不放進對話歷史
+        if message['role'] == 'system':
+            continue
+        role = 'user' if message['role'] == 'user' else 'model'
+        gemini_history.append({'role': role, 'parts': [message['content']]})
+    return gemini_history
+
+def _remember(cache: Dict, key, value, limit: int):
+    """(需持有 _sessions_lock) 將 key 移到最近使用的位置，超過 limit 時移除最久未使用的項目。"""
+    cache.pop(key, None)
+    cache[key] = value
+    while len(cache) > limit:
+        del cache[next(iter(cache))]
+
+def _get_model(model_name: str, system_prompt: str) -> "genai.GenerativeModel":
+    """取得 (或建立並快取) 指定模型與系統提示詞的 GenerativeModel。"""
+    key = (model_name, system_prompt)
+    # 第一次呼叫時 _genai() 會匯入SDK (需時數百毫秒)，必須在取得鎖之前完成，以免阻塞其他對話與 release_session()
+    genai = _genai()
+    with _sessions_lock:
+        model = _models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(model_name=model_name, system_instruction=system_prompt)
+        _remember(_models, key, model, MAX_CACHED_MODELS)
+    return model
+
+def prepare_chat(
+    model_name: str,
+    system_prompt: str,
+    conversation_history: List[Dict[str, str]],
+    session_id: Optional[str] = None
+) -> Tuple[Optional[_ChatState], Optional[str]]:
+    """
+    取得可直接送出最新使用者訊息的聊天會話，同步與非同步客戶端共用。
+
+    若快取中的會話與傳入的歷史一致，就沿用它，只需送出最後一則訊息；
+    否則 (第一回合、歷史被裁切或先前請求失敗) 才依完整歷史重建一次會話。
+    session_id 為None時是一次性的請求 (例如摘要)：每次建立新的會話且不放入快取，
+    同時進行的多個請求不會共用同一個 ChatSession。
+
+    Returns:
+        Tuple[Optional[_ChatState], Optional[str]]: 會話狀態與要送出的使用者訊息；
+            若歷史的最後一則訊息不是來自使用者則返回 (None, None)。
+    """
+    dialogue = conversation_history[1:] if conversation_history and conversation_history[0]['role'] == 'system' else conversation_history
+    if not dialogue or dialogue[-1]['role'] != 'user':
+        print("錯誤: 對話歷史的最後一則訊息不是來自使用者。")
+        return None, None
+
+    prior = dialogue[:-1]
+    first_content = prior[0]['content'] if prior else None
+    last_content = prior[-1]['content'] if prior else None
+    key = (session_id, model_name, system_prompt)
+    state = None
+    if session_id is not None:
+        with _sessions_lock:
+            state = _chat_sessions.get(key)
+    if (state is None or state.synced_len != len(prior)
+            or state.first_content != first_content or state.last_content != last_content):
+        chat = _get_model(model_name, system_prompt).start_chat(history=to_gemini_history(prior))
+        state = _ChatState(chat, len(prior), first_content, last_content)
+    if session_id is not None:
+        with _sessions_lock:
+            _remember(_chat_sessions, key, state, MAX_CHAT_SESSIONS)
+    return state, dialogue[-1]['content']
+
+def commit_chat(state: _ChatState, prompt: str, reply: str):
+    """在成功送出一則訊息後，更新會話狀態以反映新增的使用者訊息與模型回覆。"""
+    if state.synced_len == 0:
+        state.first_content = prompt
+    state.synced_len += 2
+    state.last_content = reply
+
+def discard_chat(model_name: str, system_prompt: str, session_id: Optional[str] = None):
+    """丟棄一個可能已不一致的會話 (例如請求失敗後)，下一回合將依完整歷史重建。"""
+    with _sessions_lock:
+        _chat_sessions.pop((session_id, model_name, system_prompt), None)
+
+def release_session(session_id: Optional[str]):
+    """對話結束時釋放該對話所有的聊天會話快取。"""
+    with _sessions_lock:
+        for key in [k for k in _chat_sessions if k[0] == session_id]:
+            del _chat_sessions[key]
+
+def fill_usage(stats: Optional[Dict[str, Any]], response):
+    """將Gemini回應的 usage_metadata 以 prompt_tokens / completion_tokens 寫入 stats。"""
+    usage = getattr(response, "usage_metadata", None)
+    if stats is None or usage is None:
+        return
+    stats["prompt_tokens"] = usage.prompt_token_count
+    stats["completion_tokens"] = usage.candidates_token_count
+
+def usage_tokens(response) -> Optional[int]:
+    """返回回應實際消耗的token總數，供速率限制器修正TPM額度。"""
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage is not None else None
 
 def generate_response(
     model_name: str,
     system_prompt: str,
-    conversation_history: List[Dict[str, str]]
+    conversation_history: List[Dict[str, str]],
+    session_id: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    cancel_token: Optional[CancelToken] = None
 ) -> Optional[str]:
     """
     使用指定的Gemini模型生成一個新的回應。
 
+    同一個 session_id、模型與系統提示詞會沿用同一個聊天會話，
+    每回合只送出最新的使用者訊息，而不是重建整段歷史。
+
     Args:
         model_name (str): 要使用的模型名稱 (例如, "gemini-1.5-flash")。
         system_prompt (str): AI的系統提示詞/角色設定。
         conversation_history (List[Dict[str, str]]): 對話歷史記錄。
             Gemini的格式與Ollama稍有不同，它需要 'user' 和 'model' 角色。
+        session_id (str, optional): 對話中某一方的識別碼，用來區分不同的聊天會話；
+            未指定時為一次性請求，不沿用也不保留會話。
+        stats (Dict[str, Any], optional): 若提供，會填入本次請求的token用量與速率限制的排隊時間。
+        cancel_token (CancelToken, optional): 被設定時不再等待回應，立即返回None，stats 中會標記 cancelled。
 
     Returns:
-        Optional[str]: AI生成的回應內容。如果發生錯誤則返回None。
+        Optional[str]: AI生成的回應內容。如果發生錯誤或被取消則返回None。
     """
     if model_name not in SUPPORTED_MODELS:
         print(f"錯誤: 不支援的模型 '{model_name}'。")
         return None
 
+    cache_key, cached = response_cache.lookup("gemini", model_name, system_prompt, conversation_history)
+    if cached is not None:
+        if stats is not None:
+            stats["cache_hit"] = True
+        return cached
+
     try:
-        model = genai.GenerativeModel(
-            model_name=model_name,
-            system_instruction=system_prompt
-        )
-
-        # 將Ollama格式 ('user'/'assistant') 轉換為Gemini格式 ('user'/'model')
-        gemini_history = []
-        for message in conversation_history:
-            role = 'user' if message['role'] == 'user' else 'model'
-            gemini_history.append({'role': role, 'parts': [message['content']]})
-
-        # 從歷史紀錄中找到最後一個 'user' 的訊息來發送
-        if gemini_history and gemini_history[-1]['role'] == 'user':
-            last_user_prompt = gemini_history[-1]['parts'][0]
-            # 建立一個帶有先前歷史的對話
-            chat = model.start_chat(history=gemini_history[:-1])
-            response = chat.send_message(last_user_prompt)
-            return response.text
-        else:
-            print("錯誤: 對話歷史的最後一則訊息不是來自使用者。")
+        state, last_user_prompt = prepare_chat(model_name, system_prompt, conversation_history, session_id)
+        if state is None:
             return None
+        # 依該模型的RPM/TPM額度排隊，429 時依 Retry-After 退避重試；
+        # SDK的請求無法從外部中斷，因此在背景執行緒中等待，取消時直接放棄這次請求
+        response = rate_limiter.call_with_limits(
+            "gemini", model_name, rate_limiter.estimate_request_tokens(conversation_history, system_prompt),
+            lambda: run_cancellable(cancel_token, state.chat.send_message, last_user_prompt),
+            cancel_token=cancel_token, stats=stats, usage=usage_tokens)
+        commit_chat(state, last_user_prompt, response.text)
+        fill_usage(stats, response)
+        response_cache.store(cache_key, response.text)
+        return response.text
 
+    except CancelledError:
+        # 被放棄的請求仍可能在背景寫入會話歷史，因此丟棄會話，下一回合依完整歷史重建
+        discard_chat(model_name, system_prompt, session_id)
+        if stats is not None:
+            stats["cancelled"] = True
+        return None
     except Exception as e:
         print(f"錯誤: Gemini API請求失敗: {e}")
-        return f"Gemini API 錯誤: {e}"
+        if stats is not None:
+            stats["error"] = classify_error(e)
+        discard_chat(model_name, system_prompt, session_id)
+        # 不將錯誤訊息當作回應返回，以免被當成對話內容傳給另一方
+        return None
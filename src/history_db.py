@@ -0,0 +1,505 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+import output_formatter
+
+# 對話紀錄資料庫檔案
+DEFAULT_HISTORY_PATH = "history.sqlite3"
+# 舊版以 .txt/.json 檔案存放對話紀錄的資料夾
+LEGACY_HISTORY_DIR = "history"
+# 歷史紀錄視窗每一頁列出的對話數
+PAGE_SIZE = 50
+# 檢視歷史紀錄時，每次從資料庫讀取並插入對話區的字元數
+TRANSCRIPT_CHUNK_CHARS = 16000
+
+# structured_log 每筆記錄中獨立存成欄位的鍵，其餘 (效能指標等) 以JSON存放
+_ENTRY_FIELDS = ("speaker", "content")
+# 搜尋結果中的關鍵字標記與摘錄長度
+SNIPPET_OPEN, SNIPPET_CLOSE, SNIPPET_ELLIPSIS = "【", "】", "…"
+SNIPPET_TOKENS = 24
+# trigram 分詞器只能以索引比對至少三個字元的詞，較短的詞改用 LIKE 篩選
+TRIGRAM_MIN_CHARS = 3
+# 符合的記錄超過這個數量時不以 bm25 排名 (為每一筆計分太慢)，改為由新到舊列出
+RANKED_MATCH_LIMIT = 5000
+# 搜尋索引中代表對話資訊 (主題、角色、模型) 的列，speaker 欄位使用這個名稱
+SESSION_INFO_SPEAKER = "對話資訊"
+
+# 全文搜尋索引：每一回合一列 (rowid 與 turns 相同)，每場對話另有一列對話資訊 (rowid 為負的對話編號)。
+# 以觸發程序在同一個交易中維護，寫入回合時索引就同步更新。
+_FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE history_fts USING fts5("
+    " session_id UNINDEXED, position UNINDEXED, speaker, content, tokenize='trigram');"
+    "CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN"
+    " INSERT INTO history_fts (rowid, session_id, position, speaker, content)"
+    " VALUES (new.rowid, new.session_id, new.position, new.speaker, new.content); END;"
+    "CREATE TRIGGER IF NOT EXISTS turns_fts_delete AFTER DELETE ON turns BEGIN"
+    " DELETE FROM history_fts WHERE rowid = old.rowid; END;"
+    "CREATE TRIGGER IF NOT EXISTS sessions_fts_insert AFTER INSERT ON sessions BEGIN"
+    " INSERT INTO history_fts (rowid, session_id, position, speaker, content)"
+    f" VALUES (-new.id, new.id, 0, '{SESSION_INFO_SPEAKER}',"
+    " new.topic || ' ' || new.persona1 || ' ' || new.persona2 || ' ' || new.model1 || ' ' || new.model2); END;"
+    "CREATE TRIGGER IF NOT EXISTS sessions_fts_delete AFTER DELETE ON sessions BEGIN"
+    " DELETE FROM history_fts WHERE rowid = -old.id; END;"
+)
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+class HistoryDB:
+    """
+    以SQLite儲存對話紀錄，每一回合在產生時就寫入一列並提交。
+
+    使用WAL模式，每次寫入只附加一列到日誌，不必重寫整場對話；程式中途當機時，
+    已完成的回合都還保存在資料庫中，下次啟動可在歷史紀錄視窗中檢視。
+    所有操作以同一把鎖序列化，對話執行緒與UI執行緒可共用。
+    """
+    def __init__(self, path: str = DEFAULT_HISTORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # 每次提交都同步到磁碟，斷電時也不會遺失已完成的回合
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " started_at TEXT NOT NULL,"
+            " updated_at TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " topic TEXT NOT NULL DEFAULT '',"
+            " persona1 TEXT NOT NULL DEFAULT '',"
+            " persona2 TEXT NOT NULL DEFAULT '',"
+            " model1 TEXT NOT NULL DEFAULT '',"
+            " model2 TEXT NOT NULL DEFAULT '',"
+            " turn_count INTEGER NOT NULL DEFAULT 0,"
+            " source TEXT UNIQUE);"
+            "CREATE INDEX IF NOT EXISTS idx_sessions_started ON sessions(started_at DESC, id DESC);"
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,"
+            " position INTEGER NOT NULL,"
+            " speaker TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " extra TEXT,"
+            " created_at TEXT NOT NULL,"
+            " PRIMARY KEY (session_id, position));"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+        )
+        self._conn.commit()
+        self.fts_enabled = self._create_search_index()
+
+    def _create_search_index(self) -> bool:
+        """
+        建立FTS5全文搜尋索引；資料庫中已有對話時 (由舊版建立) 一併索引既有的內容。
+
+        Returns:
+            bool: 是否可使用FTS5。SQLite 未編譯FTS5或不支援 trigram 分詞器 (3.34 以前) 時為False，
+                search() 會改用較慢的 LIKE 搜尋。
+        """
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_fts'").fetchone()
+        if exists:
+            return True
+        try:
+            with self._conn:
+                self._conn.executescript("BEGIN;" + _FTS_SCHEMA + (
+                    "INSERT INTO history_fts (rowid, session_id, position, speaker, content)"
+                    " SELECT rowid, session_id, position, speaker, content FROM turns;"
+                    "INSERT INTO history_fts (rowid, session_id, position, speaker, content)"
+                    f" SELECT -id, id, 0, '{SESSION_INFO_SPEAKER}',"
+                    " topic || ' ' || persona1 || ' ' || persona2 || ' ' || model1 || ' ' || model2 FROM sessions;"
+                    "COMMIT;"))
+        except sqlite3.OperationalError as e:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+            print(f"警告: 無法建立全文搜尋索引，將改用較慢的搜尋方式: {e}")
+            return False
+        return True
+
+    # --- 寫入 ---
+    def create_session(self, settings: Dict[str, Any], status: str = "running",
+                       started_at: Optional[str] = None, source: Optional[str] = None) -> int:
+        """
+        建立一場對話並返回其編號。
+
+        Args:
+            settings (Dict[str, Any]): 對話設定 (AppUI.get_settings() 的格式)，取其中的主題、角色與模型。
+            status (str): 初始狀態，見 finish_session()。
+            started_at (str, optional): 開始時間 (ISO格式)；預設為現在。
+            source (str, optional): 從舊版檔案匯入時的檔案路徑，用來避免重複匯入。
+        """
+        started_at = started_at or _now()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO sessions (started_at, updated_at, status, topic, persona1, persona2, model1, model2, source)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (started_at, started_at, status, settings.get("topic", ""),
+                 settings.get("persona1_name", ""), settings.get("persona2_name", ""),
+                 settings.get("model1", ""), settings.get("model2", ""), source))
+            return cursor.lastrowid
+
+    def _insert_turns(self, session_id: int, entries: List[Dict[str, Any]]):
+        """(需持有鎖並在交易中) 附加多筆 structured_log 記錄並更新對話的回合數。"""
+        position = self._conn.execute(
+            "SELECT COALESCE(MAX(position), 0) FROM turns WHERE session_id = ?", (session_id,)).fetchone()[0]
+        now = _now()
+        rows = []
+        for offset, entry in enumerate(entries, start=1):
+            extra = {k: v for k, v in entry.items() if k not in _ENTRY_FIELDS}
+            rows.append((session_id, position + offset, entry["speaker"], entry["content"],
+                         json.dumps(extra, ensure_ascii=False) if extra else None, now))
+        self._conn.executemany(
+            "INSERT INTO turns (session_id, position, speaker, content, extra, created_at) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        dialogue_turns = sum(1 for entry in entries if entry["speaker"] != "System")
+        self._conn.execute("UPDATE sessions SET updated_at = ?, turn_count = turn_count + ? WHERE id = ?",
+                           (now, dialogue_turns, session_id))
+
+    def append_turn(self, session_id: int, entry: Dict[str, Any]):
+        """在單一交易中附加一筆 structured_log 記錄 (speaker, content 與效能指標等欄位)。"""
+        with self._lock, self._conn:
+            self._insert_turns(session_id, [entry])
+
+    def finish_session(self, session_id: int, status: str):
+        """
+        記錄對話的最終狀態："finished" (正常結束)、"stopped" (使用者終止) 或 "failed" (無法取得回應)。
+        仍為 "running" 的對話表示程式在對話進行中結束。
+        """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE sessions SET status = ?, updated_at = ? WHERE id = ?", (status, _now(), session_id))
+
+    def delete_session(self, session_id: int):
+        """刪除一場對話與其所有回合。"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    # --- 查詢 ---
+    def count_sessions(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def list_sessions(self, limit: int = PAGE_SIZE, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        依開始時間由新到舊返回一頁對話摘要 (不含回合內容)，使用 started_at 索引，不需讀取或排序全部資料。
+
+        Returns:
+            List[Dict[str, Any]]: 每場對話的 id, started_at, updated_at, status, topic, persona1, persona2,
+                model1, model2, turn_count。
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT id, started_at, updated_at, status, topic, persona1, persona2, model1, model2, turn_count"
+                " FROM sessions ORDER BY started_at DESC, id DESC LIMIT ? OFFSET ?", (limit, offset))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def load_turns(self, session_id: int) -> List[Dict[str, Any]]:
+        """以 structured_log 的格式返回一場對話的所有回合，可直接交給 output_formatter。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT speaker, content, extra FROM turns WHERE session_id = ? ORDER BY position", (session_id,)).fetchall()
+        log = []
+        for speaker, content, extra in rows:
+            entry = {"speaker": speaker, "content": content}
+            if extra:
+                entry.update(json.loads(extra))
+            log.append(entry)
+        return log
+
+    def _sessions_by_id(self, session_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """(需持有鎖) 以編號取得對話摘要。"""
+        if not session_ids:
+            return {}
+        cursor = self._conn.execute(
+            "SELECT id, started_at, updated_at, status, topic, persona1, persona2, model1, model2, turn_count"
+            f" FROM sessions WHERE id IN ({','.join('?' * len(session_ids))})", session_ids)
+        columns = [column[0] for column in cursor.description]
+        return {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+
+    def search(self, query: str, limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+        """
+        全文搜尋所有對話的發言內容、發言者、主題、角色與模型。查詢詞以空白分隔且都必須出現在同一筆記錄中。
+
+        至少三個字元的詞以FTS5 trigram 索引比對並依 bm25 排序；較短的詞 (例如兩個字的中文詞) 在同一個查詢中
+        以 LIKE 篩選。所有詞都少於三個字元時無法使用索引，結果依時間由新到舊排序。
+
+        Returns:
+            List[Dict[str, Any]]: 每場對話最相關的一筆結果，包含 list_sessions() 的欄位，以及
+                position (符合的記錄位置，0 表示對話資訊)、speaker 與 snippet (以【】標示關鍵字的摘錄)。
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        if self.fts_enabled:
+            match_terms = [t for t in terms if len(t) >= TRIGRAM_MIN_CHARS]
+            like_terms = [t for t in terms if len(t) < TRIGRAM_MIN_CHARS]
+            table = "history_fts"
+        else:
+            match_terms, like_terms, table = [], terms, "turns"
+        where, params = [], []
+        # 沒有可用索引的詞時依 rowid 由新到舊掃描，取得足夠的結果就停止
+        order = "rowid DESC"
+        if match_terms:
+            where.append("history_fts MATCH ?")
+            params.append(" AND ".join('"' + t.replace('"', '""') + '"' for t in match_terms))
+        for term in like_terms:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where.append("(speaker LIKE ? ESCAPE '\\' OR content LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern]
+        with self._lock:
+            if match_terms:
+                # bm25 需要為每一筆符合的記錄計分；幾乎所有記錄都符合時排名沒有意義，改為由新到舊以維持查詢速度
+                matched = self._conn.execute("SELECT COUNT(*) FROM history_fts WHERE history_fts MATCH ?",
+                                             params[:1]).fetchone()[0]
+                order = "rank" if matched <= RANKED_MATCH_LIMIT else "rowid DESC"
+            sql = (f"SELECT session_id, position, speaker, content, rowid FROM {table}"
+                   f" WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ?")
+            # 同一場對話可能有多筆符合，多取一些再依對話合併，每場只保留最相關的一筆
+            best: Dict[int, tuple] = {}
+            for row in self._conn.execute(sql, params + [limit * 20]):
+                best.setdefault(row[0], row)
+                if len(best) >= limit:
+                    break
+            snippets: Dict[int, str] = {}
+            if match_terms and best:
+                # 摘錄只為最後顯示的記錄產生
+                rowids = [row[4] for row in best.values()]
+                snippets = dict(self._conn.execute(
+                    f"SELECT rowid, snippet(history_fts, -1, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '{SNIPPET_ELLIPSIS}',"
+                    f" {SNIPPET_TOKENS}) FROM history_fts WHERE history_fts MATCH ?"
+                    f" AND rowid IN ({','.join('?' * len(rowids))})", params[:1] + rowids))
+            sessions = self._sessions_by_id(list(best))
+        results = []
+        for session_id, (_, position, speaker, content, rowid) in best.items():
+            if session_id in sessions:
+                results.append({**sessions[session_id], "position": position, "speaker": speaker,
+                                "snippet": snippets.get(rowid) or make_snippet(content, like_terms)})
+        return results
+
+    def turn_lengths(self, session_id: int, from_position: int, limit: int) -> List[Tuple[int, str, int]]:
+        """返回自 from_position 起最多 limit 筆記錄的 (position, speaker, 內容字元數)，不讀取內容本身。"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT position, speaker, length(content) FROM turns WHERE session_id = ? AND position >= ?"
+                " ORDER BY position LIMIT ?", (session_id, from_position, limit)).fetchall()
+
+    def turn_slice(self, session_id: int, position: int, start: int, length: int) -> str:
+        """只讀取一筆記錄內容中從 start 開始的 length 個字元。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT substr(content, ?, ?) FROM turns WHERE session_id = ? AND position = ?",
+                (start + 1, length, session_id, position)).fetchone()
+        return row[0] if row else ""
+
+    # --- 舊版紀錄 ---
+    def import_legacy_dir(self, directory: str = LEGACY_HISTORY_DIR) -> int:
+        """
+        匯入舊版 history 資料夾中的 .txt/.json 紀錄。已匯入過的檔案會略過，可以重複呼叫。
+
+        .json 檔案若為 structured_log 格式則逐回合匯入，否則將 .txt 的內容匯入成一筆系統訊息。
+
+        Returns:
+            int: 新匯入的對話數。
+        """
+        if not os.path.isdir(directory):
+            return 0
+        with self._lock:
+            known = {row[0] for row in self._conn.execute("SELECT source FROM sessions WHERE source IS NOT NULL")}
+        imported = 0
+        for filename in sorted(os.listdir(directory)):
+            base, ext = os.path.splitext(filename)
+            if ext not in (".txt", ".json"):
+                continue
+            # .txt 與 .json 成對存在時只匯入一次 (以 .json 為準)
+            if ext == ".txt" and os.path.exists(os.path.join(directory, base + ".json")):
+                continue
+            path = os.path.join(directory, filename)
+            if os.path.abspath(path) in known:
+                continue
+            log = _read_legacy(path, os.path.join(directory, base + ".txt"))
+            if log is None:
+                continue
+            started_at = datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec="seconds")
+            with self._lock, self._conn:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO sessions (started_at, updated_at, status, topic, source) VALUES (?, ?, ?, ?, ?)",
+                    (started_at, started_at, "imported", base, os.path.abspath(path)))
+                if cursor.rowcount:
+                    self._insert_turns(cursor.lastrowid, log)
+                    imported += 1
+        return imported
+
+    def import_legacy_once(self, directory: str = LEGACY_HISTORY_DIR) -> int:
+        """第一次開啟資料庫時自動匯入舊版的 history 資料夾，之後不再掃描。"""
+        key = f"legacy_imported:{os.path.abspath(directory)}"
+        with self._lock:
+            done = self._conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone()
+        if done:
+            return 0
+        count = self.import_legacy_dir(directory)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, _now()))
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def _read_legacy(path: str, txt_path: str) -> Optional[List[Dict[str, Any]]]:
+    """讀取一份舊版紀錄，返回 structured_log；無法讀取時返回None。"""
+    try:
+        if path.endswith(".json"):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, list) and all(isinstance(e, dict) and "speaker" in e and "content" in e for e in data):
+                return data
+            if not os.path.exists(txt_path):
+                return [{"speaker": "System", "content": json.dumps(data, ensure_ascii=False, indent=2)}]
+            path = txt_path
+        with open(path, 'r', encoding='utf-8') as f:
+            return [{"speaker": "System", "content": f.read()}]
+    except (IOError, ValueError) as e:
+        print(f"錯誤: 匯入舊版紀錄 {path} 時發生錯誤: {e}")
+        return None
+
+def make_snippet(text: str, terms: List[str], width: int = 40) -> str:
+    """在沒有FTS5 snippet() 可用時，擷取第一個關鍵字附近的文字並以【】標示關鍵字。"""
+    folded = text.casefold()
+    positions = [folded.find(t.casefold()) for t in terms]
+    positions = [p for p in positions if p >= 0]
+    start = max(0, min(positions) - width // 2) if positions else 0
+    excerpt = text[start:start + width * 2]
+    for term in sorted(set(terms), key=len, reverse=True):
+        excerpt = re.sub(re.escape(term), lambda m: f"{SNIPPET_OPEN}{m.group(0)}{SNIPPET_CLOSE}", excerpt, flags=re.IGNORECASE)
+    prefix = SNIPPET_ELLIPSIS if start > 0 else ""
+    suffix = SNIPPET_ELLIPSIS if start + width * 2 < len(text) else ""
+    return prefix + excerpt + suffix
+
+class TranscriptReader:
+    """
+    以固定字元數的區塊，依需要從資料庫讀取一場對話的純文字紀錄 (與 output_formatter.to_txt() 相同的內容)。
+
+    每個區塊只讀取它涵蓋的那一段文字 (超長的發言以 substr 分段讀取)，並記住每個區塊的起點，
+    之後可以重新讀取任何已經讀過的區塊；記憶體用量只與區塊大小有關，與對話長度無關。
+    """
+    # 每次查詢記錄長度時讀取的筆數
+    _ROWS_PER_QUERY = 64
+
+    def __init__(self, db: HistoryDB, session_id: int, chunk_chars: int = TRANSCRIPT_CHUNK_CHARS):
+        self.db = db
+        self.session_id = session_id
+        self.chunk_chars = chunk_chars
+        # 第 i 個區塊的起點：(記錄位置, 在該記錄純文字中的偏移)
+        self._starts: List[Tuple[int, int]] = [(1, 0)]
+        self._first_position: Optional[int] = None
+        # 讀到結尾後才知道的區塊總數
+        self.total: Optional[int] = None
+
+    def chunk(self, index: int) -> Optional[str]:
+        """返回第 index 個區塊的文字；超出結尾時返回None。"""
+        while len(self._starts) <= index and self.total is None:
+            self._read(len(self._starts) - 1)
+        if index < 0 or (self.total is not None and index >= self.total):
+            return None
+        return self._read(index)
+
+    def _read(self, index: int) -> Optional[str]:
+        position, offset = self._starts[index]
+        parts: List[str] = []
+        remaining = self.chunk_chars
+        while remaining > 0:
+            rows = self.db.turn_lengths(self.session_id, position, self._ROWS_PER_QUERY)
+            if not rows:
+                break
+            for row_position, speaker, length in rows:
+                if self._first_position is None:
+                    self._first_position = row_position
+                prefix, suffix = output_formatter.txt_entry_parts(speaker)
+                # 第一筆之前沒有分隔，其餘每筆前面加上 TXT_SEPARATOR
+                separator = "" if row_position == self._first_position else output_formatter.TXT_SEPARATOR
+                pieces = [(separator, 0), (prefix, 0), (None, length), (suffix, 0)]
+                taken = self._take(row_position, pieces, offset, remaining)
+                parts.append(taken)
+                remaining -= len(taken)
+                entry_length = len(separator) + len(prefix) + length + len(suffix)
+                if offset + len(taken) < entry_length:
+                    position, offset = row_position, offset + len(taken)
+                    break
+                position, offset = row_position + 1, 0
+                if remaining == 0:
+                    break
+            else:
+                continue
+            break
+        text = "".join(parts)
+        if len(self._starts) == index + 1:
+            self._starts.append((position, offset))
+            if remaining > 0:
+                self.total = index + 1 if text else index
+        return text or None
+
+    def _take(self, position: int, pieces: List[Tuple[Optional[str], int]], offset: int, count: int) -> str:
+        """從一筆記錄的純文字 (分隔、前綴、內容、後綴) 中取出 offset 起最多 count 個字元，內容部分才查詢資料庫。"""
+        result = []
+        for text, length in pieces:
+            size = len(text) if text is not None else length
+            if offset >= size:
+                offset -= size
+                continue
+            take = min(size - offset, count)
+            result.append(text[offset:offset + take] if text is not None
+                          else self.db.turn_slice(self.session_id, position, offset, take))
+            count -= take
+            offset = 0
+            if count == 0:
+                break
+        return "".join(result)
+
+class SessionRecorder:
+    """
+    DebateRunner 使用的紀錄器：第一筆記錄時建立對話，之後每一筆都立即寫入。
+
+    寫入失敗 (例如磁碟已滿) 只會印出錯誤，不會中斷進行中的對話。
+    """
+    def __init__(self, db: HistoryDB, settings: Dict[str, Any]):
+        self.db = db
+        self.settings = settings
+        self.session_id: Optional[int] = None
+
+    def append(self, entry: Dict[str, Any]):
+        try:
+            if self.session_id is None:
+                self.session_id = self.db.create_session(self.settings)
+            self.db.append_turn(self.session_id, entry)
+        except sqlite3.Error as e:
+            print(f"錯誤: 寫入對話紀錄時發生錯誤: {e}")
+
+    def finish(self, status: str):
+        if self.session_id is None:
+            return
+        try:
+            self.db.finish_session(self.session_id, status)
+        except sqlite3.Error as e:
+            print(f"錯誤: 更新對話紀錄狀態時發生錯誤: {e}")
+
+# 應用程式共用的對話紀錄資料庫，第一次使用時開啟
+_db: Optional[HistoryDB] = None
+_db_lock = threading.Lock()
+
+def get_db(path: str = DEFAULT_HISTORY_PATH) -> HistoryDB:
+    """取得共用的對話紀錄資料庫；第一次開啟時會匯入舊版的 history 資料夾。"""
+    global _db
+    with _db_lock:
+        if _db is None:
+            _db = HistoryDB(path)
+            count = _db.import_legacy_once()
+            if count:
+                print(f"已從 {LEGACY_HISTORY_DIR} 匯入 {count} 場對話到 {path}。")
+        return _db
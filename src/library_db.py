@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Dict, Any, Callable, Optional
+
+# 使用者自訂角色與風格共用的資料庫檔案
+DEFAULT_LIBRARY_PATH = "user_library.sqlite3"
+
+class LibraryDB:
+    """
+    儲存使用者自訂角色與風格的SQLite資料庫。
+
+    每一筆記錄各佔一列，新增、修改或刪除只寫入變動的那一列，並在單一交易中提交；
+    中途當機時資料庫會停在上一次完整提交的狀態，不會像重寫整個JSON檔案那樣損毀。
+    所有操作以同一把鎖序列化，可被多個執行緒共用。
+    """
+    def __init__(self, path: str = DEFAULT_LIBRARY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " kind TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (kind, name))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_records_position ON records(kind, position)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    def data_version(self) -> int:
+        """
+        返回 SQLite 的 data_version：其他連線 (例如另一個應用程式視窗) 提交變更後這個值會改變，
+        本連線自己的寫入則不會，可用來判斷是否需要重新載入。
+        """
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self, kind: str) -> List[Dict[str, Any]]:
+        """依新增順序返回某一類的所有記錄。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM records WHERE kind = ? ORDER BY position", (kind,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def insert(self, kind: str, record: Dict[str, Any]) -> bool:
+        """新增一筆記錄；名稱已存在時返回False。"""
+        with self._lock, self._conn:
+            position = self._conn.execute(
+                "SELECT COALESCE(MAX(position), 0) + 1 FROM records WHERE kind = ?", (kind,)).fetchone()[0]
+            try:
+                self._conn.execute("INSERT INTO records (kind, name, position, data) VALUES (?, ?, ?, ?)",
+                                   (kind, record["name"], position, json.dumps(record, ensure_ascii=False)))
+            except sqlite3.IntegrityError:
+                return False
+            return True
+
+    def update(self, kind: str, old_name: str, record: Dict[str, Any]) -> bool:
+        """以新內容取代名為 old_name 的記錄 (可改名，保留原本的順序)；找不到 old_name 或新名稱已被使用時返回False。"""
+        with self._lock, self._conn:
+            try:
+                cursor = self._conn.execute("UPDATE records SET name = ?, data = ? WHERE kind = ? AND name = ?",
+                                            (record["name"], json.dumps(record, ensure_ascii=False), kind, old_name))
+            except sqlite3.IntegrityError:
+                return False
+            return cursor.rowcount > 0
+
+    def delete(self, kind: str, name: str):
+        """刪除一筆記錄。"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM records WHERE kind = ? AND name = ?", (kind, name))
+
+    def replace(self, kind: str, records: List[Dict[str, Any]]):
+        """在同一個交易中以新的列表取代某一類的所有記錄 (例如匯入備份)；名稱重複時保留第一筆。"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM records WHERE kind = ?", (kind,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO records (kind, name, position, data) VALUES (?, ?, ?, ?)",
+                [(kind, r["name"], i, json.dumps(r, ensure_ascii=False)) for i, r in enumerate(records, start=1)])
+
+    def import_legacy_json(self, kind: str, path: str, parse: Callable[[str], List[Dict[str, Any]]]) -> int:
+        """
+        第一次使用某一類記錄時，匯入舊版的JSON檔案 (之後不再讀取該檔案)。
+
+        Returns:
+            int: 匯入的記錄數；已匯入過或檔案不存在時為0。
+        """
+        key = f"legacy_imported:{kind}"
+        with self._lock:
+            done = self._conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone()
+        if done:
+            return 0
+        records = []
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    records = parse(f.read())
+            except IOError as e:
+                print(f"錯誤: 讀取舊版檔案 {path} 時發生錯誤: {e}")
+                return 0
+        with self._lock, self._conn:
+            if records:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO records (kind, name, position, data) VALUES (?, ?, ?, ?)",
+                    [(kind, r["name"], i, json.dumps(r, ensure_ascii=False)) for i, r in enumerate(records, start=1)])
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, path))
+        return len(records)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class Collection:
+    """
+    LibraryDB 中某一類記錄 (例如 "personas") 的檢視，作為 RecordStore 的可修改資料來源。
+    """
+    def __init__(self, db: LibraryDB, kind: str):
+        self.db = db
+        self.kind = kind
+
+    def version(self) -> int:
+        return self.db.data_version()
+
+    def load(self) -> List[Dict[str, Any]]:
+        return self.db.load(self.kind)
+
+    def insert(self, record: Dict[str, Any]) -> bool:
+        return self.db.insert(self.kind, record)
+
+    def update(self, old_name: str, record: Dict[str, Any]) -> bool:
+        return self.db.update(self.kind, old_name, record)
+
+    def delete(self, name: str):
+        self.db.delete(self.kind, name)
+
+    def replace(self, records: List[Dict[str, Any]]):
+        self.db.replace(self.kind, records)
+
+# 角色與風格共用的資料庫，第一次使用時開啟
+_db: Optional[LibraryDB] = None
+_db_lock = threading.Lock()
+
+def get_db(path: str = DEFAULT_LIBRARY_PATH) -> LibraryDB:
+    """取得共用的資料庫連線。"""
+    global _db
+    with _db_lock:
+        if _db is None:
+            _db = LibraryDB(path)
+        return _db
+
+def get_collection(kind: str, legacy_path: Optional[str] = None,
+                   parse: Optional[Callable[[str], List[Dict[str, Any]]]] = None) -> Collection:
+    """
+    取得某一類記錄的 Collection；提供 legacy_path 時，第一次使用會先匯入舊版的JSON檔案。
+    """
+    db = get_db()
+    if legacy_path and parse:
+        count = db.import_legacy_json(kind, legacy_path, parse)
+        if count:
+            print(f"已從 {legacy_path} 匯入 {count} 筆記錄到 {db.path}。")
+    return Collection(db, kind)
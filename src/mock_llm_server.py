@@ -0,0 +1,292 @@
+"""
+用於測試與效能評估的模擬LLM伺服器。
+
+同時提供 Ollama (`/api/tags`, `/api/show`, `/api/chat`，含流式與非流式) 與
+OpenAI chat-completions (`/v1/models`, `/v1/chat/completions`，含SSE流式) 的介面，
+可設定首字延遲分布、生成速度、回覆長度與錯誤注入，讓對話流程能在沒有真實模型的情況下被量測。
+
+用法 (在專案根目錄執行):
+    python src/mock_llm_server.py --port 11435 --latency lognormal:0.3,0.5 --tokens-per-sec 40 --failure-rate 0.01
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional
+
+DEFAULT_MODELS = ["mock-llama:latest", "mock-gemma:latest"]
+
+# 回覆內容的詞彙；中英混合，讓token估算與實際使用情境相近
+_WORDS = ["辯論", "觀點", "數據", "因此", "然而", "remote", "work", "future", "evidence", "我們", "認為", "問題"]
+
+def parse_latency(spec: str):
+    """
+    解析延遲分布設定，返回一個每次呼叫會產生一個延遲秒數的函式。
+
+    支援的格式:
+        fixed:0.2             固定 0.2 秒
+        uniform:0.1,0.5       0.1 到 0.5 秒之間均勻分布
+        lognormal:0.3,0.5     中位數 0.3 秒、sigma 0.5 的對數常態分布
+
+    Raises:
+        ValueError: 當格式無法解析時。
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0, sigma)
+    raise ValueError(f"無法解析的延遲設定: {spec}")
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    模擬LLM伺服器本體。所有行為參數都存放在伺服器物件上，由每個請求的處理器讀取。
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        models: Optional[List[str]] = None,
+        latency: str = "fixed:0.05",
+        tokens_per_sec: float = 200.0,
+        reply_tokens: int = 60,
+        failure_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            address: 監聽的 (主機, 埠號)，埠號為0時由系統指定。
+            models (List[str], optional): `/api/tags` 回報的模型名稱。
+            latency (str): 首字延遲分布，格式見 parse_latency()。
+            tokens_per_sec (float): 首字之後的生成速度；0 表示不延遲。
+            reply_tokens (int): 每則回覆的token數。
+            failure_rate (float): 以HTTP 500回應的請求比例。
+            drop_rate (float): 流式傳輸中途斷線的請求比例。
+            seed (int, optional): 隨機種子，用於可重現的測試。
+        """
+        super().__init__(address, _MockHandler)
+        self.models = models or list(DEFAULT_MODELS)
+        self.latency = parse_latency(latency)
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.request_count = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw(self) -> Dict[str, Any]:
+        """為一個請求抽樣延遲與錯誤注入結果。"""
+        with self._rng_lock:
+            self.request_count += 1
+            return {
+                "latency": max(0.0, self.latency(self._rng)),
+                "fail": self._rng.random() < self.failure_rate,
+                "drop": self._rng.random() < self.drop_rate,
+                "tokens": [self._rng.choice(_WORDS) for _ in range(self.reply_tokens)],
+            }
+
+    def handle_error(self, request, client_address):
+        # 客戶端關閉連線池中的閒置連線屬於正常情況，不輸出錯誤堆疊
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    def start_in_thread(self) -> "MockLLMServer":
+        """在背景執行緒中開始服務，並返回伺服器本身。"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def _prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    """以字元數粗估提示的token數，與真實伺服器回報的數字同一個量級即可。"""
+    return sum(len(m.get("content", "")) for m in messages) // 2 + 4 * len(messages)
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockLLMServer
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- 共用的回應工具 ---
+    def _send_json(self, data: Dict[str, Any], status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.server.tokens_per_sec if self.server.tokens_per_sec > 0 else 0.0
+
+    # --- 路由 ---
+    def do_GET(self):
+        if self.path == "/api/tags":
+            models = [{"name": name, "model": name, "size": 4_000_000_000,
+                       "details": {"family": "mock", "parameter_size": "7B", "quantization_level": "Q4_0"}}
+                      for name in self.server.models]
+            self._send_json({"models": models})
+        elif self.path == "/v1/models":
+            self._send_json({"object": "list", "data": [{"id": name, "object": "model"} for name in self.server.models]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        try:
+            request = self._read_json()
+        except json.JSONDecodeError:
+            self._send_json({"error": "invalid json"}, status=400)
+            return
+        if self.path == "/api/chat":
+            self._ollama_chat(request)
+        elif self.path == "/api/show":
+            self._ollama_show(request)
+        elif self.path == "/v1/chat/completions":
+            self._openai_chat(request)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _ollama_show(self, request: Dict[str, Any]):
+        if request.get("model") not in self.server.models:
+            self._send_json({"error": f"model '{request.get('model')}' not found"}, status=404)
+            return
+        self._send_json({"details": {"family": "mock", "parameter_size": "7B", "quantization_level": "Q4_0"},
+                         "model_info": {"mock.context_length": 8192},
+                         "parameters": "num_ctx 4096"})
+
+    def _ollama_chat(self, request: Dict[str, Any]):
+        messages = request.get("messages", [])
+        if request.get("model") not in self.server.models:
+            self._send_json({"error": f"model '{request.get('model')}' not found"}, status=404)
+            return
+        # 不含訊息的請求是模型預載，立即回應
+        if not messages:
+            self._send_json({"model": request["model"], "message": {"role": "assistant", "content": ""},
+                             "done": True, "load_duration": 0, "total_duration": 0})
+            return
+        plan = self.server.draw()
+        if plan["fail"]:
+            self._send_json({"error": "injected failure"}, status=500)
+            return
+        start = time.perf_counter()
+        time.sleep(plan["latency"])
+        first_token = time.perf_counter()
+        tokens = plan["tokens"]
+        final = {"model": request["model"], "done": True, "load_duration": 0,
+                 "prompt_eval_count": _prompt_tokens(messages), "eval_count": len(tokens)}
+        if not request.get("stream", True):
+            time.sleep(self._token_delay() * len(tokens))
+            end = time.perf_counter()
+            final.update(message={"role": "assistant", "content": " ".join(tokens)},
+                         eval_duration=int((end - first_token) * 1e9), total_duration=int((end - start) * 1e9))
+            self._send_json(final)
+            return
+        self._start_chunked("application/x-ndjson")
+        for i, token in enumerate(tokens):
+            if plan["drop"] and i == len(tokens) // 2:
+                # 模擬伺服器在生成途中斷線
+                self.close_connection = True
+                return
+            piece = token if i == 0 else " " + token
+            self._write_chunk((json.dumps({"model": request["model"], "message": {"role": "assistant", "content": piece},
+                                           "done": False}, ensure_ascii=False) + "\n").encode("utf-8"))
+            time.sleep(self._token_delay())
+        end = time.perf_counter()
+        final.update(message={"role": "assistant", "content": ""},
+                     eval_duration=int((end - first_token) * 1e9), total_duration=int((end - start) * 1e9))
+        self._write_chunk((json.dumps(final) + "\n").encode("utf-8"))
+        self._end_chunked()
+
+    def _openai_chat(self, request: Dict[str, Any]):
+        messages = request.get("messages", [])
+        plan = self.server.draw()
+        if plan["fail"]:
+            self._send_json({"error": {"message": "injected failure", "type": "server_error"}}, status=500)
+            return
+        time.sleep(plan["latency"])
+        tokens = plan["tokens"]
+        usage = {"prompt_tokens": _prompt_tokens(messages), "completion_tokens": len(tokens),
+                 "total_tokens": _prompt_tokens(messages) + len(tokens)}
+        base = {"id": f"chatcmpl-mock-{self.server.request_count}", "created": int(time.time()), "model": request.get("model")}
+        if not request.get("stream"):
+            time.sleep(self._token_delay() * len(tokens))
+            self._send_json({**base, "object": "chat.completion", "usage": usage,
+                             "choices": [{"index": 0, "finish_reason": "stop",
+                                          "message": {"role": "assistant", "content": " ".join(tokens)}}]})
+            return
+        self._start_chunked("text/event-stream")
+        for i, token in enumerate(tokens):
+            if plan["drop"] and i == len(tokens) // 2:
+                self.close_connection = True
+                return
+            piece = token if i == 0 else " " + token
+            event = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            time.sleep(self._token_delay())
+        event = {**base, "object": "chat.completion.chunk", "usage": usage,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_chunked()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="啟動一個模擬Ollama與OpenAI介面的LLM伺服器。")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", nargs="+", default=DEFAULT_MODELS, help="回報的模型名稱")
+    parser.add_argument("--latency", default="fixed:0.05", help="首字延遲分布，例如 fixed:0.2、uniform:0.1,0.5、lognormal:0.3,0.5")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0, help="首字之後的生成速度 (0 表示不延遲)")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="每則回覆的token數")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="以HTTP 500回應的請求比例")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="流式傳輸中途斷線的請求比例")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    server = MockLLMServer((args.host, args.port), models=args.models, latency=args.latency,
+                           tokens_per_sec=args.tokens_per_sec, reply_tokens=args.reply_tokens,
+                           failure_rate=args.failure_rate, drop_rate=args.drop_rate, seed=args.seed)
+    # 第一行輸出實際的位址，讓啟動它的程式 (例如 benchmark.py) 在埠號為0時也能取得
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
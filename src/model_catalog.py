@@ -0,0 +1,201 @@
+import re
+import threading
+import time
+from typing import List, Dict, Any, Callable, Optional
+
+import ollama_client
+
+# 模型列表快取的有效秒數；過期後仍先返回舊列表，同時在背景重新查詢
+DEFAULT_TTL_SECONDS = 60.0
+
+class _SingleFlight:
+    """
+    讓同一個鍵同時只有一個查詢在進行，其他呼叫者等待並共用同一個結果。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, Dict[str, Any]] = {}
+
+    def do(self, key: Any, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None}
+                self._calls[key] = call
+        if not leader:
+            call["done"].wait()
+            return call["result"]
+        try:
+            call["result"] = func()
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+        return call["result"]
+
+    def in_flight(self, key: Any) -> bool:
+        with self._lock:
+            return key in self._calls
+
+def _context_length(model_info: Dict[str, Any]) -> Optional[int]:
+    """從 `/api/show` 的 model_info 取出訓練時的上下文長度，例如 "llama.context_length"。"""
+    for key, value in model_info.items():
+        if key.endswith(".context_length"):
+            return int(value)
+    return None
+
+def _num_ctx(parameters: str) -> Optional[int]:
+    """從 Modelfile 的 parameters 文字取出 num_ctx，也就是Ollama實際使用的上下文長度。"""
+    match = re.search(r"^\s*num_ctx\s+(\d+)", parameters or "", re.MULTILINE)
+    return int(match.group(1)) if match else None
+
+class ModelCatalog:
+    """
+    Ollama模型列表與模型資料的快取。
+
+    模型列表 (`/api/tags`) 在 ttl 秒內直接使用快取；同時發出的多個查詢只會送出一次請求。
+    過期後先返回舊列表並在背景更新，UI 不需要等待。查詢失敗時不會覆蓋既有的列表。
+    模型的詳細資料 (`/api/show`) 只在第一次需要時查詢，並以模型的 digest 為鍵保留到模型被更新為止。
+    """
+    def __init__(self, fetch: Callable[[], Optional[List[Dict[str, Any]]]] = ollama_client.list_models,
+                 show: Callable[[str], Optional[Dict[str, Any]]] = ollama_client.show_model,
+                 ttl: float = DEFAULT_TTL_SECONDS):
+        self.fetch = fetch
+        self.show = show
+        self.ttl = ttl
+        self._entries: Optional[List[Dict[str, Any]]] = None
+        self._fetched_at = 0.0
+        self._details: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flight = _SingleFlight()
+        self.fetches = 0
+
+    def _refresh(self) -> Optional[List[Dict[str, Any]]]:
+        def run():
+            self.fetches += 1
+            entries = self.fetch()
+            if entries is not None:
+                with self._lock:
+                    self._entries = entries
+                    self._fetched_at = time.monotonic()
+            return entries
+        entries = self._flight.do("tags", run)
+        if entries is None:
+            with self._lock:
+                return self._entries
+        return entries
+
+    def refresh_async(self):
+        """在背景更新模型列表；已有查詢在進行時不重複送出。"""
+        if not self._flight.in_flight("tags"):
+            threading.Thread(target=self._refresh, daemon=True).start()
+
+    def entries(self, force: bool = False) -> List[Dict[str, Any]]:
+        """
+        返回 `/api/tags` 的模型資料。
+
+        Args:
+            force (bool): 是否忽略快取、等待一次新的查詢 (例如使用者按下重新整理)。
+        """
+        with self._lock:
+            entries = self._entries
+            fresh = entries is not None and time.monotonic() - self._fetched_at < self.ttl
+        if entries is None or force:
+            return self._refresh() or []
+        if not fresh:
+            self.refresh_async()
+        return entries
+
+    def names(self, force: bool = False) -> List[str]:
+        """返回可用模型名稱的列表。"""
+        return [entry["name"] for entry in self.entries(force)]
+
+    def invalidate(self):
+        """讓下一次查詢重新向Ollama取得模型列表。"""
+        with self._lock:
+            self._fetched_at = 0.0
+
+    def info(self, model_name: str, details: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        返回模型的摘要資料。
+
+        Args:
+            model_name (str): 模型名稱。
+            details (bool): 是否在需要時查詢 `/api/show` 以取得上下文長度；False 時只使用模型列表中的資料。
+
+        Returns:
+            Optional[Dict[str, Any]]: 包含 name, size, family, parameter_size, quantization,
+                context_length (模型支援的長度), num_ctx (Modelfile 設定的實際長度) 的字典；模型不存在時為None。
+        """
+        entry = next((e for e in self.entries() if e["name"] == model_name), None)
+        if entry is None:
+            return None
+        tag_details = entry.get("details") or {}
+        info = {
+            "name": model_name,
+            "size": entry.get("size"),
+            "family": tag_details.get("family"),
+            "parameter_size": tag_details.get("parameter_size"),
+            "quantization": tag_details.get("quantization_level"),
+            "context_length": None,
+            "num_ctx": None,
+        }
+        if details:
+            info.update(self._show_details(model_name, entry.get("digest")))
+        return info
+
+    def _show_details(self, model_name: str, digest: Optional[str]) -> Dict[str, Any]:
+        key = (model_name, digest)
+        with self._lock:
+            cached = self._details.get(key)
+        if cached is not None:
+            return cached
+        def run():
+            shown = self.show(model_name)
+            if shown is None:
+                return {}
+            result = {"context_length": _context_length(shown.get("model_info") or {}),
+                      "num_ctx": _num_ctx(shown.get("parameters", ""))}
+            with self._lock:
+                self._details[key] = result
+            return result
+        return self._flight.do(key, run)
+
+# 應用程式共用的模型目錄，第一次使用時建立
+_catalog: Optional[ModelCatalog] = None
+_catalog_lock = threading.Lock()
+
+def configure(ttl: float = DEFAULT_TTL_SECONDS) -> ModelCatalog:
+    """以指定的有效秒數重建共用的模型目錄 (例如變更Ollama位址或端點池之後)。"""
+    global _catalog
+    with _catalog_lock:
+        _catalog = ModelCatalog(ttl=ttl)
+        return _catalog
+
+def get_catalog() -> ModelCatalog:
+    """取得共用的模型目錄。"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ModelCatalog()
+        return _catalog
+
+def get_models(force: bool = False) -> List[str]:
+    """返回可用的Ollama模型名稱，見 ModelCatalog.names()。"""
+    return get_catalog().names(force)
+
+def get_model_info(model_name: str, details: bool = True) -> Optional[Dict[str, Any]]:
+    """返回Ollama模型的摘要資料，見 ModelCatalog.info()。"""
+    return get_catalog().info(model_name, details)
+
+def format_model_info(info: Dict[str, Any]) -> str:
+    """將模型資料整理成一行顯示用的文字，例如 "llama3:latest：llama 8.0B Q4_0，4.7 GB，上下文 8192"。"""
+    parts = [p for p in (info.get("family"), info.get("parameter_size"), info.get("quantization")) if p]
+    text = f"{info['name']}：{' '.join(parts) or '未知格式'}"
+    if info.get("size"):
+        text += f"，{info['size'] / 1e9:.1f} GB"
+    context = info.get("num_ctx") or info.get("context_length")
+    if context:
+        text += f"，上下文 {context}"
+    return text
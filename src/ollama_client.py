@@ -1,40 +1,368 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import json
-from typing import List, Dict, Any
+import socket
+import threading
+import time
+from typing import List, Dict, Any, Callable, Optional
 
-# Ollama API的預設基礎URL
+import response_cache
+import ollama_pool
+from resilience import classify_error
+from cancellation import CancelToken, CancelledError, cancel_scope, register_abort
+
+# Ollama API的預設基礎URL，可透過 set_base_url() 在執行期間變更；
+# 以 ollama_pool.configure() 設定多個端點後，未指定 base_url 的請求改由端點池分配
 OLLAMA_BASE_URL = "http://localhost:11434"
 
-def get_available_models(base_url: str = OLLAMA_BASE_URL) -> List[str]:
+# 連線池的預設大小：pool_connections 為快取的主機數，pool_maxsize 為每個主機保留的連線數
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+
+# 每次請求後模型在Ollama中保留於記憶體的時間 (例如 "30m"、"-1" 表示永久)；None 則使用伺服器預設值
+DEFAULT_KEEP_ALIVE = "30m"
+_keep_alive: Optional[str] = DEFAULT_KEEP_ALIVE
+
+# Ollama 回應中以奈秒表示的時間欄位，會被轉換為秒數放入 stats
+_DURATION_FIELDS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+_COUNT_FIELDS = ("prompt_eval_count", "eval_count")
+
+# 所有Ollama請求共用的 keep-alive session，由 get_session() 延遲建立
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+class _CancellableMixin:
     """
-    從Ollama API獲取所有可用的模型列表。
+    在等待回應時，向目前執行緒的 CancelToken 登記一個關閉socket的回呼。
+
+    取消時直接 shutdown 底層socket，阻塞中的讀取會立即返回，Ollama 也會因連線中斷而停止生成並釋放位置。
+    回呼在整個請求 (含流式讀取) 期間保持登記，直到 cancel_scope() 結束為止。
+    """
+    def getresponse(self, *args, **kwargs):
+        register_abort(self._abort)
+        return super().getresponse(*args, **kwargs)
+
+    def _abort(self):
+        sock = self.sock
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class _CancellableHTTPConnection(_CancellableMixin, HTTPConnection):
+    pass
+
+class _CancellableHTTPSConnection(_CancellableMixin, HTTPSConnection):
+    pass
+
+class _CancellableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CancellableHTTPConnection
+
+class _CancellableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CancellableHTTPSConnection
+
+class _CancellableAdapter(HTTPAdapter):
+    """使用可被 CancelToken 中止之連線的 HTTPAdapter。"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CancellableHTTPConnectionPool,
+            "https": _CancellableHTTPSConnectionPool,
+        }
+
+def _build_session(pool_connections: int, pool_maxsize: int, pool_block: bool) -> requests.Session:
+    """建立一個掛載了可取消連線池配接器的 requests.Session。"""
+    session = requests.Session()
+    adapter = _CancellableAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def configure_session(
+    pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+    pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+    pool_block: bool = False
+) -> requests.Session:
+    """
+    以指定的連線池設定重建共用的HTTP session。
+
+    只替換共用的參考而不關閉舊的session：其他執行緒可能仍在舊session上讀取串流，
+    它們會在舊的連線上正常完成，之後的請求改用新的session；舊session在不再被引用時由垃圾回收釋放其連線。
 
     Args:
-        base_url (str): Ollama服務的基礎URL。
+        pool_connections (int): 連線池要快取的主機數量。
+        pool_maxsize (int): 每個主機最多保留的keep-alive連線數。
+        pool_block (bool): 連線池用盡時是否等待可用連線，而非另開一條不保留的連線。
 
     Returns:
-        List[str]: 可用模型名稱的列表。如果發生錯誤則返回空列表。
+        requests.Session: 新建立的共用session。
+    """
+    global _session
+    new_session = _build_session(pool_connections, pool_maxsize, pool_block)
+    with _session_lock:
+        _session = new_session
+    return new_session
+
+def get_session() -> requests.Session:
+    """
+    取得所有Ollama請求共用的連線池session，第一次呼叫時才建立。
+
+    requests 並未保證 Session 是執行緒安全的；這裡之所以可由多個對話執行緒共用，是因為只用它送出無狀態的請求
+    (不使用cookie、認證或在建立後修改 headers 與配接器)，實際共用的只有 urllib3 的連線池，而它本身有加鎖保護。
+    因此不要在這個session上設定任何會在請求之間改變的狀態。
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session(DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE, False)
+    return _session
+
+def set_base_url(base_url: str):
+    """變更未明確指定 base_url 時所使用的Ollama服務位址 (例如指向另一台主機或測試用的模擬伺服器)。"""
+    global OLLAMA_BASE_URL
+    OLLAMA_BASE_URL = base_url.rstrip("/")
+
+def set_keep_alive(keep_alive: Optional[str]):
+    """
+    設定之後每次 `/api/chat` 請求所帶的 keep_alive 值，避免模型在回合之間被卸載。
+
+    Args:
+        keep_alive (Optional[str]): Ollama 接受的時間長度字串，None 表示不傳送 (使用伺服器預設值)。
+    """
+    global _keep_alive
+    _keep_alive = keep_alive
+
+def fill_stats(stats: Optional[Dict[str, Any]], response_data: Dict[str, Any]):
+    """
+    將Ollama回應 (或流式傳輸最後一個分塊) 中的計時與token數資訊寫入 stats。
+
+    時間欄位由奈秒轉換為秒，並改名為 `*_seconds`，例如 load_duration → load_seconds。
+    token數另外以 prompt_tokens / completion_tokens 提供，與其他客戶端的欄位名稱一致。
+    """
+    if stats is None:
+        return
+    for field in _DURATION_FIELDS:
+        if field in response_data:
+            stats[field.replace("_duration", "_seconds")] = response_data[field] / 1e9
+    for field in _COUNT_FIELDS:
+        if field in response_data:
+            stats[field] = response_data[field]
+    if "prompt_eval_count" in response_data:
+        stats["prompt_tokens"] = response_data["prompt_eval_count"]
+    if "eval_count" in response_data:
+        stats["completion_tokens"] = response_data["eval_count"]
+
+def build_chat_payload(model_name: str, conversation_history: List[Dict[str, str]], stream: bool) -> Dict[str, Any]:
+    """
+    組出 `/api/chat` 的請求內容，同步與非同步 (async_ollama_client) 客戶端共用。
+
+    Args:
+        model_name (str): 要使用的模型名稱。
+        conversation_history (List[Dict[str, str]]): 對話歷史記錄。
+        stream (bool): 是否要求以NDJSON流式回傳。
+
+    Returns:
+        Dict[str, Any]: 可直接以JSON送出的請求內容。
+    """
+    payload = {
+        "model": model_name,
+        "messages": conversation_history,
+        "stream": stream
+    }
+    if _keep_alive is not None:
+        payload["keep_alive"] = _keep_alive
+    return payload
+
+class StreamParser:
+    """
+    組合 `/api/chat` 流式回應 (NDJSON) 的每一行，同步與非同步 (async_ollama_client) 客戶端共用。
+
+    呼叫端逐行呼叫 feed()，返回True時停止讀取；串流結束後以 finish() 取得完整內容。
+    """
+    def __init__(self, on_token: Optional[Callable[[str], None]] = None, stats: Optional[Dict[str, Any]] = None):
+        self.on_token = on_token
+        self.stats = stats
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[str] = None
+
+    def feed(self, line: bytes) -> bool:
+        """
+        處理一行NDJSON；收到 done 分塊或伺服器回報錯誤時返回True。
+
+        Raises:
+            json.JSONDecodeError: 這一行不是有效的JSON時。
+        """
+        line = line.strip()
+        if not line:
+            return False
+        chunk = json.loads(line)
+        if "error" in chunk:
+            self.error = chunk["error"]
+            return True
+        delta = chunk.get("message", {}).get("content", "")
+        if delta:
+            self.chunks.append(delta)
+            if self.on_token:
+                self.on_token(delta)
+        if chunk.get("done"):
+            fill_stats(self.stats, chunk)
+            self.done = True
+            return True
+        return False
+
+    def finish(self) -> Optional[str]:
+        """
+        返回完整的回應內容。伺服器回報錯誤 ("server") 或串流在 done 分塊之前就結束 ("protocol") 時
+        印出錯誤、將原因寫入 stats 並返回None：不完整的回應不可當成成功的回覆或寫入快取。
+        """
+        if self.error is not None:
+            print(f"Error from Ollama during streaming: {self.error}")
+            _record_error(self.stats, "server")
+            return None
+        if not self.done:
+            print("Error: Ollama closed the stream before the final chunk.")
+            _record_error(self.stats, "protocol")
+            return None
+        return "".join(self.chunks)
+
+def extract_content(response_data: Dict[str, Any]) -> str | None:
+    """
+    從 `/api/chat` 的非流式回應中取出AI回應文字。
+
+    Returns:
+        str | None: 回應內容；若格式不符預期則印出錯誤並返回None。
+    """
+    # 檢查回應中是否包含預期的 'message' 和 'content'
+    if "message" in response_data and "content" in response_data["message"]:
+        return response_data["message"]["content"]
+    print(f"Error: Unexpected response format from Ollama: {response_data}")
+    return None
+
+def _was_cancelled(cancel_token: Optional[CancelToken], stats: Optional[Dict[str, Any]]) -> bool:
+    """請求失敗時判斷是否為使用者取消；是的話在 stats 中標記，呼叫端就不必輸出錯誤。"""
+    if cancel_token is None or not cancel_token.is_set():
+        return False
+    if stats is not None:
+        stats["cancelled"] = True
+    return True
+
+def _record_error(stats: Optional[Dict[str, Any]], kind: str):
+    """將失敗原因寫入 stats["error"]，供 resilience 判斷是否重試 (見 resilience.classify_error())。"""
+    if stats is not None:
+        stats["error"] = kind
+
+def _note_failure(lease: ollama_pool.Lease, error: Exception):
+    """連線失敗或逾時時，讓端點池暫時避開這個端點。"""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        lease.mark_failed()
+
+def _lease(
+    model_name: str,
+    affinity: Optional[str],
+    base_url: Optional[str],
+    cancel_token: Optional[CancelToken],
+    stats: Optional[Dict[str, Any]]
+) -> Optional[ollama_pool.Lease]:
+    """
+    在 cancel_token 的範圍內向端點池取得端點：等待已滿的端點時按下停止或超過回合期限會立即放棄，
+    此時在 stats 中標記 cancelled 並返回None。
+    """
+    try:
+        return ollama_pool.lease(model_name, affinity, base_url, OLLAMA_BASE_URL, cancel_token)
+    except CancelledError:
+        _was_cancelled(cancel_token, stats)
+        return None
+
+def release_session(session_id: Optional[str]):
+    """對話結束時移除該對話在端點池中的固定路由。"""
+    pool = ollama_pool.get_pool()
+    if pool is not None:
+        pool.release_affinity(session_id)
+
+def list_models(base_url: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    從Ollama API獲取所有可用模型的完整資料 (`/api/tags` 的 models 欄位，含大小、家族與量化等 details)。
+
+    Args:
+        base_url (str, optional): Ollama服務的基礎URL，預設為 OLLAMA_BASE_URL (或端點池中的所有端點)。
+
+    Returns:
+        Optional[List[Dict[str, Any]]]: 模型資料的列表；發生錯誤時返回None，以便與「沒有任何模型」區分。
     """
+    pool = ollama_pool.get_pool()
+    if base_url is None and pool is not None:
+        # 多個端點時返回所有健康端點的模型聯集，同時更新端點池的健康狀態
+        pool.probe_all()
+        return pool.model_entries()
+    base_url = base_url or OLLAMA_BASE_URL
     try:
-        response = requests.get(f"{base_url}/api/tags", timeout=5)
+        response = get_session().get(f"{base_url}/api/tags", timeout=5)
         # 如果請求失敗，拋出HTTPError異常
         response.raise_for_status()
-        models_data = response.json().get("models", [])
-        # 從返回的列表中提取模型名稱
-        return [model["name"] for model in models_data]
+        return response.json().get("models", [])
     except requests.exceptions.RequestException as e:
         # 捕獲所有requests相關的異常 (例如，連線錯誤)
         print(f"Error connecting to Ollama at {base_url}: {e}")
-        return []
+        return None
     except json.JSONDecodeError:
         # 捕獲JSON解析錯誤
         print(f"Error: Failed to decode JSON response from Ollama.")
-        return []
+        return None
+
+def get_available_models(base_url: Optional[str] = None) -> List[str]:
+    """
+    從Ollama API獲取所有可用的模型列表。
+
+    UI 應改用 model_catalog.get_models()，同時開啟的多個請求會共用一次查詢並快取結果。
+
+    Args:
+        base_url (str, optional): Ollama服務的基礎URL，預設為 OLLAMA_BASE_URL (或端點池中的所有端點)。
+
+    Returns:
+        List[str]: 可用模型名稱的列表。如果發生錯誤則返回空列表。
+    """
+    # 從返回的列表中提取模型名稱
+    return [model["name"] for model in list_models(base_url) or []]
+
+def show_model(model_name: str, base_url: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    以 `/api/show` 取得單一模型的詳細資料 (details、model_info 中的上下文長度、Modelfile 的 parameters)。
+
+    Args:
+        model_name (str): 模型名稱。
+        base_url (str, optional): Ollama服務的基礎URL；未指定時由端點池分配。
+
+    Returns:
+        Optional[Dict[str, Any]]: `/api/show` 的回應內容；發生錯誤時返回None。
+    """
+    lease = ollama_pool.lease(model_name, None, base_url, OLLAMA_BASE_URL)
+    try:
+        response = get_session().post(f"{lease.url}/api/show", json={"model": model_name}, timeout=10)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        _note_failure(lease, e)
+        print(f"Error fetching details of Ollama model {model_name}: {e}")
+        return None
+    except json.JSONDecodeError:
+        print(f"Error: Failed to decode JSON response from Ollama.")
+        return None
+    finally:
+        lease.release()
 
 def generate_response(
     model_name: str,
     conversation_history: List[Dict[str, str]],
-    base_url: str = OLLAMA_BASE_URL
+    base_url: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    cancel_token: Optional[CancelToken] = None,
+    affinity: Optional[str] = None
 ) -> str | None:
     """
     使用指定的模型和對話歷史，向Ollama API請求生成一個新的回應。
@@ -43,31 +371,165 @@ def generate_response(
         model_name (str): 要使用的模型名稱 (例如, "llama3:latest")。
         conversation_history (List[Dict[str, str]]): 對話歷史記錄，
             格式為 [{"role": "user", "content": "..."}, ...]。
-        base_url (str): Ollama服務的基礎URL。
+        base_url (str, optional): Ollama服務的基礎URL；未指定時使用 OLLAMA_BASE_URL 或由端點池分配。
+        stats (Dict[str, Any], optional): 若提供，會填入模型載入時間、生成時間與token數；失敗時填入 error。
+        cancel_token (CancelToken, optional): 被設定時立即關閉連線並返回None，stats 中會標記 cancelled。
+        affinity (str, optional): 端點池的固定路由鍵 (例如對話中某一方的 session_id)，
+            讓同一段對話持續送往同一台伺服器以沿用其KV快取。
 
     Returns:
-        str | None: AI生成的回應內容。如果發生錯誤則返回None。
+        str | None: AI生成的回應內容。如果發生錯誤或被取消則返回None。
     """
+    cache_key, cached = response_cache.lookup("ollama", model_name, None, conversation_history)
+    if cached is not None:
+        if stats is not None:
+            stats["cache_hit"] = True
+        return cached
+    lease = _lease(model_name, affinity, base_url, cancel_token, stats)
+    if lease is None:
+        return None
     try:
-        payload = {
-            "model": model_name,
-            "messages": conversation_history,
-            "stream": False  # 為簡化起見，我們不使用流式傳輸
-        }
-        response = requests.post(f"{base_url}/api/chat", json=payload, timeout=120)
-        response.raise_for_status()
-        response_data = response.json()
+        payload = build_chat_payload(model_name, conversation_history, stream=False)
+        with cancel_scope(cancel_token):
+            response = get_session().post(f"{lease.url}/api/chat", json=payload, timeout=120)
+            response.raise_for_status()
+            response_data = response.json()
+        fill_stats(stats, response_data)
+        content = extract_content(response_data)
+        if content is None:
+            _record_error(stats, "protocol")
+        response_cache.store(cache_key, content)
+        return content
+
+    except requests.exceptions.RequestException as e:
+        if _was_cancelled(cancel_token, stats):
+            return None
+        _note_failure(lease, e)
+        _record_error(stats, classify_error(e))
+        print(f"Error during Ollama generation request: {e}")
+        return None
+    except json.JSONDecodeError:
+        _record_error(stats, "protocol")
+        print(f"Error: Failed to decode JSON response from Ollama.")
+        return None
+    finally:
+        lease.release()
+
+def generate_response_stream(
+    model_name: str,
+    conversation_history: List[Dict[str, str]],
+    on_token: Optional[Callable[[str], None]] = None,
+    base_url: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    cancel_token: Optional[CancelToken] = None,
+    affinity: Optional[str] = None
+) -> str | None:
+    """
+    以流式傳輸 (streaming) 向Ollama API請求生成回應，每收到一段文字就立即回呼。
 
-        # 檢查回應中是否包含預期的 'message' 和 'content'
-        if "message" in response_data and "content" in response_data["message"]:
-            return response_data["message"]["content"]
-        else:
-            print(f"Error: Unexpected response format from Ollama: {response_data}")
+    Ollama 的 `/api/chat` 在 `"stream": True` 時會回傳 NDJSON，
+    每一行是一個包含部分 `message.content` 的JSON物件，最後一行的 `done` 為True。
+
+    Args:
+        model_name (str): 要使用的模型名稱 (例如, "llama3:latest")。
+        conversation_history (List[Dict[str, str]]): 對話歷史記錄。
+        on_token (Callable[[str], None], optional): 每收到一段新文字時呼叫的回呼函式。
+        base_url (str, optional): Ollama服務的基礎URL；未指定時使用 OLLAMA_BASE_URL 或由端點池分配。
+        stats (Dict[str, Any], optional): 若提供，會以最後一個分塊填入載入時間、生成時間與token數；失敗時填入 error
+            (串流在 done 分塊之前結束也視為 "protocol" 錯誤)。
+        cancel_token (CancelToken, optional): 被設定時立即中斷正在讀取的串流並關閉連線，
+            讓Ollama停止生成；此時返回None，stats 中會標記 cancelled。
+        affinity (str, optional): 端點池的固定路由鍵 (例如對話中某一方的 session_id)，
+            讓同一段對話持續送往同一台伺服器以沿用其KV快取。
+
+    Returns:
+        str | None: 完整的AI回應內容。如果發生錯誤或被取消則返回None。
+    """
+    cache_key, cached = response_cache.lookup("ollama", model_name, None, conversation_history)
+    if cached is not None:
+        if stats is not None:
+            stats["cache_hit"] = True
+        if on_token:
+            on_token(cached)
+        return cached
+    payload = build_chat_payload(model_name, conversation_history, stream=True)
+    parser = StreamParser(on_token, stats)
+    lease = _lease(model_name, affinity, base_url, cancel_token, stats)
+    if lease is None:
+        return None
+    try:
+        # timeout 為 (連線逾時, 兩個分塊之間的讀取逾時)，而非整體生成時間
+        with cancel_scope(cancel_token), \
+                get_session().post(f"{lease.url}/api/chat", json=payload, stream=True, timeout=(5, 120)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if parser.feed(line):
+                    break
+        if _was_cancelled(cancel_token, stats):
             return None
+        content = parser.finish()
+        response_cache.store(cache_key, content)
+        return content
 
     except requests.exceptions.RequestException as e:
-        print(f"Error during Ollama generation request: {e}")
+        if _was_cancelled(cancel_token, stats):
+            return None
+        _note_failure(lease, e)
+        _record_error(stats, classify_error(e))
+        print(f"Error during Ollama streaming request: {e}")
+        return None
+    except json.JSONDecodeError:
+        if _was_cancelled(cancel_token, stats):
+            return None
+        _record_error(stats, "protocol")
+        print(f"Error: Failed to decode streamed JSON chunk from Ollama.")
+        return None
+    finally:
+        lease.release()
+
+def warm_up_model(
+    model_name: str,
+    base_url: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None,
+    affinity: Optional[str] = None
+) -> Dict[str, float] | None:
+    """
+    以一個不含訊息的請求預先將模型載入Ollama的記憶體，並套用目前的 keep_alive 設定。
+
+    Args:
+        model_name (str): 要預載的模型名稱。
+        base_url (str, optional): Ollama服務的基礎URL；未指定時使用 OLLAMA_BASE_URL 或由端點池分配。
+        cancel_token (CancelToken, optional): 被設定時立即中止等待並返回None。
+        affinity (str, optional): 端點池的固定路由鍵，應與之後生成請求使用的相同。
+
+    Returns:
+        Dict[str, float] | None: 包含 load_seconds (伺服器回報的模型載入時間) 與
+            wall_seconds (整個請求耗時) 的字典；如果發生錯誤則返回None。
+    """
+    payload = build_chat_payload(model_name, [], stream=False)
+    lease = _lease(model_name, affinity, base_url, cancel_token, None)
+    if lease is None:
+        return None
+    start = time.perf_counter()
+    try:
+        # 在CPU上首次載入大型模型可能需要較長時間，因此使用與生成請求相同的逾時
+        with cancel_scope(cancel_token):
+            response = get_session().post(f"{lease.url}/api/chat", json=payload, timeout=120)
+            response.raise_for_status()
+            response_data = response.json()
+        result: Dict[str, float] = {}
+        fill_stats(result, response_data)
+        result.setdefault("load_seconds", 0.0)
+        result["wall_seconds"] = time.perf_counter() - start
+        return result
+    except requests.exceptions.RequestException as e:
+        if _was_cancelled(cancel_token, None):
+            return None
+        _note_failure(lease, e)
+        print(f"Error warming up Ollama model {model_name}: {e}")
         return None
     except json.JSONDecodeError:
         print(f"Error: Failed to decode JSON response from Ollama.")
         return None
+    finally:
+        lease.release()
@@ -0,0 +1,358 @@
+import asyncio
+import threading
+import requests
+from typing import Callable, List, Dict, Any, Optional, Set, Tuple
+
+from cancellation import CancelToken, CancelledError, await_cancellable
+
+# 背景健康檢查的預設間隔 (秒) 與每次檢查的逾時
+DEFAULT_PROBE_INTERVAL = 15.0
+PROBE_TIMEOUT = 3
+
+class Endpoint:
+    """
+    一台Ollama伺服器的即時狀態。
+
+    in_flight 為目前送往此端點、尚未結束的請求數；models 為最近一次健康檢查回報的模型，
+    尚未檢查過時為None (視為可能擁有任何模型)。entries 為同一次檢查中 `/api/tags` 的完整模型資料。
+    """
+    __slots__ = ("url", "in_flight", "healthy", "models", "entries", "total_requests", "failures")
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.in_flight = 0
+        self.healthy = True
+        self.models: Optional[Set[str]] = None
+        self.entries: List[Dict[str, Any]] = []
+        self.total_requests = 0
+        self.failures = 0
+
+    def has_model(self, model_name: str) -> bool:
+        return self.models is None or model_name in self.models
+
+class Lease:
+    """
+    一次請求對某個端點的使用權。請求結束時必須呼叫 release()，
+    連線失敗時先呼叫 mark_failed()，該端點會被暫時視為不健康，直到下一次健康檢查成功。
+    """
+    def __init__(self, pool: Optional["EndpointPool"], endpoint: Optional[Endpoint], url: str):
+        self.pool = pool
+        self.endpoint = endpoint
+        self.url = url
+        self._released = False
+
+    def mark_failed(self):
+        if self.pool is not None and self.endpoint is not None:
+            self.pool.mark_failed(self.endpoint)
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        if self.pool is not None and self.endpoint is not None:
+            self.pool.release(self.endpoint)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class EndpointPool:
+    """
+    多台Ollama伺服器組成的負載平衡池。
+
+    每個請求送往擁有該模型、健康且進行中請求最少的端點。
+    帶有 affinity (例如對話中某一方的 session_id) 的請求會固定送往同一個端點，
+    讓該伺服器上的KV/前綴快取在回合之間保持有效；只有在該端點不健康或沒有該模型時才會改派。
+    健康狀態與模型列表由背景執行緒定期以 `/api/tags` 檢查。
+
+    max_in_flight 為每個端點同時進行中的請求數上限 (None 表示不限制)；
+    所選端點已滿時 acquire() 會等待，直到有請求結束或傳入的 CancelToken 被設定；
+    事件迴圈中則使用 acquire_async()，等待時不阻塞迴圈。
+    session_provider 返回健康檢查使用的 requests.Session (例如 ollama_client.get_session)，
+    未提供時每次檢查各自建立連線。
+    """
+    def __init__(
+        self,
+        urls: List[str],
+        probe_interval: float = DEFAULT_PROBE_INTERVAL,
+        max_in_flight: Optional[int] = None,
+        session_provider: Optional[Callable[[], requests.Session]] = None
+    ):
+        if not urls:
+            raise ValueError("至少需要一個Ollama端點")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.probe_interval = probe_interval
+        self.max_in_flight = max_in_flight
+        self._session_provider = session_provider
+        self._affinity: Dict[str, Endpoint] = {}
+        self._lock = threading.Lock()
+        # 端點有空位或健康狀態改變時通知等待中的 acquire()
+        self._available = threading.Condition(self._lock)
+        # 等待中的 acquire_async()：(事件迴圈, future)，與 _available 同時被喚醒
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._stop = threading.Event()
+        self._probe_thread: Optional[threading.Thread] = None
+
+    def start(self) -> "EndpointPool":
+        """開始背景健康檢查，第一次檢查會立即進行。"""
+        if self._probe_thread is None:
+            self._probe_thread = threading.Thread(target=self._probe_loop, daemon=True)
+            self._probe_thread.start()
+        return self
+
+    def close(self):
+        """停止背景健康檢查。"""
+        self._stop.set()
+
+    def _probe_loop(self):
+        while not self._stop.is_set():
+            self.probe_all()
+            self._stop.wait(self.probe_interval)
+
+    def probe(self, endpoint: Endpoint) -> Optional[List[str]]:
+        """以 `/api/tags` 檢查單一端點，更新其健康狀態與模型列表，並返回模型列表 (失敗時為None)。"""
+        http = self._session_provider() if self._session_provider is not None else requests
+        try:
+            response = http.get(f"{endpoint.url}/api/tags", timeout=PROBE_TIMEOUT)
+            response.raise_for_status()
+            entries = response.json().get("models", [])
+            models = [model["name"] for model in entries]
+        except (requests.exceptions.RequestException, ValueError) as e:
+            with self._lock:
+                if endpoint.healthy:
+                    print(f"Ollama端點 {endpoint.url} 無法使用: {e}")
+                endpoint.healthy = False
+            return None
+        with self._lock:
+            endpoint.healthy = True
+            endpoint.models = set(models)
+            endpoint.entries = entries
+            self._notify()
+        return models
+
+    def probe_all(self) -> List[str]:
+        """同時檢查所有端點，返回所有健康端點上模型名稱的聯集 (依首次出現的順序)。"""
+        results: Dict[str, Optional[List[str]]] = {}
+        def run(endpoint):
+            results[endpoint.url] = self.probe(endpoint)
+        threads = [threading.Thread(target=run, args=(e,), daemon=True) for e in self.endpoints]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        merged: Dict[str, None] = {}
+        for endpoint in self.endpoints:
+            for name in results.get(endpoint.url) or []:
+                merged.setdefault(name)
+        return list(merged)
+
+    def model_entries(self) -> List[Dict[str, Any]]:
+        """返回最近一次檢查中所有健康端點的 `/api/tags` 模型資料，同名模型只保留第一筆。"""
+        merged: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for endpoint in self.endpoints:
+                if endpoint.healthy:
+                    for entry in endpoint.entries:
+                        merged.setdefault(entry["name"], entry)
+        return list(merged.values())
+
+    def _candidates(self, model_name: str) -> List[Endpoint]:
+        """(需持有鎖) 依序放寬條件：健康且有模型 → 健康 → 有模型 → 全部。"""
+        for condition in (lambda e: e.healthy and e.has_model(model_name),
+                          lambda e: e.healthy,
+                          lambda e: e.has_model(model_name)):
+            candidates = [e for e in self.endpoints if condition(e)]
+            if candidates:
+                return candidates
+        return self.endpoints
+
+    def _has_capacity(self, endpoint: Endpoint) -> bool:
+        return self.max_in_flight is None or endpoint.in_flight < self.max_in_flight
+
+    def _try_acquire(self, model_name: str, affinity: Optional[str]) -> Optional[Endpoint]:
+        """(需持有鎖) 選出端點；有空位時將其進行中請求數加一並返回，已滿時返回None。"""
+        candidates = self._candidates(model_name)
+        endpoint = self._affinity.get(affinity) if affinity else None
+        if endpoint not in candidates:
+            endpoint = min(candidates, key=lambda e: (not self._has_capacity(e), e.in_flight, e.total_requests))
+            if affinity:
+                self._affinity[affinity] = endpoint
+        if not self._has_capacity(endpoint):
+            return None
+        endpoint.in_flight += 1
+        endpoint.total_requests += 1
+        return endpoint
+
+    def _notify(self):
+        """(需持有鎖) 喚醒所有等待中的 acquire() 與 acquire_async()。"""
+        self._available.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # 等待者的事件迴圈已關閉
+                pass
+
+    def _wake_waiters(self):
+        with self._available:
+            self._notify()
+
+    def acquire(self, model_name: str, affinity: Optional[str] = None, cancel_token: Optional[CancelToken] = None) -> Endpoint:
+        """
+        選出處理這個請求的端點並將其進行中請求數加一。
+
+        設定了 max_in_flight 時，固定路由的端點已滿會等待它空出 (保留其KV快取)，
+        沒有固定路由時則等待任一候選端點空出。
+
+        Raises:
+            CancelledError: 取得端點前 cancel_token 就被設定時 (例如使用者按下停止或超過回合期限)。
+        """
+        # 回呼需在取得鎖之前登記：token 已被設定時 add_callback() 會立即呼叫它
+        callback = cancel_token.add_callback(self._wake_waiters) if cancel_token is not None else None
+        try:
+            with self._available:
+                while True:
+                    if cancel_token is not None and cancel_token.is_set():
+                        raise CancelledError()
+                    endpoint = self._try_acquire(model_name, affinity)
+                    if endpoint is not None:
+                        return endpoint
+                    self._available.wait()
+        finally:
+            if callback is not None:
+                cancel_token.remove_callback(callback)
+
+    async def acquire_async(self, model_name: str, affinity: Optional[str] = None,
+                            cancel_token: Optional[CancelToken] = None) -> Endpoint:
+        """
+        acquire() 的非同步版本：端點已滿時在事件迴圈中等待，不阻塞同一迴圈上的其他對話。
+
+        Raises:
+            CancelledError: 取得端點前 cancel_token 就被設定時。
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if cancel_token is not None and cancel_token.is_set():
+                    raise CancelledError()
+                endpoint = self._try_acquire(model_name, affinity)
+                if endpoint is not None:
+                    return endpoint
+                entry = (loop, loop.create_future())
+                self._async_waiters.append(entry)
+            try:
+                await await_cancellable(cancel_token, entry[1])
+            finally:
+                with self._lock:
+                    if entry in self._async_waiters:
+                        self._async_waiters.remove(entry)
+
+    def set_max_in_flight(self, max_in_flight: Optional[int]):
+        """變更每個端點的並行上限 (None 表示不限制)。"""
+        with self._available:
+            self.max_in_flight = max_in_flight
+            self._notify()
+
+    def release(self, endpoint: Endpoint):
+        with self._available:
+            endpoint.in_flight -= 1
+            self._notify()
+
+    def mark_failed(self, endpoint: Endpoint):
+        with self._available:
+            endpoint.failures += 1
+            endpoint.healthy = False
+            self._notify()
+
+    def release_affinity(self, affinity: Optional[str]):
+        """對話結束時移除其固定路由。"""
+        with self._lock:
+            self._affinity.pop(affinity, None)
+
+    def stats(self) -> List[Dict[str, object]]:
+        """返回每個端點的狀態快照。"""
+        with self._lock:
+            return [{"url": e.url, "healthy": e.healthy, "in_flight": e.in_flight,
+                     "total_requests": e.total_requests, "failures": e.failures,
+                     "models": sorted(e.models) if e.models is not None else None}
+                    for e in self.endpoints]
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+# ollama_client 共用的端點池；None 表示只使用單一的 OLLAMA_BASE_URL
+_pool: Optional[EndpointPool] = None
+
+def configure(
+    urls: List[str],
+    probe_interval: float = DEFAULT_PROBE_INTERVAL,
+    max_in_flight: Optional[int] = None,
+    session_provider: Optional[Callable[[], requests.Session]] = None
+) -> Optional[EndpointPool]:
+    """
+    以端點列表建立 (或重建) 共用的端點池。只有一個端點時也會建立端點池 (請求都送往該端點)；
+    列表為空時停用端點池。
+
+    Returns:
+        Optional[EndpointPool]: 新的端點池；停用時為None。
+    """
+    global _pool
+    new_pool = EndpointPool(urls, probe_interval, max_in_flight, session_provider).start() if urls else None
+    old_pool, _pool = _pool, new_pool
+    if old_pool is not None:
+        old_pool.close()
+    return new_pool
+
+def get_pool() -> Optional[EndpointPool]:
+    """返回目前的端點池，若未啟用則為None。"""
+    return _pool
+
+def lease(
+    model_name: str,
+    affinity: Optional[str] = None,
+    base_url: Optional[str] = None,
+    default_url: str = "",
+    cancel_token: Optional[CancelToken] = None
+) -> Lease:
+    """
+    為一次請求取得端點。
+
+    Args:
+        model_name (str): 請求的模型名稱。
+        affinity (str, optional): 固定路由的鍵，例如對話中某一方的 session_id。
+        base_url (str, optional): 呼叫端明確指定的位址；指定時不經過端點池。
+        default_url (str): 未啟用端點池時使用的位址。
+        cancel_token (CancelToken, optional): 等待已滿的端點時，被設定即停止等待。
+
+    Returns:
+        Lease: 帶有 url 的使用權，請求結束後需呼叫 release() (或以 with 使用)。
+
+    Raises:
+        CancelledError: 取得端點前 cancel_token 就被設定時。
+    """
+    pool = _pool
+    if base_url or pool is None:
+        return Lease(None, None, base_url or default_url)
+    endpoint = pool.acquire(model_name, affinity, cancel_token)
+    return Lease(pool, endpoint, endpoint.url)
+
+async def lease_async(
+    model_name: str,
+    affinity: Optional[str] = None,
+    base_url: Optional[str] = None,
+    default_url: str = "",
+    cancel_token: Optional[CancelToken] = None
+) -> Lease:
+    """
+    lease() 的非同步版本，供 async_ollama_client 使用；參數與返回值相同。
+
+    Raises:
+        CancelledError: 取得端點前 cancel_token 就被設定時。
+    """
+    pool = _pool
+    if base_url or pool is None:
+        return Lease(None, None, base_url or default_url)
+    endpoint = await pool.acquire_async(model_name, affinity, cancel_token)
+    return Lease(pool, endpoint, endpoint.url)
@@ -1,5 +1,10 @@
 import openai
-from typing import List, Dict, Optional
+from typing import List, Dict, Any, Optional
+
+import response_cache
+from resilience import classify_error
+import rate_limiter
+from cancellation import CancelToken, CancelledError, run_cancellable
 
 # A list of commonly used OpenAI models
 SUPPORTED_MODELS = [
@@ -34,34 +39,84 @@ def configure_api_key(api_key: str) -> bool:
         client = None
         return False
 
+def build_messages(system_prompt: str, conversation_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Builds the chat-completions message list. Shared with async_openai_client.
+    """
+    # The first message in the history for OpenAI should be the system prompt
+    messages = [{"role": "system", "content": system_prompt}]
+    # Append the rest of the conversation history
+    messages.extend(conversation_history)
+    return messages
+
+def fill_usage(stats: Optional[Dict[str, Any]], response):
+    """
+    Copies the token usage of a chat-completions response into stats.
+    """
+    usage = getattr(response, "usage", None)
+    if stats is None or usage is None:
+        return
+    stats["prompt_tokens"] = usage.prompt_tokens
+    stats["completion_tokens"] = usage.completion_tokens
+
+def usage_tokens(response) -> Optional[int]:
+    """
+    Returns the total tokens a response consumed, used to correct the TPM estimate.
+    """
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
 def generate_response(
     model_name: str,
     system_prompt: str,
-    conversation_history: List[Dict[str, str]]
+    conversation_history: List[Dict[str, str]],
+    stats: Optional[Dict[str, Any]] = None,
+    cancel_token: Optional[CancelToken] = None
 ) -> Optional[str]:
     """
     Generates a response using the specified OpenAI model.
+    If stats is given, it receives the prompt/completion token usage and any rate-limit wait.
+    Returns None on errors so they are never passed on as dialogue.
+    If cancel_token is set while the request is in flight, returns None right away
+    and marks stats["cancelled"].
     """
     if not client:
-        return "OpenAI client is not configured. Please set your API key."
+        print("OpenAI client is not configured. Please set your API key.")
+        return None
 
     if model_name not in SUPPORTED_MODELS:
-        return f"Error: Model '{model_name}' is not in the list of supported OpenAI models."
+        print(f"Error: Model '{model_name}' is not in the list of supported OpenAI models.")
+        return None
 
-    # The first message in the history for OpenAI should be the system prompt
-    messages = [{"role": "system", "content": system_prompt}]
-    # Append the rest of the conversation history
-    messages.extend(conversation_history)
+    messages = build_messages(system_prompt, conversation_history)
+    cache_key, cached = response_cache.lookup("openai", model_name, None, messages)
+    if cached is not None:
+        if stats is not None:
+            stats["cache_hit"] = True
+        return cached
 
     try:
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=messages
-        )
-        return response.choices[0].message.content
+        # Requests queue on the model's RPM/TPM quota and back off on 429s, honoring Retry-After.
+        # The SDK call cannot be interrupted, so it is awaited on a helper thread and abandoned on cancel.
+        response = rate_limiter.call_with_limits(
+            "openai", model_name, rate_limiter.estimate_request_tokens(messages),
+            lambda: run_cancellable(cancel_token, client.chat.completions.create, model=model_name, messages=messages),
+            cancel_token=cancel_token, stats=stats, usage=usage_tokens)
+        content = response.choices[0].message.content
+        fill_usage(stats, response)
+        response_cache.store(cache_key, content)
+        return content
+    except CancelledError:
+        if stats is not None:
+            stats["cancelled"] = True
+        return None
     except openai.APIError as e:
         print(f"OpenAI API Error: {e}")
-        return f"OpenAI API Error: {e}"
+        if stats is not None:
+            stats["error"] = classify_error(e)
+        return None
     except Exception as e:
         print(f"An unexpected error occurred while generating response from OpenAI: {e}")
-        return f"An unexpected error occurred: {e}"
+        if stats is not None:
+            stats["error"] = classify_error(e)
+        return None
@@ -1,13 +1,34 @@
 import csv
 import io
-from typing import List, Dict
-from docx import Document
-from openpyxl import Workbook
+from typing import List, Dict, Tuple
 
 # 定義一個標準的對話紀錄結構
 # 這是從主應用傳遞到格式化器的資料格式
 StructuredLog = List[Dict[str, str]]
 
+# 每回合可能附帶的效能指標欄位 (由 DebateRunner 記錄)，在CSV/Excel中作為額外欄位輸出
+METRIC_FIELDS = ['model', 'wall_time', 'ttft', 'prompt_tokens', 'completion_tokens', 'tokens_per_sec',
+                 'attempts', 'breaker_opens', 'breaker_closes']
+
+def _fieldnames(log: StructuredLog) -> List[str]:
+    """返回表格輸出的欄位：固定的 speaker/content，若有任何一筆帶有效能指標則加上指標欄位。"""
+    if any(field in entry for entry in log for field in METRIC_FIELDS):
+        return ['speaker', 'content'] + METRIC_FIELDS
+    return ['speaker', 'content']
+
+# 純文字格式中每筆記錄之間的分隔
+TXT_SEPARATOR = "\n"
+
+def txt_entry_parts(speaker: str) -> Tuple[str, str]:
+    """
+    返回純文字格式中一筆記錄在內容前後加上的文字，讓逐段讀取長篇紀錄時 (history_db.TranscriptReader)
+    不必載入整筆內容也能得到與 to_txt() 相同的結果。
+    """
+    # 如果是系統訊息(例如開頭的角色介紹)，直接印出內容
+    if speaker == 'System':
+        return "", ""
+    return f"[{speaker}]:\n", "\n"
+
 def to_txt(log: StructuredLog) -> str:
     """
     將結構化日誌轉換為純文字格式。
@@ -20,12 +41,9 @@ def to_txt(log: StructuredLog) -> str:
     """
     output = []
     for entry in log:
-        # 如果是系統訊息(例如開頭的角色介紹)，直接印出內容
-        if entry['speaker'] == 'System':
-            output.append(entry['content'])
-        else:
-            output.append(f"[{entry['speaker']}]:\n{entry['content']}\n")
-    return "\n".join(output)
+        prefix, suffix = txt_entry_parts(entry['speaker'])
+        output.append(f"{prefix}{entry['content']}{suffix}")
+    return TXT_SEPARATOR.join(output)
 
 def to_csv(log: StructuredLog) -> str:
     """
@@ -42,9 +60,9 @@ def to_csv(log: StructuredLog) -> str:
 
     # 使用 io.StringIO 在記憶體中建立一個類似檔案的物件來寫入CSV
     output = io.StringIO()
-    # 定義CSV的欄位標頭
-    fieldnames = ['speaker', 'content']
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
+    # 定義CSV的欄位標頭；沒有效能指標的項目 (例如摘要) 其指標欄位留空
+    fieldnames = _fieldnames(dialogue_only_log)
+    writer = csv.DictWriter(output, fieldnames=fieldnames, restval='', extrasaction='ignore')
 
     writer.writeheader()
     writer.writerows(dialogue_only_log)
@@ -84,6 +102,8 @@ def to_docx(log: StructuredLog, filepath: str):
         log (StructuredLog): 結構化的對話日誌。
         filepath (str): 要儲存的檔案路徑。
     """
+    # python-docx 與 openpyxl 載入較慢，只在實際匯出該格式時才匯入，不拖慢應用程式啟動
+    from docx import Document
     document = Document()
     # 處理開頭的系統訊息
     if log and log[0]['speaker'] == 'System':
@@ -113,17 +133,19 @@ def to_xlsx(log: StructuredLog, filepath: str):
     # 過濾掉非對話的系統訊息
     dialogue_only_log = [entry for entry in log if entry['speaker'] != 'System']
 
+    from openpyxl import Workbook
     workbook = Workbook()
     sheet = workbook.active
     sheet.title = "對話紀錄"
 
     # 寫入標頭
-    sheet['A1'] = "speaker"
-    sheet['B1'] = "content"
+    fieldnames = _fieldnames(dialogue_only_log)
+    for col_idx, field in enumerate(fieldnames, start=1):
+        sheet.cell(row=1, column=col_idx, value=field)
 
     # 寫入資料
     for row_idx, entry in enumerate(dialogue_only_log, start=2):
-        sheet[f'A{row_idx}'] = entry['speaker']
-        sheet[f'B{row_idx}'] = entry['content']
+        for col_idx, field in enumerate(fieldnames, start=1):
+            sheet.cell(row=row_idx, column=col_idx, value=entry.get(field))
 
     workbook.save(filepath)
@@ -2,21 +2,18 @@ from typing import List, Dict, Optional
 import os
 import json
 
+import library_db
+from record_store import RecordStore
+
 DEFAULT_PERSONAS_FILE = "DEFAULT_PERSONAS.md"
 USER_PERSONAS_FILE = "user_personas.json"
 
-def load_default_personas() -> List[Dict[str, str]]:
+def parse_default_personas(content: str) -> List[Dict[str, str]]:
     """
-    解析Markdown檔案，提取預設的AI角色。
+    解析預設角色Markdown檔案的內容，提取預設的AI角色。
     """
     personas = []
-    if not os.path.exists(DEFAULT_PERSONAS_FILE):
-        return personas
-
     try:
-        with open(DEFAULT_PERSONAS_FILE, 'r', encoding='utf-8') as f:
-            content = f.read()
-
         persona_blocks = content.split('---')
 
         for block in persona_blocks:
@@ -40,39 +37,51 @@ def load_default_personas() -> List[Dict[str, str]]:
 
     return personas
 
-def load_user_personas() -> List[Dict[str, str]]:
+def load_default_personas() -> List[Dict[str, str]]:
     """
-    從JSON檔案載入使用者自訂的角色。
+    解析Markdown檔案，提取預設的AI角色。
     """
-    if not os.path.exists(USER_PERSONAS_FILE):
+    if not os.path.exists(DEFAULT_PERSONAS_FILE):
         return []
     try:
-        with open(USER_PERSONAS_FILE, 'r', encoding='utf-8') as f:
-            user_personas = json.load(f)
-            for p in user_personas:
-                p["is_default"] = False
-            return user_personas
-    except (json.JSONDecodeError, IOError) as e:
-        print(f"錯誤: 讀取使用者角色檔案時發生錯誤: {e}")
+        with open(DEFAULT_PERSONAS_FILE, 'r', encoding='utf-8') as f:
+            return parse_default_personas(f.read())
+    except IOError as e:
+        print(f"錯誤: 解析預設角色檔案時發生錯誤: {e}")
         return []
 
-def save_user_personas(personas: List[Dict[str, str]]):
+def parse_user_personas(content: str) -> List[Dict[str, str]]:
     """
-    將使用者自訂的角色儲存到JSON檔案。
+    解析使用者角色JSON檔案的內容 (舊版 USER_PERSONAS_FILE 的自動匯入與匯入備份時使用)。
     """
-    user_only_personas = [
-        {"name": p["name"], "prompt": p["prompt"]} for p in personas if not p.get("is_default")
-    ]
     try:
-        with open(USER_PERSONAS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(user_only_personas, f, ensure_ascii=False, indent=4)
-    except IOError as e:
-        print(f"錯誤: 儲存使用者角色檔案時發生錯誤: {e}")
+        user_personas = json.loads(content)
+    except json.JSONDecodeError as e:
+        print(f"錯誤: 讀取使用者角色檔案時發生錯誤: {e}")
+        return []
+    for p in user_personas:
+        p["is_default"] = False
+    return user_personas
 
 def get_all_personas() -> List[Dict[str, str]]:
     """
-    獲取所有角色（預設+使用者自訂）。
+    獲取所有角色（預設+使用者自訂），內容來自共用的角色索引。
+    """
+    return [dict(p) for p in get_store().records()]
+
+# 應用程式共用的角色索引 (預設角色 + 使用者自訂角色)，第一次使用時建立
+_store: Optional[RecordStore] = None
+
+def get_store() -> RecordStore:
+    """
+    取得共用的角色索引。
+
+    以名稱查詢角色不會讀取磁碟；呼叫 reload_if_changed() 時只有內容改變的檔案才會被重新解析。
+    使用者自訂角色存放在 library_db 中，新增、修改與刪除只寫入變動的那一筆；
+    第一次使用時會自動匯入舊版的 USER_PERSONAS_FILE。匯出與匯入備份仍使用相同的JSON格式。
     """
-    default = load_default_personas()
-    user = load_user_personas()
-    return default + user
+    global _store
+    if _store is None:
+        _store = RecordStore([(DEFAULT_PERSONAS_FILE, parse_default_personas)],
+                             library_db.get_collection("personas", USER_PERSONAS_FILE, parse_user_personas))
+    return _store
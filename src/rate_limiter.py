@@ -0,0 +1,295 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import List, Dict, Any, Callable, Awaitable, Optional
+
+from cancellation import CancelledError
+from context_window import estimate_tokens
+
+# 遇到 429 時最多重試的次數，以及指數退避的起始與上限秒數
+MAX_RATE_LIMIT_RETRIES = 5
+BASE_BACKOFF_SECONDS = 2.0
+MAX_BACKOFF_SECONDS = 60.0
+# 預估token用量時，假設每則回覆的長度
+DEFAULT_EXPECTED_OUTPUT_TOKENS = 512
+
+class _Bucket:
+    """
+    以每分鐘額度定義的令牌桶 (token bucket)。
+
+    reserve() 允許餘額變成負數：先到的請求先扣額度，回傳需要等待多久才能補回，
+    因此等待的先後順序就是到達的順序，多場同時進行的對話會公平地輪流使用額度。
+    """
+    __slots__ = ("capacity", "rate", "tokens", "last")
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """扣除 amount 並返回需要等待的秒數。"""
+        self._refill(now)
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount: float, now: float):
+        """依實際用量修正先前的預估 (amount 為負數時表示多扣)。"""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class RateLimiter:
+    """
+    單一來源與模型的請求數 (RPM) 與token數 (TPM) 限制器，可被多個對話執行緒共用。
+
+    rpm 或 tpm 為None時不限制該項，但仍會依伺服器回報的 Retry-After 暫停所有請求。
+    """
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.rpm = _Bucket(rpm) if rpm else None
+        self.tpm = _Bucket(tpm) if tpm else None
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, estimated_tokens: int) -> float:
+        """
+        為一次請求預留額度。
+
+        Returns:
+            float: 呼叫端在送出請求前應等待的秒數。
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self.blocked_until - now)
+            if self.rpm is not None:
+                delay = max(delay, self.rpm.reserve(1, now))
+            if self.tpm is not None:
+                delay = max(delay, self.tpm.reserve(estimated_tokens, now))
+            return delay
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """請求完成後，以實際token用量修正預估值。"""
+        if self.tpm is None or actual_tokens is None:
+            return
+        with self._lock:
+            self.tpm.refund(estimated_tokens - actual_tokens, time.monotonic())
+
+    def cancel(self, estimated_tokens: int):
+        """退還一次未被伺服器接受 (429 或在排隊時被取消) 的請求所預留的額度。"""
+        with self._lock:
+            now = time.monotonic()
+            if self.rpm is not None:
+                self.rpm.refund(1, now)
+            if self.tpm is not None:
+                self.tpm.refund(estimated_tokens, now)
+
+    def penalize(self, delay: float):
+        """收到 429 後，在 delay 秒內暫停這個模型的所有新請求。"""
+        with self._lock:
+            self.throttled += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+# 以 (來源, 模型) 為鍵的共用限制器，以及來自設定檔的額度表
+_limiters: Dict[tuple, RateLimiter] = {}
+_limits: Dict[str, Dict[str, Dict[str, float]]] = {}
+_limiters_lock = threading.Lock()
+
+def configure(limits: Dict[str, Dict[str, Dict[str, float]]]):
+    """
+    設定各來源與模型的額度，並重建所有限制器。
+
+    Args:
+        limits: 例如 {"gemini": {"default": {"rpm": 10, "tpm": 250000}, "gemini-2.5-pro": {"rpm": 5}}}。
+            模型名稱找不到時使用該來源的 "default"；都沒有時不限制速率。
+    """
+    global _limits
+    with _limiters_lock:
+        _limits = {provider.lower(): models for provider, models in (limits or {}).items()}
+        _limiters.clear()
+
+def get_limiter(provider: str, model_name: str) -> RateLimiter:
+    """取得 (必要時建立) 某個來源與模型共用的限制器。"""
+    key = (provider, model_name)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            models = _limits.get(provider, {})
+            limit = models.get(model_name) or models.get("default") or {}
+            limiter = RateLimiter(limit.get("rpm"), limit.get("tpm"))
+            _limiters[key] = limiter
+        return limiter
+
+def estimate_request_tokens(
+    messages: List[Dict[str, str]],
+    system_prompt: Optional[str] = None,
+    expected_output: int = DEFAULT_EXPECTED_OUTPUT_TOKENS
+) -> int:
+    """預估一次請求會消耗的token數 (提示加上預期的回覆長度)，用於TPM限制。"""
+    prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+    if system_prompt:
+        prompt_tokens += estimate_tokens(system_prompt)
+    return prompt_tokens + expected_output
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """判斷例外是否為速率限制 (HTTP 429)，同時適用於Gemini的 ResourceExhausted 與OpenAI的 RateLimitError。"""
+    if type(error).__name__ in ("ResourceExhausted", "RateLimitError", "TooManyRequests"):
+        return True
+    for attr in ("status_code", "code"):
+        try:
+            if int(getattr(error, attr, 0) or 0) == 429:
+                return True
+        except (TypeError, ValueError):
+            pass
+    return False
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    從 429 錯誤中取出伺服器建議的等待秒數。
+
+    支援 HTTP 標頭 (retry-after-ms / retry-after) 以及Gemini錯誤訊息中的 retry_delay / "retry in Ns"。
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            pass
+    match = (re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", str(error))
+             or re.search(r"retry in ([\d.]+)\s*s", str(error), re.IGNORECASE))
+    return float(match.group(1)) if match else None
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    第 attempt 次重試前的等待秒數：指數退避加上隨機抖動，且不少於伺服器要求的 Retry-After。
+    """
+    base = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt))
+    base = max(base, retry_after or 0.0)
+    return base + random.uniform(0, base * 0.25)
+
+def wait(delay: float, cancel_token: Any = None) -> bool:
+    """
+    等待 delay 秒；若 cancel_token 在期間被設定則提前返回。
+
+    Returns:
+        bool: 完整等待完畢時為True，被取消時為False。
+    """
+    if delay <= 0:
+        return cancel_token is None or not cancel_token.is_set()
+    if cancel_token is None:
+        time.sleep(delay)
+        return True
+    return not cancel_token.wait(delay)
+
+def _record(stats: Optional[Dict[str, Any]], waited: float, retries: int):
+    if stats is None:
+        return
+    if waited > 0:
+        stats["rate_limit_wait_seconds"] = round(waited, 3)
+    if retries:
+        stats["rate_limit_retries"] = retries
+
+def call_with_limits(
+    provider: str,
+    model_name: str,
+    estimated_tokens: int,
+    send: Callable[[], Any],
+    cancel_token: Any = None,
+    stats: Optional[Dict[str, Any]] = None,
+    usage: Optional[Callable[[Any], Optional[int]]] = None
+) -> Any:
+    """
+    依該模型的額度排隊後呼叫 send()；遇到 429 時暫停整個模型並以退避時間重試。
+
+    Args:
+        provider (str): 來源名稱 ("gemini" 或 "openai")。
+        model_name (str): 模型名稱。
+        estimated_tokens (int): 預估的token用量，見 estimate_request_tokens()。
+        send (Callable[[], Any]): 實際送出請求的函式。
+        cancel_token (CancelToken, optional): 排隊或退避期間被設定時立即放棄。
+        stats (Dict[str, Any], optional): 若提供，會填入排隊秒數與重試次數。
+        usage (Callable, optional): 從回應取出實際token總數的函式，用來修正TPM額度。
+
+    Returns:
+        Any: send() 的返回值。
+
+    Raises:
+        CancelledError: 等待期間被取消時。
+        Exception: 非速率限制的錯誤，或重試次數用盡後的最後一個錯誤。
+    """
+    limiter = get_limiter(provider, model_name)
+    waited = 0.0
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        delay = limiter.reserve(estimated_tokens)
+        waited += delay
+        if not wait(delay, cancel_token):
+            limiter.cancel(estimated_tokens)
+            raise CancelledError()
+        try:
+            response = send()
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                _record(stats, waited, attempt)
+                raise
+            # 被拒絕的請求沒有用掉額度，重試前先退還這次的預留，避免每次重試重複扣除
+            limiter.cancel(estimated_tokens)
+            if attempt == MAX_RATE_LIMIT_RETRIES:
+                _record(stats, waited, attempt)
+                raise
+            backoff = backoff_delay(attempt, retry_after_seconds(e))
+            print(f"{provider} 模型 {model_name} 達到速率限制，{backoff:.1f} 秒後重試 ({attempt + 1}/{MAX_RATE_LIMIT_RETRIES})。")
+            limiter.penalize(backoff)
+            continue
+        _record(stats, waited, attempt)
+        if usage is not None:
+            limiter.settle(estimated_tokens, usage(response))
+        return response
+
+async def call_with_limits_async(
+    provider: str,
+    model_name: str,
+    estimated_tokens: int,
+    send: Callable[[], Awaitable[Any]],
+    stats: Optional[Dict[str, Any]] = None,
+    usage: Optional[Callable[[Any], Optional[int]]] = None
+) -> Any:
+    """call_with_limits() 的非同步版本；取消則交由 asyncio 的工作取消處理。"""
+    limiter = get_limiter(provider, model_name)
+    waited = 0.0
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        delay = limiter.reserve(estimated_tokens)
+        waited += delay
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                limiter.cancel(estimated_tokens)
+                raise
+        try:
+            response = await send()
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                _record(stats, waited, attempt)
+                raise
+            limiter.cancel(estimated_tokens)
+            if attempt == MAX_RATE_LIMIT_RETRIES:
+                _record(stats, waited, attempt)
+                raise
+            backoff = backoff_delay(attempt, retry_after_seconds(e))
+            print(f"{provider} 模型 {model_name} 達到速率限制，{backoff:.1f} 秒後重試 ({attempt + 1}/{MAX_RATE_LIMIT_RETRIES})。")
+            limiter.penalize(backoff)
+            continue
+        _record(stats, waited, attempt)
+        if usage is not None:
+            limiter.settle(estimated_tokens, usage(response))
+        return response
@@ -0,0 +1,240 @@
+import hashlib
+import os
+import threading
+from types import MappingProxyType
+from typing import List, Dict, Any, Callable, Mapping, Optional, Tuple
+
+from search_index import SearchIndex, scan, split_query
+
+Record = Mapping[str, Any]
+
+class _Source:
+    """RecordStore 的一個資料檔：路徑、解析函式，以及上次載入時的檔案簽章與內容雜湊。"""
+    __slots__ = ("path", "parse", "signature", "digest", "records")
+
+    def __init__(self, path: str, parse: Callable[[str], List[Dict[str, Any]]]):
+        self.path = path
+        self.parse = parse
+        self.signature: Optional[Tuple[int, int]] = None
+        self.digest: Optional[str] = None
+        self.records: List[Record] = []
+
+def _freeze(record: Dict[str, Any]) -> Record:
+    """複製一份並包成唯讀的 MappingProxyType，呼叫端無法再修改索引中的資料。"""
+    return MappingProxyType(dict(record))
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+class RecordStore:
+    """
+    以名稱為鍵、常駐記憶體的唯讀記錄索引 (角色、風格)。
+
+    資料依序合併自唯讀的檔案 (例如預設角色) 與一個可修改的 editable 來源 (library_db.Collection)；
+    名稱重複時保留先出現的記錄。reload_if_changed() 只在檔案的修改時間或大小改變、且內容雜湊也不同時
+    才重新解析檔案，可修改來源則只在其他程式寫入後 (version() 改變) 才重新載入，因此查詢不會讀取磁碟。
+    修改只寫入變動的那一筆記錄。
+
+    search() 以名稱與 search_field (提示詞) 的倒排索引進行全文搜尋。索引在第一次搜尋時於背景建立，
+    建立完成前改用線性搜尋；之後的修改只更新變動的記錄。
+    """
+    search_field = "prompt"
+
+    def __init__(self, sources: List[Tuple[str, Callable[[str], List[Dict[str, Any]]]]], editable: Any):
+        """
+        Args:
+            sources: (檔案路徑, 將檔案內容解析成記錄列表的函式) 的唯讀來源列表。
+            editable: 可修改的來源，需提供 version(), load(), insert(), update(), delete(), replace()
+                (見 library_db.Collection)。
+        """
+        self._sources = [_Source(path, parse) for path, parse in sources]
+        self._editable = editable
+        self._editable_version: Optional[int] = None
+        self._editable_records: List[Record] = []
+        self._index: Dict[str, Record] = {}
+        self._names: Tuple[str, ...] = ()
+        self._order: Dict[str, int] = {}
+        self._search: Optional[SearchIndex] = None
+        self._search_building = False
+        self._generation = 0
+        self._lock = threading.RLock()
+        self.reload_if_changed()
+
+    # --- 載入 ---
+    def _load(self, source: _Source) -> bool:
+        """檢查單一檔案；內容有變化時重新解析並返回True。"""
+        signature = _stat(source.path)
+        if signature == source.signature and source.signature is not None:
+            return False
+        if signature is None:
+            changed = source.signature is not None or source.records
+            source.signature, source.digest, source.records = None, None, []
+            return bool(changed)
+        try:
+            with open(source.path, 'rb') as f:
+                data = f.read()
+        except IOError as e:
+            print(f"錯誤: 讀取檔案 {source.path} 時發生錯誤: {e}")
+            return False
+        source.signature = signature
+        digest = hashlib.sha1(data).hexdigest()
+        if digest == source.digest:
+            # 只有修改時間改變 (例如被重新儲存成相同內容)，不必重新解析
+            return False
+        source.digest = digest
+        source.records = [_freeze(r) for r in source.parse(data.decode('utf-8'))]
+        return True
+
+    def _load_editable(self) -> bool:
+        version = self._editable.version()
+        if version == self._editable_version:
+            return False
+        self._editable_version = version
+        self._editable_records = [_freeze(r) for r in self._editable.load()]
+        return True
+
+    def _rebuild(self):
+        index: Dict[str, Record] = {}
+        for records in [source.records for source in self._sources] + [self._editable_records]:
+            for record in records:
+                index.setdefault(record["name"], record)
+        self._index = index
+        self._names = tuple(index)
+        self._order = {name: i for i, name in enumerate(self._names)}
+        self._generation += 1
+
+    def reload_if_changed(self) -> bool:
+        """
+        重新檢查所有資料來源，只載入內容有變化的來源。
+
+        Returns:
+            bool: 索引是否被更新。
+        """
+        with self._lock:
+            changed = False
+            for source in self._sources:
+                changed = self._load(source) or changed
+            changed = self._load_editable() or changed
+            if changed:
+                self._rebuild()
+                self._search = None
+            return changed
+
+    # --- 查詢 ---
+    def get(self, name: str) -> Optional[Record]:
+        """以名稱取得記錄 (唯讀)，找不到時返回None。"""
+        return self._index.get(name)
+
+    def names(self) -> Tuple[str, ...]:
+        """所有記錄的名稱，依來源與記錄的順序排列。"""
+        return self._names
+
+    def records(self) -> List[Record]:
+        """所有記錄 (唯讀)，順序與 names() 相同。"""
+        return list(self._index.values())
+
+    def editable_records(self) -> List[Record]:
+        """可修改來源中的記錄 (例如使用者自訂角色)。"""
+        return list(self._editable_records)
+
+    # --- 搜尋 ---
+    def prepare_search(self):
+        """在背景建立搜尋索引；已建立或正在建立時不做任何事。"""
+        with self._lock:
+            if self._search is not None or self._search_building:
+                return
+            self._search_building = True
+            generation, snapshot = self._generation, list(self._index.values())
+        def build():
+            index = SearchIndex()
+            for record in snapshot:
+                index.add(record["name"], record.get(self.search_field, ""))
+            with self._lock:
+                self._search_building = False
+                # 建立期間記錄有變動時放棄這份索引，下一次搜尋會重新建立
+                if generation == self._generation:
+                    self._search = index
+        threading.Thread(target=build, daemon=True).start()
+
+    def search(self, query: str, editable_only: bool = False) -> List[str]:
+        """
+        全文搜尋名稱與提示詞，查詢詞以空白分隔且都必須出現；名稱符合的記錄排在前面。
+
+        Args:
+            query (str): 查詢字串。
+            editable_only (bool): 是否只返回可修改來源中的記錄 (例如管理視窗只列出使用者自訂角色)。
+
+        Returns:
+            List[str]: 符合的記錄名稱；查詢為空時返回所有 (可修改的) 名稱。
+        """
+        if not split_query(query):
+            names = list(self._names)
+        elif self._search is None:
+            self.prepare_search()
+            names = scan(((r["name"], r.get(self.search_field, "")) for r in self._index.values()), query, self._order)
+        else:
+            names = self._search.search(query, self._order)
+        if editable_only:
+            editable = {r["name"] for r in self._editable_records}
+            names = [name for name in names if name in editable]
+        return names
+
+    def _reindex(self, *names: str):
+        """(需持有鎖) 修改後只更新搜尋索引中受影響的記錄。"""
+        if self._search is None:
+            return
+        for name in names:
+            self._search.remove(name)
+            record = self._index.get(name)
+            if record is not None:
+                self._search.add(name, record.get(self.search_field, ""))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    # --- 修改 ---
+    def add(self, record: Dict[str, Any]) -> bool:
+        """新增一筆記錄；名稱已存在時不新增並返回False。"""
+        with self._lock:
+            if record["name"] in self._index or not self._editable.insert(record):
+                return False
+            self._editable_records = self._editable_records + [_freeze(record)]
+            self._rebuild()
+            self._reindex(record["name"])
+            return True
+
+    def update(self, old_name: str, record: Dict[str, Any]) -> bool:
+        """以新的內容取代名為 old_name 的可修改記錄 (可改名)；新名稱與其他記錄重複時返回False。"""
+        with self._lock:
+            if record["name"] != old_name and record["name"] in self._index:
+                return False
+            if not self._editable.update(old_name, record):
+                return False
+            self._editable_records = [_freeze(record) if r["name"] == old_name else r for r in self._editable_records]
+            self._rebuild()
+            self._reindex(old_name, record["name"])
+            return True
+
+    def remove(self, name: str):
+        """刪除名為 name 的可修改記錄。"""
+        with self._lock:
+            self._editable.delete(name)
+            self._editable_records = [r for r in self._editable_records if r["name"] != name]
+            self._rebuild()
+            self._reindex(name)
+
+    def replace_editable(self, records: List[Dict[str, Any]]):
+        """以新的列表取代可修改來源中的所有記錄 (例如匯入備份)。"""
+        with self._lock:
+            self._editable.replace(records)
+            seen = set()
+            self._editable_records = [_freeze(r) for r in records if not (r["name"] in seen or seen.add(r["name"]))]
+            self._rebuild()
+            self._search = None
@@ -0,0 +1,341 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Awaitable, Dict, Any, Callable, Optional, Tuple
+
+from cancellation import CancelToken, CancelledError, await_cancellable
+
+# 每回合 (含所有重試) 可使用的總秒數，以及暫時性錯誤的重試次數與退避時間
+DEFAULT_TURN_BUDGET_SECONDS = 300.0
+DEFAULT_MAX_RETRIES = 2
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 15.0
+# 斷路器：連續失敗達到門檻後斷開，冷卻時間過後放行一個探測請求
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_BREAKER_COOLDOWN_SECONDS = 30.0
+
+# 值得重試、且會計入斷路器的錯誤類型 (見 classify_error())。
+# rate_limit 不在其中：429 已由 rate_limiter 依 Retry-After 重試過，回到這裡時表示額度仍未恢復，
+# 再重試只會加重限流；它也不代表後端故障，因此不計入斷路器。
+TRANSIENT_ERRORS = {"connection", "timeout", "server", "protocol"}
+
+_settings = {
+    "turn_budget_seconds": DEFAULT_TURN_BUDGET_SECONDS,
+    "max_retries": DEFAULT_MAX_RETRIES,
+    "breaker_threshold": DEFAULT_BREAKER_THRESHOLD,
+    "breaker_cooldown_seconds": DEFAULT_BREAKER_COOLDOWN_SECONDS,
+}
+
+def classify_error(error: Exception) -> str:
+    """
+    將客戶端的例外歸類，供重試與斷路器判斷。三個客戶端共用，不需匯入各SDK的例外類別。
+
+    Returns:
+        str: "rate_limit"、"server" (5xx)、"client" (其他4xx，例如找不到模型)、"timeout"、"connection" 或 "unknown"。
+    """
+    status = None
+    response = getattr(error, "response", None)
+    for source, attr in ((error, "status_code"), (response, "status_code"), (error, "code")):
+        try:
+            value = int(getattr(source, attr, 0) or 0)
+        except (TypeError, ValueError):
+            continue
+        if 100 <= value < 600:
+            status = value
+            break
+    name = type(error).__name__
+    if status == 429 or name in ("ResourceExhausted", "RateLimitError", "TooManyRequests"):
+        return "rate_limit"
+    if "Timeout" in name or "DeadlineExceeded" in name:
+        return "timeout"
+    if status is not None:
+        return "server" if status >= 500 else "client"
+    if name in ("ServiceUnavailable", "InternalServerError"):
+        return "server"
+    if "Connection" in name or "ChunkedEncoding" in name or isinstance(error, ConnectionError):
+        return "connection"
+    return "unknown"
+
+class CircuitBreaker:
+    """
+    單一後端與模型的斷路器。
+
+    closed: 正常放行；連續 threshold 次暫時性失敗後轉為 open。
+    open: 直接拒絕請求，cooldown 秒後轉為 half-open。
+    half-open: 只放行一個探測請求，成功則回到 closed，失敗則再次 open。
+    """
+    def __init__(self, threshold: int = DEFAULT_BREAKER_THRESHOLD, cooldown: float = DEFAULT_BREAKER_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.closes = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否放行下一個請求。"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half-open"
+            if self.state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> bool:
+        """記錄一次成功；返回這次是否讓斷路器由斷開恢復為 closed。"""
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state == "closed":
+                return False
+            self.state = "closed"
+            self.closes += 1
+            return True
+
+    def record_failure(self) -> bool:
+        """記錄一次暫時性失敗；返回這次是否讓斷路器斷開。"""
+        with self._lock:
+            self.failures += 1
+            was_probing, self._probing = self._probing, False
+            if self.state == "open" or (self.state == "closed" and self.failures < self.threshold):
+                return False
+            if self.state == "half-open" and not was_probing:
+                return False
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.opens += 1
+            return True
+
+    def release_probe(self):
+        """探測請求因取消等與後端無關的原因結束時，讓下一個請求可以重新探測。"""
+        with self._lock:
+            self._probing = False
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def configure(settings: Dict[str, Any]):
+    """
+    以設定檔的 resilience 區塊更新預設值，並重建所有斷路器。
+
+    可用的鍵: turn_budget_seconds, max_retries, breaker_threshold, breaker_cooldown_seconds。
+    """
+    for key in _settings:
+        if key in settings:
+            _settings[key] = type(_settings[key])(settings[key])
+    with _breakers_lock:
+        _breakers.clear()
+
+def get_breaker(source: str, model_name: str) -> CircuitBreaker:
+    """取得 (必要時建立) 某個後端與模型共用的斷路器。"""
+    key = (source, model_name)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(_settings["breaker_threshold"], _settings["breaker_cooldown_seconds"])
+            _breakers[key] = breaker
+        return breaker
+
+def breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """返回所有斷路器的狀態與開關次數，以 "來源/模型" 為鍵。"""
+    with _breakers_lock:
+        return {f"{source}/{model}": {"state": b.state, "opens": b.opens, "closes": b.closes}
+                for (source, model), b in _breakers.items()}
+
+def _add(stats: Dict[str, Any], key: str, amount: int = 1):
+    stats[key] = stats.get(key, 0) + amount
+
+class _Attempts:
+    """
+    call_with_resilience() 與 call_with_resilience_async() 共用的狀態：回合期限、斷路器與每次嘗試的 CancelToken，
+    以及每次嘗試結束後是否重試的判斷。兩者只在呼叫與等待的方式上不同。
+    """
+    def __init__(self, source, model_name, cancel_token, stats, turn_budget, max_retries):
+        self.source = source
+        self.model_name = model_name
+        self.cancel_token = cancel_token
+        self.stats = stats
+        budget = turn_budget if turn_budget is not None else _settings["turn_budget_seconds"]
+        self.retries = max_retries if max_retries is not None else _settings["max_retries"]
+        self.deadline = time.monotonic() + budget
+        self.breaker = get_breaker(source, model_name)
+        self._timer: Optional[threading.Timer] = None
+        self._parent_callback = None
+
+    def start(self, attempt: int) -> Optional[CancelToken]:
+        """開始第 attempt 次嘗試，返回這次嘗試的 CancelToken；斷路器斷開時返回None。"""
+        if not self.breaker.allow():
+            print(f"{self.source} 模型 {self.model_name} 的斷路器已斷開，暫時不送出請求。")
+            self.stats["error"] = "circuit_open"
+            return None
+        remaining = self.deadline - time.monotonic()
+        self.stats["attempts"] = attempt + 1
+        # 每次嘗試使用自己的 CancelToken：使用者停止或預算用盡時都會立即中止進行中的請求
+        attempt_token = CancelToken()
+        self._timer = threading.Timer(max(0.0, remaining), attempt_token.set)
+        self._timer.daemon = True
+        self._timer.start()
+        if isinstance(self.cancel_token, CancelToken):
+            self._parent_callback = self.cancel_token.add_callback(attempt_token.set)
+        self.attempt_token = attempt_token
+        return attempt_token
+
+    def stop(self):
+        """結束這次嘗試的計時與取消登記。"""
+        self._timer.cancel()
+        if self._parent_callback is not None:
+            self.cancel_token.remove_callback(self._parent_callback)
+            self._parent_callback = None
+
+    def failed(self, error: Exception, attempt_stats: Dict[str, Any]) -> bool:
+        """
+        嘗試拋出例外時呼叫。暫時性錯誤與回報 None 的失敗一樣處理 (計入斷路器並重試)，返回True；
+        其他例外 (例如認證或請求格式錯誤) 不計入斷路器，返回False，呼叫端應立即原樣拋出，不讓之後的回合只看到 circuit_open。
+        """
+        kind = classify_error(error)
+        if kind not in TRANSIENT_ERRORS:
+            self.stats["error"] = kind
+            self.breaker.release_probe()
+            return False
+        print(f"{self.source} 模型 {self.model_name} 請求失敗: {error}")
+        attempt_stats["error"] = kind
+        return True
+
+    def finish(self, attempt: int, result: Optional[str], attempt_stats: Dict[str, Any]) -> Optional[float]:
+        """
+        記錄一次嘗試的結果。
+
+        Returns:
+            Optional[float]: 應在重試前等待的秒數；成功、被取消或不再重試時為None。
+        """
+        stats, breaker = self.stats, self.breaker
+        if result is not None:
+            stats.pop("error", None)
+            stats.update(attempt_stats)
+            if breaker.record_success():
+                _add(stats, "breaker_closes")
+            return None
+        if self.cancel_token is not None and self.cancel_token.is_set():
+            stats.update(attempt_stats)
+            breaker.release_probe()
+            return None
+
+        error = "timeout" if self.attempt_token.is_set() else attempt_stats.get("error", "unknown")
+        stats["error"] = error
+        if error in TRANSIENT_ERRORS:
+            if breaker.record_failure():
+                _add(stats, "breaker_opens")
+                print(f"{self.source} 模型 {self.model_name} 連續失敗，斷路器斷開 {breaker.cooldown:.0f} 秒。")
+        else:
+            breaker.release_probe()
+        if error not in TRANSIENT_ERRORS or attempt == self.retries:
+            return None
+        delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempt))
+        delay += random.uniform(0, delay * 0.25)
+        if time.monotonic() + delay >= self.deadline:
+            print(f"{self.source} 模型 {self.model_name} 已用盡本回合的時間預算。")
+            return None
+        return delay
+
+def call_with_resilience(
+    source: str,
+    model_name: str,
+    call: Callable[[CancelToken, Dict[str, Any]], Optional[str]],
+    cancel_token: Optional[threading.Event] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    on_retry: Optional[Callable[[int, str], None]] = None,
+    turn_budget: Optional[float] = None,
+    max_retries: Optional[int] = None
+) -> Optional[str]:
+    """
+    以回合時間預算、暫時性錯誤重試與斷路器包裝一次客戶端呼叫。
+
+    Args:
+        source (str): 後端名稱，例如 "Ollama"、"Gemini"。
+        model_name (str): 模型名稱；與 source 一起決定使用哪個斷路器。
+        call (Callable): 接收 (這次嘗試的 CancelToken, 這次嘗試的 stats) 並返回回應 (失敗時為None) 的函式。
+            客戶端需在失敗時將 classify_error() 的結果寫入 stats["error"]。
+        cancel_token (threading.Event, optional): 使用者的停止旗標；被設定時不再重試。
+        stats (Dict[str, Any], optional): 會填入成功那次嘗試的 stats，以及 attempts、error、
+            breaker_opens、breaker_closes。
+        on_retry (Callable[[int, str], None], optional): 每次重試前以 (第幾次重試, 錯誤類型) 呼叫。
+        turn_budget (float, optional): 這一回合 (含重試) 的總秒數上限，預設使用設定值。
+        max_retries (int, optional): 暫時性錯誤的最多重試次數，預設使用設定值。
+
+    Returns:
+        Optional[str]: 回應內容；失敗、超出預算、斷路器斷開或被取消時為None。
+    """
+    stats = stats if stats is not None else {}
+    attempts = _Attempts(source, model_name, cancel_token, stats, turn_budget, max_retries)
+    for attempt in range(attempts.retries + 1):
+        attempt_token = attempts.start(attempt)
+        if attempt_token is None:
+            return None
+        attempt_stats: Dict[str, Any] = {}
+        try:
+            result = call(attempt_token, attempt_stats)
+        except Exception as e:
+            if not attempts.failed(e, attempt_stats):
+                raise
+            result = None
+        finally:
+            attempts.stop()
+        delay = attempts.finish(attempt, result, attempt_stats)
+        if delay is None:
+            return result
+        if on_retry:
+            on_retry(attempt + 1, stats["error"])
+        if cancel_token is None:
+            time.sleep(delay)
+        elif cancel_token.wait(delay):
+            return None
+    return None
+
+async def call_with_resilience_async(
+    source: str,
+    model_name: str,
+    call: Callable[[CancelToken, Dict[str, Any]], Awaitable[Optional[str]]],
+    cancel_token: Optional[threading.Event] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    on_retry: Optional[Callable[[int, str], None]] = None,
+    turn_budget: Optional[float] = None,
+    max_retries: Optional[int] = None
+) -> Optional[str]:
+    """
+    call_with_resilience() 的非同步版本，參數與返回值相同，call 改為返回 awaitable 的函式
+    (例如 async_ollama_client 的請求)。重試前的等待不阻塞事件迴圈，cancel_token 被設定時立即結束。
+    """
+    stats = stats if stats is not None else {}
+    attempts = _Attempts(source, model_name, cancel_token, stats, turn_budget, max_retries)
+    for attempt in range(attempts.retries + 1):
+        attempt_token = attempts.start(attempt)
+        if attempt_token is None:
+            return None
+        attempt_stats: Dict[str, Any] = {}
+        try:
+            result = await call(attempt_token, attempt_stats)
+        except Exception as e:
+            if not attempts.failed(e, attempt_stats):
+                raise
+            result = None
+        finally:
+            attempts.stop()
+        delay = attempts.finish(attempt, result, attempt_stats)
+        if delay is None:
+            return result
+        if on_retry:
+            on_retry(attempt + 1, stats["error"])
+        try:
+            await await_cancellable(cancel_token if isinstance(cancel_token, CancelToken) else None, asyncio.sleep(delay))
+        except CancelledError:
+            return None
+        if cancel_token is not None and cancel_token.is_set():
+            return None
+    return None
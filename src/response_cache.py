@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Optional, Tuple
+
+# 預設的快取檔案位置與容量上限
+DEFAULT_CACHE_PATH = os.path.join("cache", "responses.sqlite3")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def make_key(
+    provider: str,
+    model_name: str,
+    system_prompt: Optional[str],
+    messages: List[Dict[str, str]]
+) -> str:
+    """
+    以請求的完整內容計算內容定址 (content-addressed) 的快取鍵。
+
+    Args:
+        provider (str): 模型來源，例如 "ollama"、"gemini"、"openai"。
+        model_name (str): 模型名稱。
+        system_prompt (Optional[str]): 系統提示詞 (若已包含在 messages 中可為None)。
+        messages (List[Dict[str, str]]): 送出的完整訊息列表。
+
+    Returns:
+        str: SHA-256 十六進位字串。
+    """
+    material = json.dumps(
+        [provider, model_name, system_prompt, messages],
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    儲存在本機SQLite中的LLM回應快取，超過容量上限時依最近使用時間 (LRU) 淘汰。
+
+    可被多個對話執行緒共用；所有資料庫操作都以同一把鎖序列化。
+    close() 之後查詢一律視為未命中、寫入則被忽略，仍持有舊實例的執行緒不會因此出錯。
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        """查詢快取；命中時更新最近使用時間。"""
+        with self._lock:
+            if self._closed:
+                return None
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str):
+        """寫入一筆回應，必要時淘汰最久未使用的項目。"""
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            if self._closed:
+                return
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time())
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """(需持有鎖) 依 last_access 由舊到新刪除項目，直到總大小低於上限。"""
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+
+    def stats(self) -> Dict[str, int]:
+        """返回命中/未命中次數、項目數與目前佔用的位元組數。"""
+        with self._lock:
+            entries = 0 if self._closed else self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": self._total_bytes}
+
+    def clear(self):
+        """清空所有快取項目。"""
+        with self._lock:
+            if self._closed:
+                return
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._conn.close()
+
+# 三個客戶端共用的預設快取；None 表示停用
+_cache: Optional[ResponseCache] = None
+
+def configure(path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES) -> ResponseCache:
+    """
+    啟用 (或以新設定重建) 預設的回應快取。
+
+    與 ollama_client.configure_session() 相同，只替換共用的參考而不關閉舊的快取：
+    其他執行緒可能正處於 lookup() 與 store() 之間，舊實例在不再被引用時由垃圾回收關閉其連線。
+    """
+    global _cache
+    _cache = ResponseCache(path, max_bytes)
+    return _cache
+
+def disable():
+    """停用預設的回應快取；舊實例的處理方式同 configure()。"""
+    global _cache
+    _cache = None
+
+def get_cache() -> Optional[ResponseCache]:
+    """返回目前的預設快取，若未啟用則為None。"""
+    return _cache
+
+def lookup(
+    provider: str,
+    model_name: str,
+    system_prompt: Optional[str],
+    messages: List[Dict[str, str]]
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    供客戶端在送出請求前查詢快取。
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: (快取鍵, 快取的回應)。
+            快取停用時兩者皆為None；未命中時回應為None，鍵可交給 store() 使用。
+    """
+    cache = _cache
+    if cache is None:
+        return None, None
+    key = make_key(provider, model_name, system_prompt, messages)
+    return key, cache.get(key)
+
+def store(key: Optional[str], response: Optional[str]):
+    """在取得成功的回應後寫入快取；key 或 response 為None時不做任何事。"""
+    cache = _cache
+    if cache is None or key is None or response is None:
+        return
+    cache.put(key, response)
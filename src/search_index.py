@@ -0,0 +1,160 @@
+import re
+from typing import List, Dict, Iterable, Optional, Set, Tuple
+
+# 中日韓文字 (含假名、韓文) 的連續片段，或英數字組成的單字
+_TOKEN_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+|[0-9a-z]+")
+# 英數字片段索引的n-gram最大長度；較長的查詢詞以其所有trigram比對
+LATIN_GRAM = 3
+
+def _is_cjk_run(run: str) -> bool:
+    return not run[0].isascii()
+
+def normalize(text: str) -> str:
+    """搜尋前統一大小寫 (casefold)，索引與查詢都使用同一種形式。"""
+    return text.casefold()
+
+def tokenize(text: str) -> Set[str]:
+    """
+    將文字切成索引用的詞元。
+
+    中日韓文字沒有空白分隔，因此每個字 (unigram) 與每兩個相鄰的字 (bigram) 都是一個詞元；
+    英數字片段索引其中所有長度 1 到 3 的子字串，因此單字中間的片段 (例如 "port" 之於 "support") 也能找到，
+    結果與線性搜尋 scan() 的子字串比對一致。
+
+    Args:
+        text (str): 已經過 normalize() 的文字。
+    """
+    tokens: Set[str] = set()
+    for run in _TOKEN_RE.findall(text):
+        if _is_cjk_run(run):
+            tokens.update(run)
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            for n in range(1, LATIN_GRAM + 1):
+                tokens.update(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+def query_tokens(term: str) -> Set[str]:
+    """
+    查詢詞需要的詞元：中日韓片段使用bigram (只有一個字時使用unigram)，英數字片段使用trigram (較短時使用片段本身)。
+    查詢詞若是某筆記錄的子字串，這些詞元必定都出現在該記錄的索引中，因此候選集合不會遺漏。
+    """
+    tokens: Set[str] = set()
+    for run in _TOKEN_RE.findall(term):
+        if _is_cjk_run(run):
+            tokens.update([run] if len(run) == 1 else (run[i:i + 2] for i in range(len(run) - 1)))
+        elif len(run) <= LATIN_GRAM:
+            tokens.add(run)
+        else:
+            tokens.update(run[i:i + LATIN_GRAM] for i in range(len(run) - LATIN_GRAM + 1))
+    return tokens
+
+def split_query(query: str) -> List[str]:
+    """以空白分隔查詢字串，每個詞都必須出現 (AND)。"""
+    return [term for term in normalize(query).split() if term]
+
+class SearchIndex:
+    """
+    名稱與提示詞文字的倒排索引 (詞元 → 記錄名稱的集合)。
+
+    查詢時先以詞元集合的交集取得候選記錄 (由最小的集合開始)，再以子字串比對確認，
+    因此bigram不相鄰造成的誤判不會出現在結果中。結果中名稱符合的記錄排在前面。
+    """
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._texts: Dict[str, Tuple[str, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, name: str, text: str):
+        """索引一筆記錄；name 為記錄名稱，text 為要一併搜尋的內容 (例如提示詞)。"""
+        if name in self._texts:
+            self.remove(name)
+        folded_name, folded = normalize(name), normalize(f"{name}\n{text}")
+        self._texts[name] = (folded_name, folded)
+        postings = self._postings
+        for token in tokenize(folded):
+            bucket = postings.get(token)
+            if bucket is None:
+                postings[token] = {name}
+            else:
+                bucket.add(name)
+
+    def remove(self, name: str):
+        """從索引中移除一筆記錄。"""
+        texts = self._texts.pop(name, None)
+        if texts is None:
+            return
+        for token in tokenize(texts[1]):
+            bucket = self._postings.get(token)
+            if bucket is not None:
+                bucket.discard(name)
+                if not bucket:
+                    del self._postings[token]
+
+    def _candidates(self, term: str) -> Optional[Set[str]]:
+        tokens = query_tokens(term)
+        if not tokens:
+            return None
+        buckets = sorted((self._postings.get(token, set()) for token in tokens), key=len)
+        result = set(buckets[0])
+        for bucket in buckets[1:]:
+            result &= bucket
+            if not result:
+                break
+        return result
+
+    def search(self, query: str, order: Dict[str, int]) -> List[str]:
+        """
+        返回符合查詢的記錄名稱。
+
+        Args:
+            query (str): 以空白分隔的查詢詞。
+            order (Dict[str, int]): 記錄名稱 → 顯示順序，結果在同一組內依此排序。
+
+        Returns:
+            List[str]: 名稱符合的記錄在前，其餘依 order 排序。
+        """
+        terms = split_query(query)
+        candidates: Optional[Set[str]] = None
+        for term in terms:
+            found = self._candidates(term)
+            if found is None:
+                continue
+            candidates = found if candidates is None else candidates & found
+        if candidates is None:
+            candidates = set(self._texts)
+        texts = self._texts
+        matches = [name for name in candidates if all(term in texts[name][1] for term in terms)]
+        return rank(matches, terms, order, lambda name: texts[name][0])
+
+def rank(matches: Iterable[str], terms: List[str], order: Dict[str, int], folded_name) -> List[str]:
+    """名稱中包含所有查詢詞的記錄排在前面，同一組內依 order 排序。"""
+    return sorted(matches, key=lambda name: (not all(term in folded_name(name) for term in terms),
+                                             order.get(name, len(order))))
+
+def scan(records: Iterable[Tuple[str, str]], query: str, order: Dict[str, int]) -> List[str]:
+    """不使用索引的線性搜尋，在索引尚未建立完成時使用，結果與 SearchIndex.search() 相同。"""
+    terms = split_query(query)
+    matches = [name for name, text in records
+               if all(term in normalize(f"{name}\n{text}") for term in terms)]
+    return rank(matches, terms, order, normalize)
+
+if __name__ == "__main__":
+    # 自我檢查：索引搜尋與線性搜尋的結果必須完全相同
+    import random
+    random.seed(0)
+    alphabet = "abcport 自由意志中文"
+    records = {f"r{i}": "".join(random.choice(alphabet) for _ in range(random.randint(0, 40))) for i in range(300)}
+    records.update({"a": "We support users", "b": "portable tools"})
+    order = {name: i for i, name in enumerate(records)}
+    index = SearchIndex()
+    for name, text in records.items():
+        index.add(name, text)
+    queries = ["port", "ort", "Port TOOL", "自由", "意", "由意志", "p o", "zz"]
+    queries += ["".join(random.choice(alphabet) for _ in range(random.randint(1, 4))) for _ in range(500)]
+    for query in queries:
+        expected = scan(records.items(), query, order)
+        assert index.search(query, order) == expected, (query, index.search(query, order), expected)
+    print(f"{len(queries)} 個查詢的索引結果與線性搜尋一致。")
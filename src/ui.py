@@ -1,10 +1,288 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinter import scrolledtext
+from tkinter import font as tkfont
+from collections import deque
+from typing import Callable, List, Optional, Sequence, Tuple
+
+# 對話區最多保留的段落數 (開場介紹與每一回合各為一段)，較早的段落會從元件中移除；0 表示不限制
+DIALOGUE_SCROLLBACK_TURNS = 40
+# 每次點擊「載入較早的內容」時載回的段落數
+SCROLLBACK_PAGE_TURNS = 10
+# 從元件中移除的段落最多保留在記憶體中的數量，更早的段落只能從對話紀錄資料庫檢視
+HIDDEN_BLOCKS_LIMIT = 2000
+
+class VirtualListbox(ttk.Frame):
+    """
+    只繪製可見列的清單。
+
+    Tk 的 Listbox 會為每個項目建立資料，上萬筆時載入與捲動都很慢；這裡只把目前可見的那幾列
+    放進 Listbox，捲動時依位移量重新填入，捲軸則依項目總數自行換算。
+    """
+    def __init__(self, parent, **listbox_options):
+        super().__init__(parent)
+        self.items: Sequence[str] = ()
+        self.offset = 0
+        self.selected_index: Optional[int] = None
+        self.listbox = tk.Listbox(self, exportselection=False, activestyle="none", **listbox_options)
+        self.listbox.pack(side="left", fill="both", expand=True)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        font = self.listbox.cget("font")
+        self._row_height = tkfont.Font(font=font).metrics("linespace") + 1
+        self.listbox.bind("<Configure>", lambda e: self._render())
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.listbox.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1) or "break")
+        self.listbox.bind("<Button-4>", lambda e: self.scroll(-1) or "break")
+        self.listbox.bind("<Button-5>", lambda e: self.scroll(1) or "break")
+        self.listbox.bind("<Up>", lambda e: self.move_selection(-1) or "break")
+        self.listbox.bind("<Down>", lambda e: self.move_selection(1) or "break")
+
+    def set_items(self, items: Sequence[str]):
+        """替換所有項目並回到頂端。"""
+        self.items = items
+        self.offset = 0
+        self.selected_index = None
+        self._render()
+
+    def selected(self) -> Optional[str]:
+        """目前選取的項目，未選取時為None。"""
+        if self.selected_index is None or self.selected_index >= len(self.items):
+            return None
+        return self.items[self.selected_index]
+
+    def _visible_rows(self) -> int:
+        return max(1, self.listbox.winfo_height() // self._row_height)
+
+    def _render(self):
+        rows = self._visible_rows()
+        total = len(self.items)
+        self.offset = max(0, min(self.offset, total - rows))
+        self.listbox.delete(0, tk.END)
+        visible = self.items[self.offset:self.offset + rows]
+        if visible:
+            self.listbox.insert(tk.END, *visible)
+        if self.selected_index is not None and self.offset <= self.selected_index < self.offset + rows:
+            self.listbox.selection_set(self.selected_index - self.offset)
+        if total <= rows:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.offset / total, (self.offset + rows) / total)
+
+    def scroll(self, rows: int):
+        """向下 (正數) 或向上 (負數) 捲動指定列數。"""
+        self.offset += rows
+        self._render()
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.offset = int(float(value) * len(self.items))
+            self._render()
+        elif action == "scroll":
+            self.scroll(int(value) * (self._visible_rows() if unit == "pages" else 1))
+
+    def _on_select(self, event=None):
+        selection = self.listbox.curselection()
+        if selection:
+            self.selected_index = self.offset + selection[0]
+
+    def move_selection(self, step: int):
+        """以鍵盤上下移動選取，必要時捲動讓選取的項目保持可見。"""
+        if not self.items:
+            return
+        current = self.selected_index if self.selected_index is not None else self.offset - step
+        self.selected_index = max(0, min(len(self.items) - 1, current + step))
+        rows = self._visible_rows()
+        if self.selected_index < self.offset:
+            self.offset = self.selected_index
+        elif self.selected_index >= self.offset + rows:
+            self.offset = self.selected_index - rows + 1
+        self._render()
+        self.listbox.event_generate("<<ListboxSelect>>")
+
+
+class ChunkedTextView:
+    """
+    將很長的文字分成區塊，依捲動位置延遲載入唯讀的 Text 元件。
+
+    show() 只同步插入第一個區塊，第一個畫面不受全文長度影響；捲動接近底部 (或頂端) 時，
+    在閒置回呼中載入下一個 (或上一個) 區塊，並移除離畫面最遠的區塊，
+    元件中最多只保留 max_chunks 個區塊。捲軸反映的是目前載入的範圍。
+    """
+    # 可見範圍的下緣超過 (或上緣低於) 這個比例時載入相鄰的區塊
+    LOAD_THRESHOLD = 0.15
+
+    def __init__(self, text: tk.Text, scrollbar, max_chunks: int = 4):
+        self.text = text
+        self.scrollbar = scrollbar
+        self.max_chunks = max_chunks
+        self.load_chunk: Optional[Callable[[int], Optional[str]]] = None
+        self.first = self.last = 0
+        self._pending = None
+
+    @property
+    def active(self) -> bool:
+        return self.load_chunk is not None
+
+    def show(self, load_chunk: Callable[[int], Optional[str]]):
+        """
+        清空元件並開始顯示新的內容。
+
+        Args:
+            load_chunk (Callable[[int], Optional[str]]): 返回第 i 個區塊文字的函式，超出結尾時返回None
+                (例如 history_db.TranscriptReader.chunk)。
+        """
+        self.close()
+        self.load_chunk = load_chunk
+        self.text.config(state="normal")
+        self.text.delete("1.0", tk.END)
+        self.text.config(state="disabled")
+        self.first, self.last = 0, -1
+        self.text.config(yscrollcommand=self._on_scroll)
+        self._append()
+        self.text.yview_moveto(0)
+
+    def close(self):
+        """停止延遲載入 (例如對話區要改為顯示新的對話)；已載入的文字保持不變。"""
+        if self._pending is not None:
+            self.text.after_cancel(self._pending)
+            self._pending = None
+        if self.load_chunk is not None:
+            self.load_chunk = None
+            self.text.config(yscrollcommand=self.scrollbar.set)
+
+    def _mark(self, index: int) -> str:
+        return f"chunk{index}"
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self.load_chunk is None or self._pending is not None:
+            return
+        if float(last) > 1 - self.LOAD_THRESHOLD:
+            self._pending = self.text.after_idle(self._run, self._append)
+        elif float(first) < self.LOAD_THRESHOLD and self.first > 0:
+            self._pending = self.text.after_idle(self._run, self._prepend)
+
+    def _run(self, action):
+        self._pending = None
+        if self.load_chunk is not None:
+            action()
+
+    def _append(self):
+        chunk = self.load_chunk(self.last + 1)
+        if chunk is None:
+            return
+        self.last += 1
+        self.text.config(state="normal")
+        self.text.mark_set(self._mark(self.last), "end-1c")
+        self.text.mark_gravity(self._mark(self.last), "left")
+        self.text.insert(tk.END, chunk)
+        if self.last - self.first + 1 > self.max_chunks:
+            # 移除最上方的區塊，並以標記維持目前畫面所在的位置
+            self.text.mark_set("view_anchor", "@0,0")
+            self.text.delete("1.0", self._mark(self.first + 1))
+            self.text.mark_unset(self._mark(self.first))
+            self.first += 1
+            self.text.yview("view_anchor")
+        self.text.config(state="disabled")
+
+    def _prepend(self):
+        chunk = self.load_chunk(self.first - 1)
+        if chunk is None:
+            return
+        self.text.config(state="normal")
+        self.text.mark_set("view_anchor", "@0,0")
+        # 插入在最前面的文字要位於原本第一個區塊的標記與畫面標記之前
+        for mark in (self._mark(self.first), "view_anchor"):
+            self.text.mark_gravity(mark, "right")
+        self.text.insert("1.0", chunk)
+        for mark in (self._mark(self.first), "view_anchor"):
+            self.text.mark_gravity(mark, "left")
+        self.first -= 1
+        self.text.mark_set(self._mark(self.first), "1.0")
+        self.text.mark_gravity(self._mark(self.first), "left")
+        if self.last - self.first + 1 > self.max_chunks:
+            self.text.delete(self._mark(self.last), tk.END)
+            self.text.mark_unset(self._mark(self.last))
+            self.last -= 1
+        self.text.yview("view_anchor")
+        self.text.config(state="disabled")
+
+
+class SearchablePicker(ttk.Frame):
+    """
+    附有搜尋框的虛擬清單。每次輸入都以 search 回呼重新篩選 (例如 RecordStore.search)，
+    結果數量顯示在搜尋框旁。
+    """
+    def __init__(self, parent, search: Callable[[str], Sequence[str]], **listbox_options):
+        super().__init__(parent)
+        self.search = search
+        search_frame = ttk.Frame(self)
+        search_frame.pack(fill="x", pady=(0, 5))
+        ttk.Label(search_frame, text="搜尋:").pack(side="left")
+        self.query_var = tk.StringVar()
+        self.search_entry = ttk.Entry(search_frame, textvariable=self.query_var)
+        self.search_entry.pack(side="left", fill="x", expand=True, padx=5)
+        self.count_label = ttk.Label(search_frame, text="")
+        self.count_label.pack(side="right")
+        self.list = VirtualListbox(self, **listbox_options)
+        self.list.pack(fill="both", expand=True)
+        self.query_var.trace_add("write", lambda *args: self.refresh())
+        self.search_entry.bind("<Down>", lambda e: (self.list.listbox.focus_set(), self.list.move_selection(1)))
+
+    def refresh(self):
+        """以目前的查詢重新篩選 (資料變動後也應呼叫)。"""
+        results = self.search(self.query_var.get())
+        self.list.set_items(results)
+        self.count_label.config(text=f"{len(results)} 筆")
+
+    def selected(self) -> Optional[str]:
+        return self.list.selected()
+
+    def bind_choose(self, callback: Callable[[str], None]):
+        """雙擊或按 Enter 時以選取的項目呼叫 callback。"""
+        def choose(event=None):
+            name = self.selected()
+            if name is not None:
+                callback(name)
+        self.list.listbox.bind("<Double-Button-1>", choose)
+        self.list.listbox.bind("<Return>", choose)
+        self.search_entry.bind("<Return>", lambda e: self.list.move_selection(1) if self.selected() is None else choose())
+
+
+class PickerWindow(tk.Toplevel):
+    """
+    從大型角色或風格庫中搜尋並選擇一個項目的彈出視窗。選擇後以名稱呼叫 on_choose 並關閉。
+    """
+    def __init__(self, parent, title: str, search: Callable[[str], Sequence[str]], on_choose: Callable[[str], None]):
+        super().__init__(parent)
+        self.title(title)
+        self.geometry("450x500")
+        self.transient(parent)
+        self.grab_set()
+
+        self.picker = SearchablePicker(self, search)
+        self.picker.pack(padx=10, pady=10, fill="both", expand=True)
+
+        def choose(name):
+            on_choose(name)
+            self.destroy()
+        self.picker.bind_choose(choose)
+
+        button_frame = ttk.Frame(self)
+        button_frame.pack(pady=10)
+        self.choose_button = ttk.Button(button_frame, text="選擇",
+                                        command=lambda: self.picker.selected() and choose(self.picker.selected()))
+        self.choose_button.pack(side="left", padx=5)
+        ttk.Button(button_frame, text="取消", command=self.destroy).pack(side="left", padx=5)
+
+        self.picker.refresh()
+        self.picker.search_entry.focus_set()
+
 
 class HistoryManagerWindow(tk.Toplevel):
     """
-    一個用於管理對話歷史紀錄的視窗。
+    一個用於管理對話歷史紀錄的視窗。紀錄依開始時間由新到舊分頁列出。
     """
     def __init__(self, parent):
         super().__init__(parent)
@@ -13,6 +291,15 @@ class HistoryManagerWindow(tk.Toplevel):
         self.transient(parent)
         self.grab_set()
 
+        search_frame = ttk.Frame(self)
+        search_frame.pack(padx=10, pady=(10, 0), fill="x")
+        ttk.Label(search_frame, text="搜尋內容:").pack(side="left")
+        self.search_var = tk.StringVar()
+        self.search_entry = ttk.Entry(search_frame, textvariable=self.search_var)
+        self.search_entry.pack(side="left", fill="x", expand=True, padx=5)
+        self.clear_search_button = ttk.Button(search_frame, text="清除", command=lambda: self.search_var.set(""))
+        self.clear_search_button.pack(side="right")
+
         list_frame = ttk.LabelFrame(self, text="已存檔的對話", padding=10)
         list_frame.pack(padx=10, pady=10, fill="both", expand=True)
 
@@ -23,6 +310,19 @@ class HistoryManagerWindow(tk.Toplevel):
         scrollbar.pack(side="right", fill="y")
         self.history_listbox.config(yscrollcommand=scrollbar.set)
 
+        # 搜尋時顯示選取結果的完整摘錄
+        self.snippet_label = ttk.Label(self, text="", wraplength=660, justify="left")
+        self.snippet_label.pack(padx=10, fill="x")
+
+        page_frame = ttk.Frame(self)
+        page_frame.pack(padx=10, fill="x")
+        self.prev_button = ttk.Button(page_frame, text="< 較新")
+        self.prev_button.pack(side="left")
+        self.page_label = ttk.Label(page_frame, text="")
+        self.page_label.pack(side="left", expand=True)
+        self.next_button = ttk.Button(page_frame, text="較舊 >")
+        self.next_button.pack(side="right")
+
         button_frame = ttk.Frame(self)
         button_frame.pack(pady=10)
 
@@ -30,6 +330,8 @@ class HistoryManagerWindow(tk.Toplevel):
         self.view_button.pack(side="left", padx=5)
         self.delete_button = ttk.Button(button_frame, text="刪除")
         self.delete_button.pack(side="left", padx=5)
+        self.import_button = ttk.Button(button_frame, text="匯入舊紀錄...")
+        self.import_button.pack(side="left", padx=5)
         self.close_button = ttk.Button(button_frame, text="關閉", command=self.destroy)
         self.close_button.pack(side="right", padx=5)
 
@@ -83,12 +385,9 @@ class StyleManagerWindow(tk.Toplevel):
         list_frame = ttk.LabelFrame(self, text="自訂風格列表", padding=10)
         list_frame.pack(padx=10, pady=10, fill="both", expand=True)
 
-        self.style_listbox = tk.Listbox(list_frame)
-        self.style_listbox.pack(side="left", fill="both", expand=True)
-
-        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.style_listbox.yview)
-        scrollbar.pack(side="right", fill="y")
-        self.style_listbox.config(yscrollcommand=scrollbar.set)
+        # search 回呼由 app.py 設定
+        self.style_picker = SearchablePicker(list_frame, search=lambda query: [])
+        self.style_picker.pack(fill="both", expand=True)
 
         button_frame = ttk.Frame(self)
         button_frame.pack(pady=10)
@@ -155,12 +454,9 @@ class PersonaManagerWindow(tk.Toplevel):
         list_frame = ttk.LabelFrame(self, text="自訂角色列表", padding=10)
         list_frame.pack(padx=10, pady=10, fill="both", expand=True)
 
-        self.persona_listbox = tk.Listbox(list_frame)
-        self.persona_listbox.pack(side="left", fill="both", expand=True)
-
-        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.persona_listbox.yview)
-        scrollbar.pack(side="right", fill="y")
-        self.persona_listbox.config(yscrollcommand=scrollbar.set)
+        # search 回呼由 app.py 設定
+        self.persona_picker = SearchablePicker(list_frame, search=lambda query: [])
+        self.persona_picker.pack(fill="both", expand=True)
 
         # 按鈕區
         button_frame = ttk.Frame(self)
@@ -247,8 +543,12 @@ class AppUI:
         self.model1_combo.pack(fill=tk.X, pady=(0, 5))
 
         ttk.Label(ai1_frame, text="預設角色:").pack(fill=tk.X)
-        self.persona1_combo = ttk.Combobox(ai1_frame, state="readonly")
-        self.persona1_combo.pack(fill=tk.X, pady=(0, 5))
+        persona1_frame = ttk.Frame(ai1_frame)
+        persona1_frame.pack(fill=tk.X, pady=(0, 5))
+        self.persona1_search_button = ttk.Button(persona1_frame, text="搜尋…", width=6)
+        self.persona1_search_button.pack(side=tk.RIGHT, padx=(5, 0))
+        self.persona1_combo = ttk.Combobox(persona1_frame, state="readonly")
+        self.persona1_combo.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
         ttk.Label(ai1_frame, text="角色提示詞 (可手動修改):").pack(fill=tk.X)
         self.persona1_text = scrolledtext.ScrolledText(ai1_frame, height=5, wrap=tk.WORD)
@@ -273,8 +573,12 @@ class AppUI:
         self.model2_combo.pack(fill=tk.X, pady=(0, 5))
 
         ttk.Label(ai2_frame, text="預設角色:").pack(fill=tk.X)
-        self.persona2_combo = ttk.Combobox(ai2_frame, state="readonly")
-        self.persona2_combo.pack(fill=tk.X, pady=(0, 5))
+        persona2_frame = ttk.Frame(ai2_frame)
+        persona2_frame.pack(fill=tk.X, pady=(0, 5))
+        self.persona2_search_button = ttk.Button(persona2_frame, text="搜尋…", width=6)
+        self.persona2_search_button.pack(side=tk.RIGHT, padx=(5, 0))
+        self.persona2_combo = ttk.Combobox(persona2_frame, state="readonly")
+        self.persona2_combo.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
         ttk.Label(ai2_frame, text="角色提示詞 (可手動修改):").pack(fill=tk.X)
         self.persona2_text = scrolledtext.ScrolledText(ai2_frame, height=5, wrap=tk.WORD)
@@ -294,8 +598,12 @@ class AppUI:
         style_frame.pack(fill=tk.X, pady=5)
 
         ttk.Label(style_frame, text="選擇風格範本:").pack(fill=tk.X)
-        self.style_combo = ttk.Combobox(style_frame, state="readonly")
-        self.style_combo.pack(fill=tk.X, pady=(0, 5))
+        style_select_frame = ttk.Frame(style_frame)
+        style_select_frame.pack(fill=tk.X, pady=(0, 5))
+        self.style_search_button = ttk.Button(style_select_frame, text="搜尋…", width=6)
+        self.style_search_button.pack(side=tk.RIGHT, padx=(5, 0))
+        self.style_combo = ttk.Combobox(style_select_frame, state="readonly")
+        self.style_combo.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
         ttk.Label(style_frame, text="對話風格指令 (可選填/手動修改):").pack(fill=tk.X)
         self.style_prompt_text = scrolledtext.ScrolledText(style_frame, height=3, wrap=tk.WORD)
@@ -321,12 +629,28 @@ class AppUI:
 
         self.dialogue_text = scrolledtext.ScrolledText(dialogue_frame, state="disabled", wrap=tk.WORD, height=15)
         self.dialogue_text.pack(fill=tk.BOTH, expand=True)
+        # 檢視歷史紀錄時以區塊延遲載入，不必一次插入整份紀錄
+        self.transcript_view = ChunkedTextView(self.dialogue_text, self.dialogue_text.vbar)
+        # 有限的捲動紀錄：每一段開頭有一個標記，超過上限時移除最早的段落。
+        # 被移除段落的原始文字 (含預載與重試提示) 保存在 hidden_blocks，可透過 load_older_turns 原樣載回；
+        # 超過 HIDDEN_BLOCKS_LIMIT 段時丟棄最早的，完整紀錄仍在對話紀錄資料庫中
+        self.scrollback_turns = DIALOGUE_SCROLLBACK_TURNS
+        self.turn_marks = deque()
+        self.hidden_blocks = deque()
+        self.dropped_turns = 0
+        self._mark_serial = 0
+        self.dialogue_text.tag_config("older_banner", foreground="gray", justify="center")
+        self.dialogue_text.tag_bind("older_banner", "<Button-1>", lambda e: self.load_older_turns())
+        self.dialogue_text.tag_bind("older_banner", "<Enter>", lambda e: self.dialogue_text.config(cursor="hand2"))
+        self.dialogue_text.tag_bind("older_banner", "<Leave>", lambda e: self.dialogue_text.config(cursor=""))
 
         # --- 狀態列 ---
         status_frame = ttk.Frame(self.root, padding=(5, 2))
         status_frame.pack(side=tk.BOTTOM, fill=tk.X)
         self.version_label = ttk.Label(status_frame, text=f"Version: {version}")
         self.version_label.pack(side=tk.RIGHT)
+        self.status_label = ttk.Label(status_frame, text="")
+        self.status_label.pack(side=tk.LEFT)
 
         # --- 存檔區塊 (移到狀態列之上，確保可見) ---
         save_frame = ttk.Frame(self.root, padding=(10, 5))
@@ -358,19 +682,124 @@ class AppUI:
             "style_prompt": self.style_prompt_text.get("1.0", tk.END).strip()
         }
 
-    def append_dialogue(self, text: str):
-        """將文字附加到對話紀錄區。"""
-        self.dialogue_text.config(state="normal")
-        self.dialogue_text.insert(tk.END, text)
-        self.dialogue_text.config(state="disabled")
-        self.dialogue_text.see(tk.END) # 自動捲動到最下方
+    def append_dialogue(self, text: str, new_turn: bool = False):
+        """將文字附加到對話紀錄區；new_turn 為True時這段文字開始新的一段 (回合)。"""
+        self.append_dialogue_batch([(new_turn, text)])
+
+    def append_dialogue_batch(self, segments: List[Tuple[bool, str]]):
+        """
+        一次附加多段文字，整批只切換一次元件狀態、捲動一次。
+
+        Args:
+            segments: (是否開始新的一段, 文字) 的列表。
+        """
+        text = self.dialogue_text
+        self.transcript_view.close()
+        # 使用者捲動到上方閱讀時不自動捲動，也暫不移除較早的段落
+        at_bottom = text.yview()[1] >= 0.999
+        text.config(state="normal")
+        for new_turn, chunk in segments:
+            if new_turn or not self.turn_marks:
+                self._start_turn_block()
+            if chunk:
+                text.insert(tk.END, chunk)
+        self._trim_scrollback(at_bottom)
+        text.config(state="disabled")
+        if at_bottom:
+            text.see(tk.END) # 自動捲動到最下方
+
+    def _new_mark(self) -> str:
+        self._mark_serial += 1
+        return f"turn{self._mark_serial}"
+
+    def _start_turn_block(self):
+        name = self._new_mark()
+        self.dialogue_text.mark_set(name, "end-1c")
+        self.dialogue_text.mark_gravity(name, "left")
+        self.turn_marks.append(name)
+
+    def _trim_scrollback(self, at_bottom: bool):
+        """
+        段落數超過上限時移除最早的段落，讓插入與排版的成本不隨執行時間增加。
+        使用者不在底部時最多延後到上限的兩倍才移除，並維持目前的畫面位置。
+        """
+        limit = self.scrollback_turns
+        if limit <= 0 or len(self.turn_marks) <= limit or (not at_bottom and len(self.turn_marks) <= limit * 2):
+            return
+        text = self.dialogue_text
+        text.mark_set("scroll_anchor", "@0,0")
+        while len(self.turn_marks) > limit:
+            first = self.turn_marks.popleft()
+            self.hidden_blocks.append(text.get(first, self.turn_marks[0]))
+            text.delete(first, self.turn_marks[0])
+            text.mark_unset(first)
+            if len(self.hidden_blocks) > HIDDEN_BLOCKS_LIMIT:
+                self.hidden_blocks.popleft()
+                self.dropped_turns += 1
+        self._update_banner()
+        if not at_bottom:
+            text.yview("scroll_anchor")
+
+    def _update_banner(self):
+        """(元件需為可編輯狀態) 在最上方顯示被隱藏的段落數，點擊後載回較早的段落。"""
+        text = self.dialogue_text
+        if text.tag_ranges("older_banner"):
+            text.delete("older_banner.first", "older_banner.last")
+        if self.hidden_blocks:
+            banner = f"⋯ 已隱藏較早的 {len(self.hidden_blocks)} 段內容，點此載入 ⋯\n"
+        elif self.dropped_turns:
+            banner = f"⋯ 更早的 {self.dropped_turns} 段內容請至歷史紀錄檢視 ⋯\n"
+        else:
+            return
+        first = self.turn_marks[0]
+        # 提示文字要位於第一段的標記之前，移除段落時才不會被一併刪除
+        text.mark_gravity(first, "right")
+        text.insert("1.0", banner, "older_banner")
+        text.mark_gravity(first, "left")
+
+    def load_older_turns(self, count: int = SCROLLBACK_PAGE_TURNS):
+        """將最近被移除的 count 段內容重新插入到最上方。"""
+        if not self.hidden_blocks or not self.turn_marks:
+            return
+        text = self.dialogue_text
+        text.config(state="normal")
+        for _ in range(min(count, len(self.hidden_blocks))):
+            block = self.hidden_blocks.pop()
+            current = self.turn_marks[0]
+            name = self._new_mark()
+            text.mark_set(name, current)
+            text.mark_gravity(name, "left")
+            text.mark_gravity(current, "right")
+            text.insert(current, block)
+            text.mark_gravity(current, "left")
+            self.turn_marks.appendleft(name)
+        self._update_banner()
+        text.config(state="disabled")
+
+    def _reset_scrollback(self):
+        for name in self.turn_marks:
+            self.dialogue_text.mark_unset(name)
+        self.turn_marks.clear()
+        self.hidden_blocks.clear()
+        self.dropped_turns = 0
+
+    def set_status(self, text: str):
+        """更新狀態列左側的文字 (例如每回合的效能指標)。"""
+        self.status_label.config(text=text)
 
     def clear_dialogue(self):
         """清空對話紀錄區。"""
+        self.transcript_view.close()
+        self._reset_scrollback()
         self.dialogue_text.config(state="normal")
         self.dialogue_text.delete("1.0", tk.END)
         self.dialogue_text.config(state="disabled")
 
+    def show_transcript(self, load_chunk: Callable[[int], Optional[str]]):
+        """以區塊延遲載入的方式在對話紀錄區顯示一份 (可能很長的) 紀錄，見 ChunkedTextView。"""
+        self._reset_scrollback()
+        self.transcript_view.show(load_chunk)
+
     def get_dialogue_content(self) -> str:
         """獲取對話紀錄區的全部內容。"""
         return self.dialogue_text.get("1.0", tk.END)